@@ -0,0 +1,5 @@
+#__main__.py
+"""`python -m benchmarks`: the load harness"""
+from .harness import main
+
+main()
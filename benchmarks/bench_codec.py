@@ -0,0 +1,60 @@
+#bench_codec.py
+"""
+Micro-benchmark of the JSON and binary wire codecs.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_codec --iterations 200000
+"""
+import argparse
+import time
+from typing import Any, Callable, Dict, List
+
+from src.protocol.message import (
+    MsgType, JSON_VERSION, BINARY_VERSION, pack, unpack, pack_binary, unpack_binary
+)
+
+def sample_messages(version: int) -> List[Dict[str, Any]]:
+    """Representative frames: chat, private chat with token, system notice"""
+    token = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "x" * 120
+    return [
+        {"v": version, "t": MsgType.CHAT, "body": "hello everyone", "to": None, "token": token},
+        {"v": version, "t": MsgType.CHAT, "body": "see you at 5?", "to": "alice", "token": token},
+        {"v": version, "t": MsgType.SYS, "body": "User 'bob' joined the chat.", "to": None, "token": None},
+    ]
+
+def measure(func: Callable[[Any], Any], items: List[Any], iterations: int) -> float:
+    """Return operations per second of func over items"""
+    count = len(items)
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(items[i % count])
+    return iterations / (time.perf_counter() - start)
+
+def run(iterations: int) -> List[Dict[str, Any]]:
+    results = []
+    codecs = [
+        ("json", JSON_VERSION, pack, unpack),
+        ("binary", BINARY_VERSION, pack_binary, unpack_binary),
+    ]
+    for name, version, encode, decode in codecs:
+        messages = sample_messages(version)
+        encoded = [encode(m) for m in messages]
+        results.append({
+            "codec": name,
+            "encode_ops": measure(encode, messages, iterations),
+            "decode_ops": measure(decode, encoded, iterations),
+            "bytes_per_msg": sum(len(e) for e in encoded) / len(encoded),
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire codec micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'codec':<8} {'encode ops/s':>14} {'decode ops/s':>14} {'bytes/msg':>10}")
+    for r in run(args.iterations):
+        print(f"{r['codec']:<8} {r['encode_ops']:>14,.0f} {r['decode_ops']:>14,.0f} {r['bytes_per_msg']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#bench_compression.py
+"""
+Bytes saved and CPU spent by per-message compression across message-size
+distributions, with and without the shared chat dictionary, and the cost of
+a compressed broadcast (compressed once, whatever the number of recipients).
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_compression --messages 5000 --recipients 100
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from src.protocol.compression import CHAT_DICTIONARY, COMPRESSED_TAG, Compressor, decompress
+from src.protocol.message import MsgType, BINARY_VERSION, JSON_VERSION, pack
+from src.server.server_state import ServerStateManager
+from .fake_quic import make_protocols
+
+_NAMES = ["alice", "bob", "carol", "dave", "erin", "frank", "grace", "heidi", "ivan", "judy", "mallory", "oscar"]
+_WORDS = ("the a to is it you I and that of for on this what be have with do not are but at so "
+          "we can just if get like about know will there was think me going up out good time "
+          "meeting build release test thanks please tomorrow today link check update fix issue "
+          "deploy server message room everyone morning yes no ok sure great idea problem help").split()
+
+def chat_text(rng: random.Random, low: int, high: int) -> str:
+    text = ""
+    target = rng.randint(low, high)
+    while len(text) < target:
+        text += rng.choice(_WORDS) + " "
+    return text[:target].strip()
+
+def system_text(rng: random.Random) -> str:
+    name = rng.choice(_NAMES)
+    return rng.choice([f"User '{name}' joined the chat.", f"User '{name}' left the chat.",
+                       f"Joined room 'general'.", f"User '{name}' is not online."])
+
+# Name -> generator of (type, body)
+DISTRIBUTIONS = {
+    "short chat": lambda rng: (MsgType.CHAT, f"{rng.choice(_NAMES)}: {chat_text(rng, 5, 40)}"),
+    "medium chat": lambda rng: (MsgType.CHAT, f"{rng.choice(_NAMES)}: {chat_text(rng, 60, 200)}"),
+    "long chat": lambda rng: (MsgType.CHAT, f"{rng.choice(_NAMES)}: {chat_text(rng, 300, 1000)}"),
+    "system": lambda rng: (MsgType.SYS, system_text(rng)),
+    "online list": lambda rng: (MsgType.SYS, "Online users: " + ", ".join(
+        f"{rng.choice(_NAMES)}{rng.randint(1, 999)}" for _ in range(rng.randint(10, 60)))),
+}
+
+def payloads(distribution: str, count: int, version: int) -> list:
+    rng = random.Random(42)
+    generate = DISTRIBUTIONS[distribution]
+    out = []
+    for _ in range(count):
+        msg_type, body = generate(rng)
+        out.append(pack({"v": version, "t": int(msg_type), "body": body, "to": None, "token": None}))
+    return out
+
+def measure(data: list, compressor: Compressor, dictionary: bytes) -> dict:
+    start = time.perf_counter()
+    sent = [compressor.compress(payload) for payload in data]
+    compress_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for payload in sent:
+        if payload[:1] == COMPRESSED_TAG:
+            decompress(payload, dictionary=dictionary)
+    decompress_s = time.perf_counter() - start
+    raw = sum(len(p) for p in data)
+    wire = sum(len(p) for p in sent)
+    return {"raw": raw / len(data), "wire": wire / len(data), "saved": 1 - wire / raw,
+            "compress_us": compress_s / len(data) * 1e6, "decompress_us": decompress_s / len(data) * 1e6}
+
+async def broadcast_cost(recipients: int, rounds: int, compressed: bool) -> tuple:
+    state = ServerStateManager()
+    compressor = Compressor()
+    protocols = make_protocols(state, recipients + 1, compressor=compressor)
+    for protocol in protocols:
+        protocol.writer.framed = True
+        protocol.compressed = compressed
+    sender = protocols[0]
+    body = "hello everyone, the release build is ready for testing, please check it today"
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sender.broadcast_chat_message(body)
+    elapsed = (time.perf_counter() - start) / rounds
+    for protocol in protocols:
+        protocol.scheduler.close()
+    return elapsed, compressor.messages / rounds
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message compression benchmark")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--threshold", type=int, default=64)
+    parser.add_argument("--recipients", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    modes = [
+        ("no dict", lambda: Compressor(threshold=0, dictionary=b""), b""),
+        ("dict", lambda: Compressor(threshold=0), CHAT_DICTIONARY),
+        (f"dict >={args.threshold}B", lambda: Compressor(threshold=args.threshold), CHAT_DICTIONARY),
+    ]
+    for version, label in ((BINARY_VERSION, "binary"), (JSON_VERSION, "json")):
+        print(f"{label} wire format")
+        print(f"{'distribution':>13} {'mode':>11} {'raw B':>7} {'wire B':>7} {'saved':>7} "
+              f"{'compress us':>12} {'inflate us':>11}")
+        for distribution in DISTRIBUTIONS:
+            data = payloads(distribution, args.messages, version)
+            for mode, make, dictionary in modes:
+                r = measure(data, make(), dictionary)
+                print(f"{distribution:>13} {mode:>11} {r['raw']:>7.1f} {r['wire']:>7.1f} {r['saved']:>7.1%} "
+                      f"{r['compress_us']:>12.2f} {r['decompress_us']:>11.2f}")
+        print()
+
+    plain, _ = asyncio.run(broadcast_cost(args.recipients, args.rounds, compressed=False))
+    packed, compressions = asyncio.run(broadcast_cost(args.recipients, args.rounds, compressed=True))
+    print(f"broadcast to {args.recipients}: {plain * 1e6:.1f} us plain, {packed * 1e6:.1f} us compressed, "
+          f"{compressions:.0f} compression(s) per broadcast")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,58 @@
+#bench_fanout.py
+"""
+Benchmark of broadcast cost against room size: one task and one encode per
+recipient (previous behaviour) versus encode-once fan-out.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_fanout --sizes 10 100 1000 5000
+"""
+import argparse
+import asyncio
+import time
+
+from src.protocol.message import MsgType
+from src.server.server_state import ServerStateManager
+from .fake_quic import make_protocols
+
+async def per_task_broadcast(sender, body: str):
+    """Previous implementation: one task and one pack() per recipient"""
+    tasks = [
+        asyncio.create_task(client_info.protocol.async_send(MsgType.CHAT, f"{sender.username}: {body}"))
+        for username, client_info in sender.server_state.clients.items()
+        if username != sender.username
+    ]
+    await asyncio.gather(*tasks)
+
+async def bench_size(size: int, rounds: int) -> dict:
+    state = ServerStateManager()
+    protocols = make_protocols(state, size)
+    sender = protocols[0]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await per_task_broadcast(sender, "hello everyone")
+    per_task = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sender.broadcast_chat_message("hello everyone")
+    fan_out = (time.perf_counter() - start) / rounds
+
+    return {"size": size, "per_task_ms": per_task * 1000, "fan_out_ms": fan_out * 1000}
+
+async def run(sizes, rounds: int):
+    print(f"{'room size':>10} {'per-task ms':>12} {'fan-out ms':>11} {'speedup':>8}")
+    for size in sizes:
+        r = await bench_size(size, rounds)
+        print(f"{r['size']:>10} {r['per_task_ms']:>12.3f} {r['fan_out_ms']:>11.3f} "
+              f"{r['per_task_ms'] / r['fan_out_ms']:>7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast fan-out benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.rounds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#bench_federation.py
+"""
+Cost of crossing between federation nodes.
+
+Part one runs two Federation objects in this process, linked over loopback
+TCP, and pushes `--frames` private messages from one to a user on the other
+in bursts of `--burst`, batched (frames queued in one loop pass share a
+write) and unbatched (a write per frame). Part two starts `--nodes` real
+server nodes on localhost and measures private message latency and
+throughput from a sender on node 0 to a recipient on the same node and to
+one on another node; latency is timed on paced messages, throughput on a
+burst of `--messages`.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_federation --nodes 2 --messages 5000
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from src.protocol.message import MsgType
+from src.server.federation import Federation
+from src.server.server_state import ServerStateManager
+from src.utils.config_loader import load_config
+from .certs import generate_self_signed
+from .harness import LoadClient, Samples, percentiles, run_server, stamp
+from .headless import headless_client
+
+class CountingConnection:
+    """Just enough of a client connection for fan-out: counts frames"""
+    frame_key = ephemeral_key = ("bench", False)
+
+    def __init__(self):
+        self.frames = 0
+
+    def encode_frame(self, msg):
+        return b""
+
+    def send_frame(self, data):
+        self.frames += 1
+
+async def link_run(frames: int, burst: int, batch_delay: float) -> dict:
+    states = [ServerStateManager(), ServerStateManager()]
+    secret = os.urandom(32)
+    nodes = [Federation(i, ("127.0.0.1", 0), {}, states[i], batch_delay=batch_delay, gossip_interval=0,
+                        secret=secret) for i in range(2)]
+    ports = [await node.listen() for node in nodes]
+    nodes[0].add_peer(1, "127.0.0.1", ports[1])
+    nodes[1].add_peer(0, "127.0.0.1", ports[0])
+    bob = CountingConnection()
+    states[1].add_client("bob", bob)
+    try:
+        while not all(node.links[1 - node.node_id].up for node in nodes):
+            await asyncio.sleep(0.01)
+        msg = {"t": int(MsgType.CHAT), "body": "[Private] alice: " + "x" * 40, "to": None, "token": None}
+        started = time.perf_counter()
+        for first in range(0, frames, burst):
+            for _ in range(min(burst, frames - first)):
+                nodes[0].send_private(1, "bob", msg)
+            await asyncio.sleep(0)
+        while bob.frames < frames:
+            await asyncio.sleep(0.001)
+        seconds = time.perf_counter() - started
+        link = nodes[0].links[1]
+        return {"per_second": frames / seconds, "writes": link.writes, "per_write": link.frames_sent / link.writes}
+    finally:
+        for node in nodes:
+            node.close()
+        await asyncio.sleep(0.01)
+
+async def wait_for(condition, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Timed out waiting for deliveries")
+        await asyncio.sleep(0.005)
+
+async def node_run(ports: list, opts: argparse.Namespace) -> dict:
+    from contextlib import AsyncExitStack
+
+    async with AsyncExitStack() as stack:
+        async def open_client(port, username):
+            client = await stack.enter_async_context(headless_client("127.0.0.1", port, client_class=LoadClient))
+            await client.login(username)
+            return client
+
+        sender = await open_client(ports[0], "alice")
+        recipients = {"same node": await open_client(ports[0], "bob"),
+                      "cross node": await open_client(ports[-1], "carol")}
+        await asyncio.sleep(1.0)  # Let presence reach every node
+
+        results = {}
+        for route, recipient in recipients.items():
+            username = "bob" if route == "same node" else "carol"
+            LoadClient.samples = samples = Samples()
+            for n in range(opts.pings):
+                await sender.chat(f"ping {stamp()}", to=username)
+                await asyncio.sleep(opts.ping_interval)
+            await wait_for(lambda: samples.count >= opts.pings, 30)
+            latency = percentiles(samples.values)
+
+            LoadClient.samples = Samples()
+            received = recipient.received
+            started = time.perf_counter()
+            for n in range(opts.messages):
+                await sender.chat(f"burst {n} {stamp()}", to=username)
+                if n % 100 == 99:
+                    await asyncio.sleep(0)
+            await wait_for(lambda: recipient.received - received >= opts.messages, 120)
+            seconds = time.perf_counter() - started
+            results[route] = dict(latency, per_second=opts.messages / seconds,
+                                  burst_p99=percentiles(LoadClient.samples.values)["p99"])
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Federation latency and throughput benchmark")
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=200000, help="Messages over the in-process link")
+    parser.add_argument("--burst", type=int, default=100, help="Messages queued per loop pass on the link")
+    parser.add_argument("--pings", type=int, default=500, help="Paced messages timed per route")
+    parser.add_argument("--ping-interval", type=float, default=0.002)
+    parser.add_argument("--messages", type=int, default=5000, help="Burst size for throughput per route")
+    parser.add_argument("--port", type=int, default=4460)
+    parser.add_argument("--federation-port", type=int, default=7460)
+    parser.add_argument("--server-startup", type=float, default=2.0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"node-to-node link, {args.frames} messages in bursts of {args.burst}")
+    print(f"{'link':>10} {'msgs/s':>10} {'writes':>8} {'msgs/write':>11}")
+    for label, batch_delay in (("batched", 0.0), ("unbatched", -1.0)):
+        r = asyncio.run(link_run(args.frames, args.burst, batch_delay))
+        print(f"{label:>10} {r['per_second']:>10,.0f} {r['writes']:>8} {r['per_write']:>11.1f}")
+
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    context = multiprocessing.get_context("spawn")
+    cert, key = generate_self_signed(directory)
+    os.makedirs(os.path.join(directory, "bus"))
+    addresses = {str(i): f"127.0.0.1:{args.federation_port + i}" for i in range(args.nodes)}
+    ports = [args.port + i for i in range(args.nodes)]
+    secret = os.urandom(32).hex()  # Tokens are accepted on every node, and the nodes admit each other
+    servers = []
+    for i in range(args.nodes):
+        config = dict(load_config("server"), host="127.0.0.1", port=ports[i], cert_path=cert, key_path=key,
+                      workers=1, bcrypt_rounds=4, history_dir=None, mailbox_spill_dir=None, metrics_port=0,
+                      user_store_path=os.path.join(directory, "users.db"), auth_secret=secret,
+                      rate_limiting=False,
+                      handshake_admission=False, federation=True, federation_node_id=i, federation_secret=secret,
+                      federation_listen=addresses[str(i)],
+                      federation_peers={node: address for node, address in addresses.items() if node != str(i)})
+        servers.append(context.Process(target=run_server, args=(config, 0, os.path.join(directory, "bus"))))
+    try:
+        for server in servers:
+            server.start()
+        time.sleep(args.server_startup)
+        results = asyncio.run(node_run(ports, args))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"\n{args.nodes} nodes on localhost; {args.pings} paced messages for latency, "
+          f"{args.messages} for throughput")
+    print(f"{'route':>11} {'p50 ms':>8} {'p99 ms':>8} {'msgs/s':>9} {'burst p99':>10}")
+    for route, r in results.items():
+        print(f"{route:>11} {r['p50']:>8.2f} {r['p99']:>8.2f} {r['per_second']:>9,.0f} {r['burst_p99']:>8.1f}ms")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
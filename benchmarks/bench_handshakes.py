@@ -0,0 +1,150 @@
+#bench_handshakes.py
+"""
+Handshake throughput and the cost of a connection flood to clients already
+connected.
+
+For each certificate key type and admission option, a server on loopback
+takes a flood of `--concurrency` clients opening QUIC connections back to
+back (full handshakes, no login) for `--seconds`, while one logged-in
+client measures its QUIC ping round trip. Reported: completed handshakes
+per second, server CPU per handshake, and the connected client's ping
+latency.
+
+Admission options:
+
+    off      no admission control
+    cap      at most --max-handshakes in flight, no per-address limit
+    retry    the cap, and a Retry round trip for every new connection
+    default  the server's configured defaults; the flood comes from a
+             single address, so the per-address rate caps it
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_handshakes --keys ec rsa2048 rsa4096 --seconds 5
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from aioquic.asyncio.client import connect
+from aioquic.quic.configuration import QuicConfiguration
+
+from src.client.client import ChatClient
+from src.server.admission import RETRY_ALWAYS, RETRY_NEVER
+from src.utils.config_loader import load_config
+from .certs import generate_self_signed
+from .harness import process_cpu_seconds, run_server
+
+KEYS = ("ec", "rsa2048", "rsa4096")
+OPTIONS = ("off", "cap", "retry", "default")
+
+def admission_config(option: str, max_handshakes: int) -> dict:
+    if option == "off":
+        return {"handshake_admission": False}
+    if option == "cap":
+        return {"max_handshakes": max_handshakes, "handshake_rate_per_ip": 0, "retry": RETRY_NEVER}
+    if option == "retry":
+        return {"max_handshakes": max_handshakes, "handshake_rate_per_ip": 0, "retry": RETRY_ALWAYS}
+    return {}
+
+async def flood(port: int, deadline: float, configuration: QuicConfiguration, counts: dict) -> None:
+    """Open connections one after another until the deadline"""
+    while time.perf_counter() < deadline:
+        try:
+            async with connect("127.0.0.1", port, configuration=configuration, wait_connected=False) as protocol:
+                await asyncio.wait_for(protocol.wait_connected(), max(0.1, deadline - time.perf_counter()))
+                counts["handshakes"] += 1
+        except (asyncio.TimeoutError, ConnectionError):
+            counts["failed"] += 1
+
+async def pinger(client: ChatClient, rtts: list, interval: float) -> None:
+    while True:
+        started = time.perf_counter()
+        await client.protocol.ping()
+        rtts.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+async def handshake_run(port: int, pid: int, opts: argparse.Namespace) -> dict:
+    configuration = QuicConfiguration(is_client=True, alpn_protocols=["chat/2"], verify_mode=0)
+    client = ChatClient("127.0.0.1", port)
+    await client.connect()
+    if not await client.login("watcher", "secret", timeout=30):
+        raise RuntimeError("Login failed")
+    rtts = []
+    ping_task = asyncio.create_task(pinger(client, rtts, 0.05))
+    try:
+        await asyncio.sleep(1.0)
+        idle = sorted(rtts)
+        rtts.clear()
+
+        counts = {"handshakes": 0, "failed": 0}
+        cpu_before = process_cpu_seconds(pid)
+        started = time.perf_counter()
+        deadline = started + opts.seconds
+        await asyncio.gather(*(flood(port, deadline, configuration, counts) for _ in range(opts.concurrency)))
+        seconds = time.perf_counter() - started
+        cpu = process_cpu_seconds(pid) - cpu_before
+    finally:
+        ping_task.cancel()
+        await client.close()
+
+    busy = sorted(rtts) or [float("nan")]
+    return {
+        "per_second": counts["handshakes"] / seconds,
+        "cpu_ms": cpu / counts["handshakes"] * 1e3 if counts["handshakes"] else float("nan"),
+        "cpu_percent": cpu / seconds * 100,
+        "failed": counts["failed"],
+        "idle_p50": statistics.median(idle) * 1e3,
+        "p50": statistics.median(busy) * 1e3,
+        "p99": busy[int(len(busy) * 0.99)] * 1e3 if rtts else float("nan"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Handshake admission benchmark")
+    parser.add_argument("--keys", nargs="+", choices=KEYS, default=list(KEYS))
+    parser.add_argument("--options", nargs="+", choices=OPTIONS, default=list(OPTIONS))
+    parser.add_argument("--concurrency", type=int, default=64, help="Connections being opened at once")
+    parser.add_argument("--max-handshakes", type=int, default=16, help="Cap for the cap and retry options")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=4456)
+    parser.add_argument("--server-startup", type=float, default=2.0)
+    args = parser.parse_args()
+    # Aborted connection attempts leave unretrieved ConnectionErrors in aioquic's waiters
+    logging.disable(logging.CRITICAL)
+
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    context = multiprocessing.get_context("spawn")
+    os.makedirs(os.path.join(directory, "bus"))
+    print(f"{args.concurrency} connections opened at once for {args.seconds:g}s; ping RTT of one connected client")
+    print(f"{'key':>8} {'admission':>9} {'hs/s':>7} {'CPU ms/hs':>10} {'CPU':>6} {'failed':>7} "
+          f"{'idle p50':>9} {'flood p50':>10} {'flood p99':>10}")
+    try:
+        for key_type in args.keys:
+            cert, key = generate_self_signed(directory, key_type)
+            for option in args.options:
+                config = dict(load_config("server"), host="127.0.0.1", port=args.port, cert_path=cert, key_path=key,
+                              workers=1, bcrypt_rounds=4, history_dir=None, mailbox_spill_dir=None, metrics_port=0,
+                              user_store_path=os.path.join(directory, f"users-{key_type}-{option}.db"),
+                              auth_secret=os.urandom(32).hex(),
+                              rate_limiting=False, **admission_config(option, args.max_handshakes))
+                server = context.Process(target=run_server, args=(config, 0, os.path.join(directory, "bus")))
+                server.start()
+                try:
+                    time.sleep(args.server_startup)
+                    r = asyncio.run(handshake_run(args.port, server.pid, args))
+                finally:
+                    server.terminate()
+                    server.join()
+                print(f"{key_type:>8} {option:>9} {r['per_second']:>7.0f} {r['cpu_ms']:>10.2f} "
+                      f"{r['cpu_percent']:>5.0f}% {r['failed']:>7} {r['idle_p50']:>7.2f}ms "
+                      f"{r['p50']:>8.2f}ms {r['p99']:>8.2f}ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
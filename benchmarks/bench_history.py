@@ -0,0 +1,71 @@
+#bench_history.py
+"""
+Message history: append rate and range-read latency.
+
+Appends N chat messages (time spent on the caller's thread, then until the
+writer thread has them on disk), then reads pages starting at random
+sequence numbers through the sparse index and mmap.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_history --records 100000 1000000
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from src.protocol.message import MsgType
+from src.server.history import HistoryStore, encode_entry
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(records: int, page: int, reads: int, index_interval: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="chat-history-") as directory:
+        store = HistoryStore(directory, index_interval=index_interval)
+        payloads = [
+            encode_entry({"t": int(MsgType.CHAT), "body": f"user{i % 100}: message number {i}"}, f"user{i % 100}")
+            for i in range(min(records, 1000))
+        ]
+
+        start = time.perf_counter()
+        for i in range(records):
+            store.append(payloads[i % len(payloads)])
+        appended = time.perf_counter() - start
+        store.flush(timeout=600)
+        durable = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(reads):
+            seq = random.randint(1, max(1, records - page))
+            t0 = time.perf_counter()
+            result = store.read(seq, page)
+            latencies.append((time.perf_counter() - t0) * 1e6)
+            assert result and result[0][0] == seq
+        store.close()
+
+    return {
+        "append_per_s": records / appended,
+        "durable_per_s": records / durable,
+        "p50_us": statistics.median(latencies),
+        "p99_us": percentile(latencies, 99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Message history benchmark")
+    parser.add_argument("--records", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--index-interval", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'records':>10} {'append/s':>12} {'on disk/s':>12} {'read p50 us':>12} {'read p99 us':>12}")
+    for records in args.records:
+        r = run(records, args.page, args.reads, args.index_interval)
+        print(f"{records:>10,} {r['append_per_s']:>12,.0f} {r['durable_per_s']:>12,.0f} "
+              f"{r['p50_us']:>12.1f} {r['p99_us']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#bench_idle.py
+"""
+CPU cost of idle connections.
+
+Part one opens `--clients` logged-in connections to a server on loopback
+and measures the server's CPU while they only keep alive, once per
+keep-alive style:
+
+    none      nothing sent; QUIC and the reaper's timer only
+    sys       the old SYS "ping" on a new stream per ping
+    datagram  an application PING sent as a QUIC DATAGRAM
+    quic      a QUIC PING frame, answered by the QUIC stack alone
+
+The interval is short so a few seconds stand in for minutes of idling.
+Part two times the idle reaper's timer wheel against scanning every
+connection on every tick.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_idle --clients 300 --interval 1 --seconds 10
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from src.client.client import ChatClient
+from src.protocol.framing import STREAM_MODE_PER_MESSAGE, STREAM_MODE_SESSION
+from src.protocol.message import MsgType
+from src.server.reaper import IdleReaper
+from src.server.server_state import ServerStateManager
+from src.utils.config_loader import load_config
+from .certs import generate_self_signed
+from .harness import process_cpu_seconds, run_server
+
+MODES = ("none", "sys", "datagram", "quic")
+
+async def pinger(client: ChatClient, mode: str, interval: float) -> None:
+    await asyncio.sleep(random.uniform(0, interval))  # Spread the pings over the interval
+    while True:
+        if mode == "sys":
+            client.protocol.write({"t": MsgType.SYS, "body": "ping"})
+        else:
+            client.ping()
+        await asyncio.sleep(interval)
+
+async def idle_run(port: int, pid: int, mode: str, opts: argparse.Namespace) -> dict:
+    clients = [
+        ChatClient("127.0.0.1", port, stream_mode=STREAM_MODE_PER_MESSAGE if mode == "sys" else STREAM_MODE_SESSION,
+                   compression=False, keep_alive_interval=opts.interval if mode == "quic" else None,
+                   idle_timeout=opts.idle_timeout)
+        for _ in range(opts.clients)
+    ]
+    tasks = []
+
+    async def open_client(i: int, client: ChatClient) -> None:
+        await client.connect()
+        if not await client.login(f"{mode}{i}", "secret", timeout=60):
+            raise RuntimeError(f"Login failed for client {i}")
+
+    try:
+        # Every login is announced to everyone online; batches let those announcements coalesce
+        for first in range(0, len(clients), opts.login_batch):
+            await asyncio.gather(*(open_client(i, clients[i])
+                                   for i in range(first, min(first + opts.login_batch, len(clients)))))
+        tasks = [asyncio.create_task(pinger(client, mode, opts.interval))
+                 for client in clients if mode in ("sys", "datagram")]
+        await asyncio.sleep(opts.interval * 2)  # Let presence traffic from the logins settle
+
+        cpu_before = process_cpu_seconds(pid)
+        started = time.perf_counter()
+        await asyncio.sleep(opts.seconds)
+        seconds = time.perf_counter() - started
+        cpu = process_cpu_seconds(pid) - cpu_before
+        closed = sum(client.protocol._closed.is_set() for client in clients)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Each close waits out QUIC's draining period, so close them together
+        await asyncio.gather(*(client.close() for client in clients))
+    pings = opts.clients * seconds / opts.interval if mode != "none" else 0
+    return {"cpu_percent": cpu / seconds * 100, "us_per_ping": cpu / pings * 1e6 if pings else None,
+            "closed": closed}
+
+class IdleSession:
+    """Just enough of a connection for the reaper"""
+    def __init__(self, now: float, username: str):
+        self.connected_at = self.last_seen = now
+        self.username = username
+        self._closed = asyncio.Event()
+
+async def reaper_cost(connections: int, idle_timeout: float, tick: float) -> tuple:
+    """Seconds of CPU per simulated second: timer wheel, and a scan of every connection per tick"""
+    loop = asyncio.get_running_loop()
+    reaper = IdleReaper(ServerStateManager(), idle_timeout=idle_timeout, auth_timeout=idle_timeout, tick=tick,
+                        slots=int(idle_timeout / tick) + 2)
+    sessions = [IdleSession(loop.time(), f"user{i}") for i in range(connections)]
+    for session in sessions:
+        reaper.watch(session)
+    reaper.close()
+    ticks = int(idle_timeout / tick) * 3
+
+    elapsed = 0.0
+    for _ in range(ticks):
+        now = loop.time()
+        for session in sessions:
+            session.last_seen = now  # Everyone stays alive, as with keep-alive
+        started = time.perf_counter()
+        reaper.tick()
+        elapsed += time.perf_counter() - started
+    reaper.close()
+    wheel = elapsed / (ticks * tick)
+
+    started = time.perf_counter()
+    for _ in range(ticks):
+        now = loop.time()
+        [session for session in sessions
+         if session._closed.is_set() or now - session.last_seen >= idle_timeout]
+    scan = (time.perf_counter() - started) / (ticks * tick)
+    return wheel, scan
+
+def main():
+    parser = argparse.ArgumentParser(description="Idle connection CPU benchmark")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--interval", type=float, default=1.0, help="Keep-alive interval in seconds")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Measurement window per mode")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--login-batch", type=int, default=100)
+    parser.add_argument("--port", type=int, default=4455)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--reaper-connections", type=int, default=50000)
+    parser.add_argument("--reaper-idle-timeout", type=float, default=90.0)
+    parser.add_argument("--server-startup", type=float, default=2.0)
+    args = parser.parse_args()
+    args.idle_timeout = max(60.0, args.interval * 4)
+    logging.disable(logging.INFO)
+
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    context = multiprocessing.get_context("spawn")
+    cert, key = generate_self_signed(directory)
+    config = dict(load_config("server"), host="127.0.0.1", port=args.port, cert_path=cert, key_path=key,
+                  workers=1, bcrypt_rounds=args.bcrypt_rounds, history_dir=None, mailbox_spill_dir=None,
+                  user_store_path=os.path.join(directory, "users.db"), auth_secret=os.urandom(32).hex(),
+                  metrics_port=0, idle_timeout=args.idle_timeout, handshake_admission=False)
+    os.makedirs(os.path.join(directory, "bus"))
+
+    print(f"{args.clients} idle clients, keep-alive every {args.interval:g}s, {args.seconds:g}s per mode")
+    print(f"{'mode':>9} {'server CPU':>11} {'us/ping':>9} {'closed':>7}")
+    try:
+        for mode in args.modes:
+            # A fresh server per mode, so earlier connections cannot linger
+            server = context.Process(target=run_server, args=(config, 0, os.path.join(directory, "bus")))
+            server.start()
+            try:
+                time.sleep(args.server_startup)
+                r = asyncio.run(idle_run(args.port, server.pid, mode, args))
+            finally:
+                server.terminate()
+                server.join()
+            us = f"{r['us_per_ping']:.1f}" if r["us_per_ping"] is not None else "-"
+            print(f"{mode:>9} {r['cpu_percent']:>10.2f}% {us:>9} {r['closed']:>7}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    wheel, scan = asyncio.run(reaper_cost(args.reaper_connections, args.reaper_idle_timeout, 1.0))
+    print(f"\nreaper over {args.reaper_connections} connections ({args.reaper_idle_timeout:g}s idle timeout, 1s tick): "
+          f"wheel {wheel * 1e3:.3f} ms/s, full scan {scan * 1e3:.3f} ms/s")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+#bench_login_storm.py
+"""
+Login storm: N clients send AUTH_REQ at the same moment while a ticker
+measures how late the event loop wakes up. Compares bcrypt on the loop
+thread ("inline") with the thread and process pools.
+
+Join/online-user broadcasts are disabled so only authentication cost is
+measured.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_login_storm --clients 1000 --rounds 6
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from src.protocol.auth import AuthManager
+from src.protocol.message import MsgType, pack
+from src.server.auth_service import AuthService, EXECUTOR_INLINE, EXECUTOR_PROCESS, EXECUTOR_THREAD
+from src.server.chat_server import ChatProtocol
+from src.server.server_state import ServerStateManager
+from .fake_quic import FakeQuic
+
+class QuietProtocol(ChatProtocol):
+    """ChatProtocol without join broadcasts, over a connection taken as established"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handshake_complete = True
+
+    def broadcast_system_message(self, message: str):
+        pass
+
+async def measure_lag(interval: float, lags: list, stop: asyncio.Event):
+    """Record how late each wake-up of a periodic timer is"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+async def storm(executor: str, clients: int, rounds: int, workers: int) -> dict:
+    state = ServerStateManager()
+    service = AuthService(AuthManager(bcrypt_rounds=rounds), executor=executor, max_workers=workers)
+    protocols = [QuietProtocol(FakeQuic(), server_state=state, auth_service=service) for _ in range(clients)]
+
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(0.001, lags, stop))
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    for i, protocol in enumerate(protocols):
+        protocol.handle_payload(pack({"v": 1, "t": MsgType.AUTH_REQ, "to": f"user{i}", "body": "secret"}))
+    while len(state.clients) < clients:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    service.shutdown()
+    lags.sort()
+    return {
+        "executor": executor,
+        "seconds": elapsed,
+        "lag_p50_ms": statistics.median(lags) * 1000,
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+    }
+
+async def run(clients: int, rounds: int, workers: int):
+    print(f"{'executor':<8} {'seconds':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for executor in (EXECUTOR_INLINE, EXECUTOR_THREAD, EXECUTOR_PROCESS):
+        r = await storm(executor, clients, rounds, workers)
+        print(f"{r['executor']:<8} {r['seconds']:>8.2f} {r['lag_p50_ms']:>11.2f} "
+              f"{r['lag_p99_ms']:>11.2f} {r['lag_max_ms']:>11.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Login storm benchmark")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=6, help="bcrypt work factor")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.clients, args.rounds, args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#bench_metrics.py
+"""
+Overhead of the metrics instruments on the message path: a chat message
+goes through quic_event_received, handle_stream_data and a broadcast to R
+recipients, with the real registry and with instruments that do nothing.
+The cost of each instrument operation is measured on its own as well.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_metrics --recipients 1 10 100 --messages 20000
+"""
+import argparse
+import asyncio
+import time
+import timeit
+
+from aioquic.quic.events import StreamDataReceived
+
+from src.protocol.framing import frame
+from src.protocol.message import MsgType, BINARY_VERSION, pack
+from src.server.metrics import ServerMetrics
+from src.server.server_state import ServerStateManager
+from src.utils.metrics import MetricsRegistry
+from .fake_quic import make_protocols
+
+class _Noop:
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+class NullMetrics:
+    """Stand-in with the same instruments as ServerMetrics, all empty methods"""
+    def __init__(self):
+        noop = _Noop()
+        for name in vars(ServerMetrics()):
+            setattr(self, name, noop)
+
+def run_path(metrics, recipients: int, messages: int) -> float:
+    """Seconds per message through the receive and broadcast path"""
+    async def scenario():
+        state = ServerStateManager()
+        protocols = make_protocols(state, recipients + 1, metrics=metrics)
+        sender = protocols[0]
+        data = frame(pack({"v": BINARY_VERSION, "t": int(MsgType.CHAT), "body": "hello everyone",
+                           "to": None, "token": None}))
+        events = [StreamDataReceived(data=data, end_stream=False, stream_id=0) for _ in range(messages)]
+        start = time.perf_counter()
+        for event in events:
+            sender.quic_event_received(event)
+        elapsed = time.perf_counter() - start
+        for protocol in protocols:
+            protocol.scheduler.close()
+        return elapsed / messages
+
+    return asyncio.run(scenario())
+
+def instrument_costs(number: int) -> dict:
+    """Nanoseconds per instrument operation"""
+    registry = MetricsRegistry()
+    counter = registry.counter("c")
+    histogram = registry.histogram("h")
+    now = time.perf_counter
+    return {
+        "counter.inc": timeit.timeit(counter.inc, number=number) / number * 1e9,
+        "histogram.observe": timeit.timeit(lambda: histogram.observe(0.0003), number=number) / number * 1e9,
+        "perf_counter": timeit.timeit(now, number=number) / number * 1e9,
+        "empty call": timeit.timeit(lambda: None, number=number) / number * 1e9,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics overhead benchmark")
+    parser.add_argument("--recipients", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--ops", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'operation':>18} {'ns':>7}")
+    for name, ns in instrument_costs(args.ops).items():
+        print(f"{name:>18} {ns:>7.1f}")
+    print()
+
+    print(f"{'recipients':>10} {'no-op us/msg':>13} {'metrics us/msg':>15} {'overhead us':>12} {'overhead':>9}")
+    for recipients in args.recipients:
+        # Alternate both sides and keep the best run of each to shave off scheduling noise
+        messages = max(args.messages // max(recipients, 1), 200)
+        bare, metered = float("inf"), float("inf")
+        for _ in range(args.repeat):
+            bare = min(bare, run_path(NullMetrics(), recipients, messages))
+            metered = min(metered, run_path(ServerMetrics(), recipients, messages))
+        print(f"{recipients:>10} {bare * 1e6:>13.2f} {metered * 1e6:>15.2f} "
+              f"{(metered - bare) * 1e6:>12.2f} {(metered - bare) / bare:>8.1%}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
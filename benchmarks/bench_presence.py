@@ -0,0 +1,70 @@
+#bench_presence.py
+"""
+Reconnect storm: N users join back to back. Compares sending the full
+online-user list after every join (previous behaviour) with per-event
+presence deltas and with deltas coalesced over a window.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_presence --users 500 2000
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from src.protocol.message import MsgType
+from src.server.chat_server import ChatProtocol
+from src.server.fanout import fan_out
+from src.server.presence import PresenceBroadcaster
+from src.server.server_state import ServerStateManager
+from .fake_quic import FakeQuic
+
+def full_list_join(state: ServerStateManager, protocol: ChatProtocol):
+    """Previous behaviour: every join sends the whole list to everyone"""
+    state.add_client(protocol.username, protocol)
+    online_list = ", ".join(state.get_online_users())
+    fan_out((c.protocol for c in state.clients.values()),
+            {"t": int(MsgType.SYS), "body": f"Online users: {online_list}", "to": None, "token": None})
+
+async def storm(users: int, strategy: str) -> dict:
+    state = ServerStateManager()
+    presence = PresenceBroadcaster(state, window=0 if strategy == "delta" else 0.05)
+    protocols = []
+    for i in range(users):
+        protocol = ChatProtocol(FakeQuic(), server_state=state, presence=presence)
+        protocol.username = f"user{i}"
+        protocols.append(protocol)
+
+    start = time.perf_counter()
+    for protocol in protocols:
+        if strategy == "full-list":
+            full_list_join(state, protocol)
+        else:
+            state.add_client(protocol.username, protocol)
+            protocol.notify_presence_change()
+    presence.flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "strategy": strategy,
+        "ms": elapsed * 1000,
+        "frames": sum(p._quic.frames_sent for p in protocols),
+        "bytes": sum(p._quic.bytes_sent for p in protocols),
+    }
+
+async def run(sizes):
+    print(f"{'users':>6} {'strategy':<10} {'ms':>10} {'frames':>10} {'bytes':>14}")
+    for users in sizes:
+        for strategy in ("full-list", "delta", "coalesced"):
+            r = await storm(users, strategy)
+            print(f"{users:>6} {r['strategy']:<10} {r['ms']:>10.1f} {r['frames']:>10,} {r['bytes']:>14,}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Presence broadcast benchmark")
+    parser.add_argument("--users", type=int, nargs="+", default=[500, 2000])
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.users))
+
+if __name__ == "__main__":
+    main()
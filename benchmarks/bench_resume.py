@@ -0,0 +1,103 @@
+#bench_resume.py
+"""
+Reconnect time-to-first-message: a full TLS handshake plus bcrypt password
+login, versus TLS resumption with the login token sent as 0-RTT early data.
+Each sample connects, authenticates and waits for AUTH_OK.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_resume --reconnects 20 --bcrypt-rounds 12
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import tempfile
+import time
+
+from aioquic.asyncio import connect, serve
+from aioquic.quic.configuration import QuicConfiguration
+
+from src.protocol.auth import AuthManager
+from src.protocol.message import ALPN_BINARY, BINARY_VERSION, MsgType
+from src.server.auth_service import AuthService
+from src.server.chat_server import ChatProtocol
+from src.server.server_state import ServerStateManager
+from src.server.tickets import SessionTicketStore
+from .certs import generate_self_signed
+from .headless import HeadlessClient
+
+async def reconnect(port: int, username: str, token=None, ticket=None) -> tuple:
+    """Connect and authenticate once; returns (seconds to AUTH_OK, new ticket, token, early data accepted)"""
+    configuration = QuicConfiguration(is_client=True, alpn_protocols=[ALPN_BINARY], server_name="localhost")
+    configuration.verify_mode = 0
+    configuration.session_ticket = ticket
+    tickets = []
+    early = []
+
+    class Client(HeadlessClient):
+        def quic_event_received(self, event):
+            if hasattr(event, "early_data_accepted"):
+                early.append(event.early_data_accepted)
+            super().quic_event_received(event)
+
+    start = time.perf_counter()
+    async with connect("127.0.0.1", port, configuration=configuration, create_protocol=Client,
+                       session_ticket_handler=tickets.append, wait_connected=ticket is None) as client:
+        client.wire_version = BINARY_VERSION
+        await client.send_message({"v": BINARY_VERSION, "t": MsgType.AUTH_REQ, "to": username,
+                                   "body": None if token else "secret", "token": token})
+        await asyncio.wait_for(client.authenticated.wait(), 30)
+        elapsed = time.perf_counter() - start
+        for _ in range(100):  # The ticket follows the handshake
+            if tickets:
+                break
+            await asyncio.sleep(0.01)
+        return elapsed, tickets[-1] if tickets else None, client.token, bool(early and early[0])
+
+async def run(reconnects: int, bcrypt_rounds: int, port: int):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = generate_self_signed(directory)
+        server_config = QuicConfiguration(is_client=False, alpn_protocols=[ALPN_BINARY])
+        server_config.load_cert_chain(cert, key)
+        state = ServerStateManager()
+        auth_service = AuthService(AuthManager(bcrypt_rounds=bcrypt_rounds))
+        store = SessionTicketStore()
+        server = await serve(
+            "127.0.0.1", port, configuration=server_config,
+            create_protocol=lambda *args, **kwargs: ChatProtocol(
+                *args, server_state=state, auth_service=auth_service, **kwargs
+            ),
+            session_ticket_fetcher=store.pop,
+            session_ticket_handler=store.add,
+        )
+        try:
+            # Registration happens on the very first login
+            _, ticket, token, _ = await reconnect(port, "alice")
+            fresh, resumed, early = [], [], 0
+            for _ in range(reconnects):
+                elapsed, _, _, _ = await reconnect(port, "alice")
+                fresh.append(elapsed)
+                elapsed, ticket, token, accepted = await reconnect(port, "alice", token=token, ticket=ticket)
+                resumed.append(elapsed)
+                early += accepted
+        finally:
+            server.close()
+            auth_service.shutdown()
+
+    print(f"{reconnects} reconnects, bcrypt cost {bcrypt_rounds}; 0-RTT accepted {early}/{reconnects}")
+    print(f"{'mode':<10} {'p50 ms':>8} {'mean ms':>8} {'max ms':>8}")
+    for name, samples in (("fresh", fresh), ("resumed", resumed)):
+        print(f"{name:<10} {statistics.median(samples) * 1000:>8.2f} {statistics.mean(samples) * 1000:>8.2f} "
+              f"{max(samples) * 1000:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Session resumption benchmark")
+    parser.add_argument("--reconnects", type=int, default=20)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--port", type=int, default=14453)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.reconnects, args.bcrypt_rounds, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#bench_rooms.py
+"""
+Room fan-out: U users spread over R rooms, each user in K rooms. Compares
+the cost of one room message with one global broadcast, which is what every
+message cost before rooms existed.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_rooms --rooms 100 --users 1000 --rooms-per-user 3
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from src.server.server_state import ServerStateManager
+from .fake_quic import make_protocols
+
+def sent_frames(protocols) -> int:
+    return sum(p._quic.frames_sent for p in protocols)
+
+async def run(rooms: int, users: int, rooms_per_user: int, messages: int):
+    rng = random.Random(42)
+    state = ServerStateManager()
+    protocols = make_protocols(state, users)
+    room_names = [f"room{i}" for i in range(rooms)]
+    for protocol in protocols:
+        for room in rng.sample(room_names, rooms_per_user):
+            state.join_room(protocol.username, room)
+
+    senders = [rng.choice(protocols) for _ in range(messages)]
+
+    start = time.perf_counter()
+    for sender in senders:
+        sender.broadcast_chat_message("hello everyone")
+    global_s = time.perf_counter() - start
+    global_frames = sent_frames(protocols)
+
+    start = time.perf_counter()
+    for sender in senders:
+        sender.broadcast_room_message(rng.choice(sorted(state.user_rooms[sender.username])), "hello room")
+    room_s = time.perf_counter() - start
+    room_frames = sent_frames(protocols) - global_frames
+
+    print(f"{rooms} rooms x {users} users, {rooms_per_user} rooms per user, {messages} messages")
+    print(f"{'mode':<8} {'us/msg':>10} {'frames/msg':>11}")
+    print(f"{'global':<8} {global_s / messages * 1e6:>10.1f} {global_frames / messages:>11.1f}")
+    print(f"{'room':<8} {room_s / messages * 1e6:>10.1f} {room_frames / messages:>11.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Room fan-out benchmark")
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rooms-per-user", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.rooms, args.users, args.rooms_per_user, args.messages))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#bench_sessions.py
+"""
+Memory of the server's session table.
+
+Registers N simulated sessions in the previous layout (a dataclass per
+client holding its own StateManager, whose transitions were a dict rebuilt
+on every call) and in the current one (slotted ClientInfo records with a
+small-int state, one shared username string and integer session ids), and
+reports the bytes each session adds to the table, measured with tracemalloc.
+Usernames are decoded from wire bytes as they are at login; the protocol
+objects, which dwarf either layout, are shared and not counted.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_sessions --sessions 10000 100000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Optional
+
+from src.protocol.states import ConnectionState
+from src.server.server_state import ClientInfo, ServerStateManager
+
+class LegacyState(Enum):
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    AUTHENTICATING = "authenticating"
+    AUTHENTICATED = "authenticated"
+    ERROR = "error"
+
+class LegacyStateManager:
+    """Previous StateManager: per-instance dict, transition table built per call"""
+    def __init__(self):
+        self.state = LegacyState.DISCONNECTED
+        self.error_message: Optional[str] = None
+
+    def transition_to(self, new_state: LegacyState, error_msg: str = None) -> bool:
+        valid_transitions = {
+            LegacyState.DISCONNECTED: [LegacyState.CONNECTING],
+            LegacyState.CONNECTING: [LegacyState.AUTHENTICATING, LegacyState.ERROR],
+            LegacyState.AUTHENTICATING: [LegacyState.AUTHENTICATED, LegacyState.ERROR],
+            LegacyState.AUTHENTICATED: [LegacyState.DISCONNECTED, LegacyState.ERROR],
+            LegacyState.ERROR: [LegacyState.DISCONNECTED],
+        }
+        if new_state in valid_transitions[self.state]:
+            self.state = new_state
+            self.error_message = error_msg if new_state == LegacyState.ERROR else None
+            return True
+        return False
+
+@dataclass
+class LegacyClientInfo:
+    username: str
+    protocol: object
+    state: LegacyStateManager
+    token: Optional[str] = None
+    outbound: Optional[object] = None
+
+def legacy_table(names: list, protocol: object) -> Dict[str, LegacyClientInfo]:
+    clients = {}
+    for raw in names:
+        username = raw.decode("utf-8")
+        clients[username] = LegacyClientInfo(username=username, protocol=protocol, state=LegacyStateManager())
+        state = clients[username].state
+        state.transition_to(LegacyState.CONNECTING)
+        state.transition_to(LegacyState.AUTHENTICATING)
+        state.transition_to(LegacyState.AUTHENTICATED)
+    return clients
+
+def slot_table(names: list, protocol: object) -> ServerStateManager:
+    state = ServerStateManager()
+    for raw in names:
+        state.add_client(raw.decode("utf-8"), protocol)
+    state.drain_presence_delta()  # As the presence broadcaster would
+    return state
+
+def measure(build, sessions: int) -> float:
+    """Bytes per session retained by the table `build` returns"""
+    names = [f"user{i:07d}".encode("utf-8") for i in range(sessions)]
+    protocol = object()
+    gc.collect()
+    tracemalloc.start()
+    table = build(names, protocol)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del table
+    return retained / sessions
+
+def transition_cost(rounds: int) -> tuple:
+    """Nanoseconds per transition: legacy manager, and a slotted record"""
+    legacy = LegacyStateManager()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        legacy.transition_to(LegacyState.CONNECTING)
+        legacy.transition_to(LegacyState.DISCONNECTED)  # Refused
+        legacy.state = LegacyState.DISCONNECTED
+    old = (time.perf_counter() - started) / (rounds * 2)
+
+    record = ClientInfo(0, "user", None, ConnectionState.DISCONNECTED)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        record.transition_to(ConnectionState.CONNECTING)
+        record.transition_to(ConnectionState.DISCONNECTED)  # Refused
+        record.state = ConnectionState.DISCONNECTED
+    new = (time.perf_counter() - started) / (rounds * 2)
+    return old * 1e9, new * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="Session table memory benchmark")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--rounds", type=int, default=200000, help="Transition pairs to time")
+    args = parser.parse_args()
+
+    print(f"{'sessions':>9} {'before B/session':>17} {'after B/session':>16} {'saved':>7}")
+    for sessions in args.sessions:
+        before = measure(legacy_table, sessions)
+        after = measure(slot_table, sessions)
+        print(f"{sessions:>9} {before:>17.0f} {after:>16.0f} {1 - after / before:>6.0%}")
+
+    old, new = transition_cost(args.rounds)
+    print(f"\nstate transition: before {old:.0f} ns, after {new:.0f} ns")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+#bench_slow_consumers.py
+"""
+Slow-consumer soak: U users keep broadcasting while a fraction of them never
+read (their QUIC peers acknowledge nothing). Reports traced memory at each
+checkpoint; with bounded outbound queues it levels off, while "unbounded"
+(everything handed straight to QUIC, the previous behaviour) keeps growing.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_slow_consumers --users 200 --stalled 0.2 --rounds 6000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from src.server.outbound import OutboundLimits
+from src.server.server_state import ServerStateManager
+from .fake_quic import FakeQuic, make_protocols
+
+class StalledQuic(FakeQuic):
+    """FakeQuic whose peer never acknowledges: sent data stays in the stream buffer"""
+    def send_stream_data(self, stream_id: int, data: bytes, end_stream: bool = False) -> None:
+        super().send_stream_data(stream_id, data, end_stream)
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            stream = self._streams[stream_id] = SimpleNamespace(sender=SimpleNamespace(_buffer=bytearray()))
+        stream.sender._buffer += data
+
+def limits_for(policy: str) -> OutboundLimits:
+    if policy == "unbounded":
+        return OutboundLimits(max_frames=1 << 62, max_bytes=1 << 62, high_watermark=1 << 62)
+    return OutboundLimits(policy=policy)
+
+async def soak(users: int, stalled: float, rounds: int, checkpoints: int, policy: str) -> dict:
+    rng = random.Random(7)
+    state = ServerStateManager()
+    limits = limits_for(policy)
+    protocols = make_protocols(state, users, outbound=limits)
+    for protocol in protocols[:int(users * stalled)]:
+        protocol._quic.__class__ = StalledQuic
+    for protocol in protocols:
+        protocol.writer.framed = True  # Session stream, as modern clients use
+
+    tracemalloc.start()
+    memory = []
+    start = time.perf_counter()
+    for i in range(rounds):
+        sender = rng.choice(protocols)
+        if not sender._quic.closed:  # Evicted clients send nothing more
+            sender.broadcast_chat_message("x" * 100)
+        if (i + 1) % (rounds // checkpoints) == 0:
+            memory.append(tracemalloc.get_traced_memory()[0])
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+
+    return {
+        "memory": memory,
+        "ms": elapsed * 1000,
+        "depth": limits.stats.depth,
+        "drops": limits.stats.drops,
+        "evictions": limits.stats.evictions,
+    }
+
+async def run(users: int, stalled: float, rounds: int, checkpoints: int):
+    print(f"{users} users, {stalled:.0%} never read, {rounds} broadcasts; traced MiB at each checkpoint")
+    for policy in ("unbounded", "drop_oldest", "drop_newest", "disconnect"):
+        r = await soak(users, stalled, rounds, checkpoints, policy)
+        curve = " ".join(f"{m / (1 << 20):6.1f}" for m in r["memory"])
+        print(f"{policy:<12} {curve}  | depth {r['depth']:,} drops {r['drops']:,} "
+              f"evictions {r['evictions']} ({r['ms']:.0f} ms)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Slow-consumer soak benchmark")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stalled", type=float, default=0.2)
+    parser.add_argument("--rounds", type=int, default=6000)
+    parser.add_argument("--checkpoints", type=int, default=8)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    asyncio.run(run(args.users, args.stalled, args.rounds, args.checkpoints))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
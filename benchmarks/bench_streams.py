@@ -0,0 +1,74 @@
+#bench_streams.py
+"""
+End-to-end comparison of the per-message-stream and session-stream modes:
+one client broadcasts N messages over loopback and another counts them.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_streams --messages 5000
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from aioquic.asyncio import serve
+from aioquic.quic.configuration import QuicConfiguration
+
+from src.protocol.auth import AuthManager
+from src.protocol.framing import STREAM_MODE_PER_MESSAGE, STREAM_MODE_SESSION
+from src.protocol.message import ALPN_BINARY
+from src.server.auth_service import AuthService
+from src.server.chat_server import ChatProtocol
+from src.server.server_state import ServerStateManager
+from .certs import generate_self_signed
+from .headless import headless_client
+
+async def run_mode(mode: str, messages: int, cert: str, key: str, port: int) -> float:
+    server_config = QuicConfiguration(is_client=False, alpn_protocols=[ALPN_BINARY])
+    server_config.load_cert_chain(cert, key)
+    state = ServerStateManager()
+    auth_service = AuthService(AuthManager(bcrypt_rounds=4))
+    server = await serve(
+        "127.0.0.1", port, configuration=server_config,
+        create_protocol=lambda *args, **kwargs: ChatProtocol(
+            *args, server_state=state, auth_service=auth_service, stream_mode=mode, **kwargs
+        )
+    )
+
+    try:
+        async with headless_client("127.0.0.1", port, stream_mode=mode) as receiver, \
+                   headless_client("127.0.0.1", port, stream_mode=mode) as sender:
+            await receiver.login("receiver")
+            await sender.login("sender")
+
+            receiver.target = messages
+            start = time.perf_counter()
+            for i in range(messages):
+                await sender.chat(f"message {i}")
+                if i % 100 == 0:
+                    await asyncio.sleep(0)
+            await asyncio.wait_for(receiver.done.wait(), timeout=120)
+            return time.perf_counter() - start
+    finally:
+        server.close()
+        auth_service.shutdown()
+
+async def run(messages: int, port: int):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = generate_self_signed(directory)
+        print(f"{'mode':<12} {'seconds':>8} {'msgs/s':>10}")
+        for i, mode in enumerate((STREAM_MODE_PER_MESSAGE, STREAM_MODE_SESSION)):
+            elapsed = await run_mode(mode, messages, cert, key, port + i)
+            print(f"{mode:<12} {elapsed:>8.3f} {messages / elapsed:>10,.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream mode benchmark")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--port", type=int, default=14433)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.messages, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#bench_tracing.py
+"""
+Cost of per-message tracing on the receive path.
+
+Feeds `--messages` chat messages through handle_stream_data of one of
+`--recipients` + 1 FakeQuic-backed connections, so each is decoded, routed
+and queued to every other connection, which then transmit. Runs without a
+tracer (tracing off, the default), and with one sampling each rate in
+`--rates`; reports microseconds per message and the overhead against no
+tracer. The last run's traces are summarized as the trace-summary CLI does.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_tracing --recipients 10 --rates 0.01 1.0
+"""
+import argparse
+import asyncio
+import time
+
+from src.protocol.message import MsgType, pack
+from src.server.server_state import ServerStateManager
+from src.server.tracing import MessageTracer, percentile, summarize
+from .fake_quic import make_protocols
+
+async def run(messages: int, recipients: int, tracer) -> float:
+    state = ServerStateManager()
+    protocols = make_protocols(state, recipients + 1, tracer=tracer)
+    sender = protocols[0]
+    data = pack({"t": int(MsgType.CHAT), "body": "hello everyone"})
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    for n in range(messages):
+        sender.handle_stream_data(4 * n, data, True)
+        for protocol in protocols:
+            protocol.transmit()
+    return (time.perf_counter() - started) / messages * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Message tracing overhead benchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--recipients", type=int, default=10)
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.01, 0.1, 1.0])
+    parser.add_argument("--rounds", type=int, default=5, help="Best of this many runs per setting")
+    args = parser.parse_args()
+
+    print(f"{args.messages} chat messages to {args.recipients} recipients each, best of {args.rounds}")
+    print(f"{'tracing':>10} {'us/msg':>8} {'overhead':>9} {'sampled':>8}")
+    asyncio.run(run(args.messages, args.recipients, None))  # Warm up
+    # Settings take turns, so that drift on a busy machine hits them alike
+    settings = [None] + args.rates
+    timings = {rate: [] for rate in settings}
+    sampled = {}
+    for _ in range(args.rounds):
+        for rate in settings:
+            tracer = MessageTracer(rate, buffer_size=args.messages) if rate else None
+            timings[rate].append(asyncio.run(run(args.messages, args.recipients, tracer)))
+            sampled[rate] = tracer.sampled if tracer else 0
+    baseline = min(timings[None])
+    for rate in settings:
+        best = min(timings[rate])
+        label = f"{rate:.0%}" if rate else "off"
+        overhead = f"{(best - baseline) / baseline:.1%}" if rate else "-"
+        print(f"{label:>10} {best:>8.2f} {overhead:>9} {sampled[rate]:>8}")
+
+    spans = summarize(tracer.drain(everything=True))
+    print(f"\nstages at {args.rates[-1]:.0%} sampling")
+    print(f"{'stage (us)':<36} {'count':>7} {'p50':>9} {'p99':>9}")
+    for span, values in spans.items():
+        values.sort()
+        print(f"{span:<36} {len(values):>7} {percentile(values, 50):>9.1f} {percentile(values, 99):>9.1f}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
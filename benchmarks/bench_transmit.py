@@ -0,0 +1,102 @@
+#bench_transmit.py
+"""
+Per-message transmit versus micro-batched transmit, end to end over
+loopback: a sender fires bursts of chat messages at R receivers and the
+server's datagram counters are compared.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_transmit --receivers 10 --bursts 200 --burst 20
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from contextlib import AsyncExitStack
+
+from aioquic.asyncio import serve
+from aioquic.quic.configuration import QuicConfiguration
+
+from src.protocol.auth import AuthManager
+from src.protocol.message import ALPN_BINARY
+from src.server.auth_service import AuthService
+from src.server.chat_server import ChatProtocol
+from src.server.scheduler import TransmitScheduler
+from src.server.server_state import ServerStateManager
+from .certs import generate_self_signed
+from .headless import headless_client
+
+async def run_mode(batching: bool, receivers: int, bursts: int, burst: int, cert: str, key: str, port: int) -> dict:
+    server_config = QuicConfiguration(is_client=False, alpn_protocols=[ALPN_BINARY])
+    server_config.load_cert_chain(cert, key)
+    state = ServerStateManager()
+    auth_service = AuthService(AuthManager(bcrypt_rounds=4))
+    scheduler = TransmitScheduler(batching=batching)
+    server = await serve(
+        "127.0.0.1", port, configuration=server_config,
+        create_protocol=lambda *args, **kwargs: ChatProtocol(
+            *args, server_state=state, auth_service=auth_service, scheduler=scheduler, **kwargs
+        )
+    )
+
+    try:
+        async with AsyncExitStack() as stack:
+            clients = [await stack.enter_async_context(headless_client("127.0.0.1", port))
+                       for _ in range(receivers + 1)]
+            sender, listeners = clients[0], clients[1:]
+            await sender.login("sender")
+            for i, listener in enumerate(listeners):
+                await listener.login(f"receiver{i}")
+            await asyncio.sleep(0.2)  # Let join notices settle
+
+            for listener in listeners:
+                listener.received = 0
+                listener.target = bursts * burst
+            stats = scheduler.stats
+            before = (stats.messages, stats.transmits, stats.datagrams)
+            start = time.perf_counter()
+            for b in range(bursts):
+                for i in range(burst):
+                    await sender.chat(f"burst {b} message {i}")
+                await asyncio.sleep(0)
+            await asyncio.wait_for(asyncio.gather(*(l.done.wait() for l in listeners)), timeout=120)
+            elapsed = time.perf_counter() - start
+            messages, transmits, datagrams = (
+                stats.messages - before[0], stats.transmits - before[1], stats.datagrams - before[2]
+            )
+    finally:
+        server.close()
+        scheduler.close()
+        auth_service.shutdown()
+
+    return {
+        "seconds": elapsed,
+        "messages": messages,
+        "transmits": transmits,
+        "datagrams": datagrams,
+    }
+
+async def run(receivers: int, bursts: int, burst: int, port: int):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = generate_self_signed(directory)
+        print(f"{receivers} receivers, {bursts} bursts of {burst} messages")
+        print(f"{'mode':<12} {'seconds':>8} {'messages':>9} {'transmits':>10} {'datagrams':>10} "
+              f"{'msgs/dgram':>11} {'syscalls/msg':>13}")
+        for i, batching in enumerate((False, True)):
+            r = await run_mode(batching, receivers, bursts, burst, cert, key, port + i)
+            print(f"{'batched' if batching else 'per-message':<12} {r['seconds']:>8.3f} {r['messages']:>9,} "
+                  f"{r['transmits']:>10,} {r['datagrams']:>10,} {r['messages'] / r['datagrams']:>11.2f} "
+                  f"{r['datagrams'] / r['messages']:>13.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Transmit batching benchmark")
+    parser.add_argument("--receivers", type=int, default=10)
+    parser.add_argument("--bursts", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--port", type=int, default=14443)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.receivers, args.bursts, args.burst, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#bench_user_store.py
+"""
+Logins against a large user store.
+
+Fills an in-memory store and an SQLite one with `--users` users (sharing
+one bcrypt hash, since hashing a million passwords would take hours), then
+measures, `--concurrency` at a time:
+
+    lookups  user records fetched through the async store API, for users
+             picked uniformly (nearly all miss the LRU) and from a hot set
+             of `--hot` users (nearly all hit it)
+    logins   AuthService.login of existing users: a lookup then a bcrypt
+             check of `--bcrypt-rounds` in the auth pool
+
+along with the worst event loop stall seen meanwhile. "sqlite on loop" runs
+the same queries synchronously on the event loop, as a store without an
+off-loop path would. Lookups in memory never yield either, so their stall
+is the whole run; a dict lookup is cheap enough for that not to matter.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_user_store --users 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from src.protocol.auth import AuthManager, hash_password
+from src.protocol.user_store import MemoryUserStore, SQLiteUserStore, UserStore
+from src.server.auth_service import AuthService
+
+class OnLoopStore(UserStore):
+    """An SQLite store queried on the event loop thread"""
+    def __init__(self, store: SQLiteUserStore):
+        self.store = store
+
+    def get_hash(self, username):
+        return self.store._select(username)
+
+    def add(self, username, hashed):
+        return self.store._insert(username, hashed)
+
+    def __len__(self):
+        return len(self.store)
+
+async def watch_loop(wakeups: list) -> None:
+    """Record when the loop gets round to a task sleeping 1 ms at a time"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(0.001)
+        wakeups.append(loop.time())
+
+async def timed(jobs, concurrency: int) -> tuple:
+    """Run coroutine factories `concurrency` at a time: (per second, worst loop stall in ms)"""
+    loop = asyncio.get_running_loop()
+    wakeups = [loop.time()]
+    watcher = asyncio.create_task(watch_loop(wakeups))
+    jobs = iter(jobs)
+
+    async def worker():
+        for job in jobs:
+            await job()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    watcher.cancel()
+    wakeups.append(loop.time())
+    return seconds, max(later - earlier for earlier, later in zip(wakeups, wakeups[1:])) * 1e3
+
+async def lookups(store: UserStore, names: list, count: int, concurrency: int) -> tuple:
+    seconds, stall = await timed((lambda name=random.choice(names): store.get_hash_async(name)
+                                  for _ in range(count)), concurrency)
+    return count / seconds, stall
+
+async def logins(store: UserStore, users: int, count: int, opts: argparse.Namespace) -> tuple:
+    service = AuthService(AuthManager(bcrypt_rounds=opts.bcrypt_rounds, store=store), max_workers=opts.auth_workers)
+    try:
+        seconds, stall = await timed((lambda name=f"user{random.randrange(users)}": service.login(name, "secret")
+                                      for _ in range(count)), opts.concurrency)
+    finally:
+        service._executor.shutdown(wait=True)
+    return count / seconds, stall
+
+def fill(store: UserStore, users: int, hashed: bytes) -> float:
+    started = time.perf_counter()
+    for first in range(0, users, 100000):
+        store.add_many((f"user{i}", hashed) for i in range(first, min(first + 100000, users)))
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="User store benchmark")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--logins", type=int, default=5000)
+    parser.add_argument("--hot", type=int, default=1000, help="Users in the hot set")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--auth-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    hashed = hash_password("secret", args.bcrypt_rounds)
+    try:
+        memory = MemoryUserStore()
+        sqlite = SQLiteUserStore(os.path.join(directory, "users.db"), pool_size=args.pool_size,
+                                 cache_size=args.cache_size)
+        print(f"{args.users:,} users: memory filled in {fill(memory, args.users, hashed):.1f}s, "
+              f"sqlite in {fill(sqlite, args.users, hashed):.1f}s "
+              f"({os.path.getsize(os.path.join(directory, 'users.db')) / 2**20:.0f} MiB)")
+        stores = {"memory": memory, "sqlite": sqlite, "sqlite on loop": OnLoopStore(sqlite)}
+        everyone = [f"user{i}" for i in range(args.users)]
+        hot = random.sample(everyone, args.hot)
+
+        print(f"\n{args.lookups:,} lookups, {args.concurrency} at a time")
+        print(f"{'store':>15} {'users':>8} {'lookups/s':>10} {'max stall':>10} {'cache hits':>11}")
+        for label, store in stores.items():
+            for pick, names in (("uniform", everyone), ("hot", hot)):
+                hits = sqlite.hits
+                rate, stall = asyncio.run(lookups(store, names, args.lookups, args.concurrency))
+                hit_rate = f"{(sqlite.hits - hits) / args.lookups:.0%}" if store is sqlite else "-"
+                print(f"{label:>15} {pick:>8} {rate:>10,.0f} {stall:>8.2f}ms {hit_rate:>11}")
+
+        print(f"\n{args.logins:,} logins of random users, bcrypt rounds {args.bcrypt_rounds}, "
+              f"{args.auth_workers} auth workers")
+        print(f"{'store':>15} {'logins/s':>9} {'max stall':>10}")
+        for label, store in stores.items():
+            rate, stall = asyncio.run(logins(store, args.users, args.logins, args))
+            print(f"{label:>15} {rate:>9,.0f} {stall:>8.2f}ms")
+        sqlite.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
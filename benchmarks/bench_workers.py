@@ -0,0 +1,117 @@
+#bench_workers.py
+"""
+Throughput across worker counts. Starts the server with 1/2/4/8 worker
+processes sharing one UDP port, then load processes connect clients that
+send private messages to random users. Users land on different workers, so
+most messages cross the bus.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks.bench_workers --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from src.server.chat_server import run_worker
+from src.utils.config_loader import load_config
+from .certs import generate_self_signed
+from .headless import headless_client
+
+async def load(port: int, process_id: int, processes: int, clients: int, messages: int,
+               barrier, start_at, results):
+    from contextlib import AsyncExitStack
+
+    logging.getLogger().setLevel(logging.WARNING)
+    users = [f"user{p}_{i}" for p in range(processes) for i in range(clients)]
+    rng = random.Random(process_id)
+    async with AsyncExitStack() as stack:
+        connections = []
+        for i in range(clients):
+            client = await stack.enter_async_context(headless_client("127.0.0.1", port))
+            await client.login(f"user{process_id}_{i}")
+            connections.append(client)
+
+        # Wait until every load process is logged in, then let the cluster settle
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+        await asyncio.sleep(max(0.0, start_at.value - time.time()))
+
+        for n in range(messages):
+            for client in connections:
+                await client.chat(f"message {n}", to=rng.choice(users))
+            await asyncio.sleep(0)
+
+        # Drain until nothing arrives for a few seconds
+        last_total, last_change = -1, time.time()
+        while time.time() - last_change < 3.0:
+            total = sum(c.received for c in connections)
+            if total != last_total:
+                last_total, last_change = total, time.time()
+            await asyncio.sleep(0.05)
+        results.put((sum(c.received for c in connections), last_change))
+
+def run_load(*args):
+    asyncio.run(load(*args))
+
+def bench(workers: int, port: int, cert: str, key: str, processes: int, clients: int, messages: int) -> dict:
+    config = dict(load_config("server"), host="127.0.0.1", port=port, cert_path=cert, key_path=key,
+                  workers=workers, bcrypt_rounds=4, rate_limiting=False,
+                  handshake_admission=False)
+    context = multiprocessing.get_context("spawn")
+    bus_dir = tempfile.mkdtemp(prefix="chat-bus-")
+    config["user_store_path"] = os.path.join(bus_dir, "users.db")  # Shared by the workers
+    config["auth_secret"] = os.urandom(32).hex()
+    servers = [context.Process(target=run_worker, args=(config, i, bus_dir)) for i in range(workers)]
+    for process in servers:
+        process.start()
+    time.sleep(2.0)
+
+    barrier = context.Barrier(processes + 1)
+    start_at = context.Value("d", 0.0)
+    results = context.Queue()
+    loaders = [
+        context.Process(target=run_load, args=(port, p, processes, clients, messages, barrier, start_at, results))
+        for p in range(processes)
+    ]
+    try:
+        for process in loaders:
+            process.start()
+        barrier.wait()
+        start_at.value = time.time() + 1.0
+        outcomes = [results.get(timeout=300) for _ in loaders]
+    finally:
+        for process in loaders + servers:
+            process.terminate()
+            process.join()
+        shutil.rmtree(bus_dir, ignore_errors=True)
+
+    delivered = sum(received for received, _ in outcomes)
+    elapsed = max(last for _, last in outcomes) - start_at.value
+    return {"workers": workers, "delivered": delivered, "seconds": elapsed,
+            "sent": processes * clients * messages}
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker throughput benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--processes", type=int, default=4, help="Load generator processes")
+    parser.add_argument("--clients", type=int, default=25, help="Connections per load process")
+    parser.add_argument("--messages", type=int, default=200, help="Private messages per connection")
+    parser.add_argument("--port", type=int, default=14500)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = generate_self_signed(directory)
+        print(f"{'workers':>7} {'sent':>8} {'delivered':>10} {'seconds':>8} {'deliveries/s':>13}")
+        for i, workers in enumerate(args.workers):
+            r = bench(workers, args.port + i, cert, key, args.processes, args.clients, args.messages)
+            print(f"{r['workers']:>7} {r['sent']:>8} {r['delivered']:>10} {r['seconds']:>8.2f} "
+                  f"{r['delivered'] / r['seconds']:>13,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#certs.py
+"""Self-signed certificates for running the server on loopback in benchmarks."""
+import datetime
+import os
+from typing import Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.x509.oid import NameOID
+
+def generate_self_signed(directory: str, key_type: str = "ec") -> Tuple[str, str]:
+    """
+    Write a localhost certificate and key into directory.
+
+    Args:
+        directory: Output directory
+        key_type: "ec" for ECDSA P-256, or "rsa2048" / "rsa4096"
+
+    Returns:
+        (cert_path, key_path)
+    """
+    if key_type == "ec":
+        key = ec.generate_private_key(ec.SECP256R1())
+    elif key_type.startswith("rsa"):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=int(key_type[3:]))
+    else:
+        raise ValueError(f"Unknown key type: {key_type}")
+
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, f"cert-{key_type}.pem")
+    key_path = os.path.join(directory, f"key-{key_type}.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
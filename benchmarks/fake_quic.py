@@ -0,0 +1,40 @@
+#fake_quic.py
+"""In-memory stand-in for QuicConnection so server code can be benchmarked without sockets."""
+class FakeQuic:
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self._next_stream_id = 1
+        self._streams = {}  # Nothing is ever left unacknowledged
+        self.closed = False
+
+    def get_next_available_stream_id(self, is_unidirectional: bool = False) -> int:
+        stream_id = self._next_stream_id
+        self._next_stream_id += 4
+        return stream_id
+
+    def send_stream_data(self, stream_id: int, data: bytes, end_stream: bool = False) -> None:
+        self.frames_sent += 1
+        self.bytes_sent += len(data)
+
+    def datagrams_to_send(self, now: float) -> list:
+        return []
+
+    def get_timer(self):
+        return None
+
+    def close(self, error_code: int = 0, frame_type=None, reason_phrase: str = "") -> None:
+        self.closed = True
+
+def make_protocols(server_state, count: int, prefix: str = "user", **kwargs) -> list:
+    """Create authenticated ChatProtocol instances backed by FakeQuic; needs a running loop"""
+    from src.server.chat_server import ChatProtocol
+
+    protocols = []
+    for i in range(count):
+        protocol = ChatProtocol(FakeQuic(), server_state=server_state, **kwargs)
+        protocol.handshake_complete = True
+        protocol.username = f"{prefix}{i}"
+        server_state.add_client(protocol.username, protocol)
+        protocols.append(protocol)
+    return protocols
@@ -0,0 +1,367 @@
+#harness.py
+"""
+Load generator for the chat server.
+
+Starts the server on loopback (one process per worker) with a generated
+self-signed certificate, then spreads thousands of headless clients over
+several load processes and runs one scenario:
+
+    login_storm   every client connects and logs in at once
+    broadcast     a few senders chat to everyone, all clients listen
+    private_mesh  every client sends private messages to random users
+    churn         clients keep connecting, logging in, messaging and leaving
+
+Reports throughput, p50/p95/p99 end-to-end latency and server CPU and RSS,
+and saves everything as JSON so runs can be compared.
+
+Usage:
+    PYTHONPATH=$PWD python -m benchmarks private_mesh --clients 1000 --messages 20
+    PYTHONPATH=$PWD python -m benchmarks broadcast --clients 2000 --senders 10 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from src.protocol.message import MsgType
+from src.server.chat_server import run_worker
+from src.utils.config_loader import load_config
+from .certs import generate_self_signed
+from .headless import HeadlessClient, headless_client
+
+SCENARIOS = ("login_storm", "broadcast", "private_mesh", "churn")
+
+_STAMP = re.compile(r"@(\d+)")  # Send time carried in message bodies, ns since the epoch
+_MAX_SAMPLES = 200_000          # Latency samples kept per load process
+_IDLE_DRAIN = 2.0               # Seconds without deliveries that end a run
+
+class Samples:
+    """Latency samples in milliseconds, reservoir-sampled beyond a cap"""
+    def __init__(self, cap: int = _MAX_SAMPLES, seed: int = 0):
+        self.values: List[float] = []
+        self.count = 0
+        self._cap = cap
+        self._rng = random.Random(seed)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if len(self.values) < self._cap:
+            self.values.append(value)
+        else:
+            slot = self._rng.randrange(self.count)
+            if slot < self._cap:
+                self.values[slot] = value
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def at(p):
+        return round(values[min(len(values) - 1, int(len(values) * p / 100))], 3)
+
+    return {"p50": at(50), "p95": at(95), "p99": at(99), "max": round(values[-1], 3)}
+
+class LoadClient(HeadlessClient):
+    """Headless client that measures the latency of every stamped chat message it receives"""
+    samples: Optional[Samples] = None  # Shared by the clients of one load process
+    last_received = 0.0
+
+    def handle_message(self, message: dict) -> None:
+        if message.get("t") == MsgType.CHAT and not (message.get("body") or "").startswith("[Private to "):
+            match = _STAMP.search(message.get("body") or "")
+            if match:
+                LoadClient.samples.add((time.time_ns() - int(match.group(1))) / 1e6)
+            LoadClient.last_received = time.time()
+        super().handle_message(message)
+
+def stamp() -> str:
+    return f"@{time.time_ns()}"
+
+# Load processes
+
+def split(total: int, parts: int) -> List[int]:
+    return [total // parts + (1 if p < total % parts else 0) for p in range(parts)]
+
+async def load(scenario: str, opts: SimpleNamespace, process_id: int, barrier, start_at, results):
+    logging.getLogger().setLevel(logging.ERROR)
+    counts = split(opts.clients, opts.processes)
+    first = sum(counts[:process_id])  # Global index of this process's first client
+    names = [f"u{p}_{i}" for p, count in enumerate(counts) for i in range(count)]
+    mine = names[first:first + counts[process_id]]
+    rng = random.Random(process_id)
+    LoadClient.samples = Samples(seed=process_id)
+    logins = Samples(seed=process_id)
+    sent = errors = 0
+
+    def connect():
+        return headless_client("127.0.0.1", opts.port, client_class=LoadClient)
+
+    async with AsyncExitStack() as stack:
+        connections = []
+        if scenario in ("broadcast", "private_mesh"):
+            gate = asyncio.Semaphore(opts.connect_concurrency)
+
+            async def open_client(name):
+                async with gate:
+                    client = await stack.enter_async_context(connect())
+                    await client.login(name, timeout=opts.timeout)
+                    return client
+
+            connections = await asyncio.gather(*(open_client(name) for name in mine))
+
+        # Start every load process at the same moment
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+        await asyncio.sleep(max(0.0, start_at.value - time.time()))
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.time()
+
+        if scenario == "login_storm":
+            async def storm_login(name):
+                nonlocal errors
+                t0 = time.perf_counter()
+                try:
+                    client = await stack.enter_async_context(connect())
+                    await client.login(name, timeout=opts.timeout)
+                    logins.add((time.perf_counter() - t0) * 1000)
+                except Exception:
+                    errors += 1
+
+            await asyncio.gather(*(storm_login(name) for name in mine))
+            finished = time.time()
+
+        elif scenario == "broadcast":
+            senders = [c for i, c in enumerate(connections) if first + i < opts.senders]
+            for _ in range(opts.messages):
+                for client in senders:
+                    await client.chat(stamp())
+                    sent += 1
+                await asyncio.sleep(opts.interval)
+
+        elif scenario == "private_mesh":
+            for _ in range(opts.messages):
+                for name, client in zip(mine, connections):
+                    await client.chat(stamp(), to=rng.choice(names))
+                    sent += 1
+                await asyncio.sleep(opts.interval)
+
+        elif scenario == "churn":
+            deadline = started + opts.duration
+
+            async def churner(name):
+                nonlocal sent, errors
+                while time.time() < deadline:
+                    t0 = time.perf_counter()
+                    try:
+                        async with connect() as client:
+                            await client.login(name, timeout=opts.timeout)
+                            logins.add((time.perf_counter() - t0) * 1000)
+                            await client.chat(stamp(), to=name)
+                            sent += 1
+                            await asyncio.sleep(opts.interval)
+                    except Exception:
+                        errors += 1
+
+            await asyncio.gather(*(churner(name) for name in mine))
+            finished = time.time()
+
+        if scenario in ("broadcast", "private_mesh"):
+            # Wait until deliveries stop arriving
+            LoadClient.last_received = max(LoadClient.last_received, time.time())
+            while time.time() - LoadClient.last_received < _IDLE_DRAIN:
+                await asyncio.sleep(0.05)
+            finished = LoadClient.last_received
+
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        results.put({
+            "process": process_id,
+            "started": started,
+            "finished": finished,
+            "sent": sent,
+            "received": LoadClient.samples.count,
+            "logins": logins.count,
+            "errors": errors,
+            "latency": LoadClient.samples.values,
+            "login_latency": logins.values,
+            "cpu_seconds": (after.ru_utime + after.ru_stime) - (usage.ru_utime + usage.ru_stime),
+            "rss_peak_mb": after.ru_maxrss / 1024,
+        })
+
+def run_load(scenario: str, opts: dict, process_id: int, barrier, start_at, results):
+    asyncio.run(load(scenario, SimpleNamespace(**opts), process_id, barrier, start_at, results))
+
+# Server process measurements (Linux /proc)
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+def process_memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    memory = {"rss_mb": None, "rss_peak_mb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    memory["rss_peak_mb"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return memory
+
+def total(values) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return round(sum(values), 3) if values else None
+
+# Orchestration
+
+def run_server(config: dict, worker_id: int, bus_dir: str):
+    """Server worker with per-connection logging turned down"""
+    logging.disable(logging.INFO)
+    run_worker(config, worker_id, bus_dir)
+
+def run(scenario: str, opts: argparse.Namespace) -> dict:
+    directory = tempfile.mkdtemp(prefix="chat-bench-")
+    context = multiprocessing.get_context("spawn")
+    cert, key = generate_self_signed(directory)
+    config = dict(
+        load_config("server"), host="127.0.0.1", port=opts.port, cert_path=cert, key_path=key,
+        workers=opts.workers, bcrypt_rounds=opts.bcrypt_rounds, rate_limiting=opts.rate_limiting,
+        handshake_admission=opts.handshake_admission,
+        history_dir=os.path.join(directory, "history") if opts.history else None,
+        mailbox_spill_dir=os.path.join(directory, "mailbox"),
+        user_store_path=os.path.join(directory, "users.db"), auth_secret=os.urandom(32).hex(),
+    )
+    bus_dir = os.path.join(directory, "bus")
+    os.makedirs(bus_dir)
+    servers = [context.Process(target=run_server, args=(config, i, bus_dir), name=f"chat-worker-{i}")
+               for i in range(opts.workers)]
+    for process in servers:
+        process.start()
+    time.sleep(opts.server_startup)
+
+    barrier = context.Barrier(opts.processes + 1)
+    start_at = context.Value("d", 0.0)
+    results = context.Queue()
+    loaders = [
+        context.Process(target=run_load, args=(scenario, vars(opts), p, barrier, start_at, results))
+        for p in range(opts.processes)
+    ]
+    try:
+        for process in loaders:
+            process.start()
+        barrier.wait()
+        start_at.value = time.time() + 0.5
+        time.sleep(0.5)
+        cpu_before = [process_cpu_seconds(p.pid) for p in servers]
+        outcomes = [results.get(timeout=opts.run_timeout) for _ in loaders]
+        cpu_after = [process_cpu_seconds(p.pid) for p in servers]
+        memory = [process_memory_mb(p.pid) for p in servers]
+    finally:
+        for process in loaders + servers:
+            process.terminate()
+            process.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    started = min(o["started"] for o in outcomes)
+    seconds = max(o["finished"] for o in outcomes) - started
+    sent = sum(o["sent"] for o in outcomes)
+    received = sum(o["received"] for o in outcomes)
+    logins = sum(o["logins"] for o in outcomes)
+    server_cpu = total(a - b for a, b in zip(cpu_after, cpu_before) if a is not None and b is not None)
+    if scenario == "login_storm":
+        throughput, unit = logins / seconds, "logins/s"
+    elif scenario == "churn":
+        throughput, unit = logins / seconds, "sessions/s"
+    else:
+        throughput, unit = received / seconds, "deliveries/s"
+
+    return {
+        "scenario": scenario,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "options": {k: v for k, v in vars(opts).items() if k not in ("output", "scenario")},
+        "results": {
+            "throughput": round(throughput, 2),
+            "unit": unit,
+            "seconds": round(seconds, 3),
+            "sent": sent,
+            "delivered": received,
+            "logins": logins,
+            "errors": sum(o["errors"] for o in outcomes),
+            "latency_ms": percentiles([v for o in outcomes for v in o["latency"]]),
+            "login_ms": percentiles([v for o in outcomes for v in o["login_latency"]]),
+            "server": {
+                "cpu_seconds": server_cpu,
+                "cpu_percent": round(server_cpu / seconds * 100, 1) if server_cpu is not None else None,
+                "rss_mb": total(m["rss_mb"] for m in memory),
+                "rss_peak_mb": total(m["rss_peak_mb"] for m in memory),
+            },
+            "load": {
+                "cpu_seconds": total(o["cpu_seconds"] for o in outcomes),
+                "rss_peak_mb": total(o["rss_peak_mb"] for o in outcomes),
+            },
+        },
+    }
+
+def print_summary(report: dict) -> None:
+    r = report["results"]
+    print(f"scenario {report['scenario']}: {r['throughput']:,.1f} {r['unit']} over {r['seconds']:.2f}s "
+          f"(sent {r['sent']:,}, delivered {r['delivered']:,}, logins {r['logins']:,}, errors {r['errors']})")
+    for name in ("latency_ms", "login_ms"):
+        p = r[name]
+        if p["p50"] is not None:
+            print(f"  {name:<11} p50 {p['p50']:.2f}  p95 {p['p95']:.2f}  p99 {p['p99']:.2f}  max {p['max']:.2f}")
+    s = r["server"]
+    print(f"  server      cpu {s['cpu_seconds']}s ({s['cpu_percent']}%)  rss {s['rss_mb']} MiB "
+          f"(peak {s['rss_peak_mb']} MiB)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Chat server load harness")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--clients", type=int, default=1000, help="Total client connections")
+    parser.add_argument("--processes", type=int, default=4, help="Load generator processes")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--messages", type=int, default=10, help="Messages per sending client")
+    parser.add_argument("--senders", type=int, default=10, help="Sending clients in the broadcast scenario")
+    parser.add_argument("--interval", type=float, default=0.05, help="Pause between send rounds, seconds")
+    parser.add_argument("--duration", type=float, default=10.0, help="Length of the churn scenario, seconds")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--history", action="store_true", help="Keep message history on the server")
+    parser.add_argument("--rate-limiting", action="store_true", help="Keep the server's per-user rate limits on")
+    parser.add_argument("--handshake-admission", action="store_true",
+                        help="Keep the server's handshake cap and per-address connection rate on")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-login timeout, seconds")
+    parser.add_argument("--run-timeout", type=float, default=600.0)
+    parser.add_argument("--server-startup", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=14600)
+    parser.add_argument("--output", help="JSON report path (default: bench-<scenario>-<time>.json)")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = run(args.scenario, args)
+    print_summary(report)
+    output = args.output or f"bench-{args.scenario}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"  saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#headless.py
+"""Headless ChatClientProtocol for benchmarks: counts messages instead of printing them."""
+import asyncio
+from contextlib import asynccontextmanager
+
+from aioquic.asyncio import connect
+from aioquic.quic.configuration import QuicConfiguration
+
+from src.client.client import ChatClientProtocol
+from src.protocol.framing import STREAM_MODE_SESSION
+from src.protocol.message import ALPN_BINARY, MsgType
+
+class HeadlessClient(ChatClientProtocol):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.received = 0
+        self.target = 0
+        self.done = asyncio.Event()
+        self.authenticated = asyncio.Event()
+
+    def handle_message(self, message: dict) -> None:
+        t = message.get("t")
+        if t == MsgType.AUTH_OK:
+            self.token = message.get("token")
+            self.authenticated.set()
+        elif t == MsgType.CHAT:
+            self.received += 1
+            if self.target and self.received >= self.target:
+                self.done.set()
+
+    async def login(self, username: str, password: str = "secret", timeout: float = 30) -> None:
+        await self.send_message({"v": self.wire_version, "t": MsgType.AUTH_REQ, "to": username, "body": password})
+        await asyncio.wait_for(self.authenticated.wait(), timeout)
+
+    async def chat(self, body: str, to: str = None) -> None:
+        await self.send_message({"v": self.wire_version, "t": MsgType.CHAT, "body": body, "to": to})
+
+@asynccontextmanager
+async def headless_client(host: str, port: int, stream_mode: str = STREAM_MODE_SESSION, alpn: str = ALPN_BINARY,
+                          client_class=HeadlessClient):
+    """Connect a HeadlessClient (or subclass) to a server with an unverified certificate"""
+    configuration = QuicConfiguration(is_client=True, alpn_protocols=[alpn])
+    configuration.verify_mode = 0
+    async with connect(
+        host, port, configuration=configuration,
+        create_protocol=lambda *args, **kwargs: client_class(*args, stream_mode=stream_mode, **kwargs)
+    ) as client:
+        yield client
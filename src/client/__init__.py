@@ -1,7 +1,10 @@
-from .chat_client import ChatClientProtocol
+from .client import ChatClient, ChatClientProtocol
 from .client_state import ClientStateManager
+from .tickets import TicketCache
 
 __all__ = [
+    'ChatClient',
     'ChatClientProtocol',
-     'ClientStateManager'
+     'ClientStateManager',
+     'TicketCache'
      ]
\ No newline at end of file
@@ -126,102 +126,101 @@
 
 
 import asyncio
+import json
 import sys
+import time
 import logging
 from typing import Optional
-from aioquic.asyncio import connect, QuicConnectionProtocol
-from aioquic.quic.configuration import QuicConfiguration
 
-from src.protocol.message import MsgType, pack, unpack
+from src.protocol.message import MsgType
+from src.protocol.framing import STREAM_MODE_SESSION
 from src.utils.config_loader import load_config
-from src.protocol.states import ConnectionState
-from .client_state import ClientStateManager
+from .client import ChatClient, ChatClientProtocol
+from .tickets import TicketCache
 
 logging.basicConfig(level=logging.INFO)
 
-class ChatClientProtocol(QuicConnectionProtocol):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.state_manager = ClientStateManager()
-        self.token: Optional[str] = None
-
-    def quic_event_received(self, event) -> None:
-        from aioquic.quic.events import StreamDataReceived
-        if isinstance(event, StreamDataReceived):
-            try:
-                message = unpack(event.data)
-            except Exception as e:
-                logging.error(f"Error decoding message: {e}")
-                return
-            t = message.get("t")
-            if t == MsgType.AUTH_OK:
-                print(f"\n[SYSTEM] {message.get('body')}")
-                self.token = message.get("token")
-                self.state_manager.transition_to(ConnectionState.AUTHENTICATED)
-            elif t == MsgType.AUTH_BAD:
-                print(f"\n[AUTH ERROR] {message.get('body')}")
-            elif t == MsgType.CHAT:
-                print(f"\n{message.get('body')}")
-            elif t == MsgType.SYS:
-                print(f"\n[SYSTEM] {message.get('body')}")
-            else:
-                print(f"\n[UNKNOWN] {message}")
-
-    async def send_message(self, msg: dict):
-        try:
-            new_stream = self._quic.get_next_available_stream_id()
-            self._quic.send_stream_data(new_stream, pack(msg), end_stream=True)
-            self.transmit()
-        except Exception as e:
-            logging.error(f"Error sending message: {e}")
-
-async def send_keep_alive(protocol, interval=15):
-    """Send keep-alive pings to the server every `interval` seconds."""
-    while protocol.state_manager.is_connected:
-        await asyncio.sleep(interval)
-        try:
-            await protocol.send_message({"t": MsgType.SYS, "body": "ping"})
-            logging.info("Keep-alive ping sent.")
-        except Exception as e:
-            logging.error(f"Keep-alive error: {e}")
+def render(message: dict) -> Optional[str]:
+    """Text the CLI prints for a received message, or None for state-only messages"""
+    t = message.get("t")
+    if t == MsgType.AUTH_OK or t == MsgType.SYS:
+        return f"\n[SYSTEM] {message.get('body')}"
+    if t == MsgType.AUTH_BAD:
+        return f"\n[AUTH ERROR] {message.get('body')}"
+    if t == MsgType.CHAT:
+        return f"\n{message.get('body')}"
+    if t in (MsgType.PRESENCE_SNAPSHOT, MsgType.PRESENCE):
+        return None
+    if t == MsgType.TYPING:
+        names = ", ".join((message.get("body") or "").split("\n"))
+        where = f" in {message.get('room')}" if message.get("room") else ""
+        return f"\n[{names} typing{where}...]"
+    if t in (MsgType.ROOM_JOIN, MsgType.ROOM_LEAVE):
+        return f"\n[SYSTEM] {message.get('body')}"
+    if t == MsgType.ROOM_LIST:
+        rooms = [line.split(" ") for line in message.get("body").split("\n") if line]
+        room_list = ", ".join(f"{room} ({count})" for room, count in rooms)
+        return f"\n[SYSTEM] Rooms: {room_list or 'none'}"
+    if t == MsgType.HISTORY:
+        page = json.loads(message.get("body") or "{}")
+        return "".join(f"\n[{time.strftime('%H:%M:%S', time.localtime(timestamp))}] {body}"
+                       for seq, timestamp, body, room in page.get("records", [])) or None
+    return f"\n[UNKNOWN] {message}"
+
+async def print_messages(client: ChatClient):
+    """Print everything the server sends until the connection closes"""
+    async for message in client.messages():
+        text = render(message)
+        if text is not None:
+            print(text)
 
 async def main():
     # Load configuration
     config = load_config("client")
-    
-    # Get user credentials
+    host, port = config["server_host"], config["server_port"]
+    tickets = TicketCache(config.get("ticket_cache", "~/.chat_client/tickets.json"))
+    resume = tickets.get(host, port)
+
+    # Get user credentials; a saved session token stands in for the password
     username = input("Enter username: ").strip()
-    password = input("Enter password: ").strip()
-
-    # Setup QUIC configuration
-    quic_config = QuicConfiguration(is_client=True, alpn_protocols=["chat/1"])
-    quic_config.verify_mode = 0  # Accept self-signed certificates
-
-    async with connect(
-        config["server_host"],
-        config["server_port"],
-        configuration=quic_config,
-        create_protocol=ChatClientProtocol
-    ) as protocol:
-        # Send authentication
-        auth_msg = {
-            "v": 1,
-            "t": MsgType.AUTH_REQ,
-            "to": username,
-            "body": password,
-            "token": None
-        }
-        await protocol.send_message(auth_msg)
-        await asyncio.sleep(1)
-
-        if not hasattr(protocol, "token") or protocol.token is None:
+    can_resume = resume.token is not None and resume.username == username
+    password = None if can_resume else input("Enter password: ").strip()
+
+    client = ChatClient(
+        host,
+        port,
+        alpn_protocols=config["alpn_protocols"],
+        stream_mode=config.get("stream_mode", STREAM_MODE_SESSION),
+        session_ticket=resume.ticket,
+        session_ticket_handler=lambda ticket: tickets.store_ticket(host, port, ticket),
+        compression=config.get("compression", True),
+        datagrams=config.get("datagrams", True),
+        idle_timeout=config.get("idle_timeout", 60.0),
+        keep_alive_interval=config.get("keep_alive_interval", 20.0)
+    )
+    # With a ticket and a token, authenticate in the first flight as 0-RTT early data
+    early = can_resume and resume.ticket is not None
+    protocol = await client.connect(wait_connected=not early)
+    if early:
+        protocol.wire_version = resume.wire_version or protocol.wire_version
+    printer = asyncio.create_task(print_messages(client))
+
+    try:
+        authenticated = False
+        if can_resume:
+            authenticated = await client.login(username, token=resume.token)
+            if not authenticated:
+                tickets.drop_token(host, port)
+                password = input("Session expired. Enter password: ").strip()
+        if not authenticated:
+            authenticated = await client.login(username, password=password)
+
+        if not authenticated:
             print("Authentication failed, exiting.")
             return
+        tickets.store_session(host, port, username, client.token, protocol.wire_version)
 
         print("Logged in. Type messages to chat. Type '/quit' to exit.")
-        
-        # Start keep-alive pings
-        asyncio.create_task(send_keep_alive(protocol, interval=15))
 
         while True:
             try:
@@ -237,26 +236,53 @@ async def main():
                     print("Exiting chat.")
                     break
 
-                msg_out = {
-                    "v": 1,
-                    "t": MsgType.CHAT,
-                    "body": line,
-                    "to": None,
-                    "token": protocol.token
-                }
+                if line.lower() == "/who":
+                    online_list = ", ".join(sorted(client.online_users))
+                    print(f"Online users: {online_list}")
+                    continue
+
+                if line.lower() == "/rooms":
+                    await client.list_rooms()
+                    continue
+
+                if line.lower() == "/history" or line.lower().startswith("/history "):
+                    count = line[len("/history"):].strip()
+                    await client.history(int(count) if count.isdigit() else None)
+                    continue
+
+                if line.lower() == "/more":
+                    if not await client.more_history():
+                        print("No more history.")
+                    continue
+
+                if line.lower().startswith(("/join ", "/leave ")):
+                    command, room = line.split(" ", 1)
+                    if command.lower() == "/join":
+                        await client.join(room.strip())
+                    else:
+                        await client.leave(room.strip())
+                    continue
 
                 if line.startswith("@"):
                     parts = line.split(" ", 1)
                     if len(parts) != 2:
                         print("Invalid private message format. Use '@username message'")
                         continue
-                    msg_out["to"] = parts[0][1:]
-                    msg_out["body"] = parts[1]
-
-                await protocol.send_message(msg_out)
+                    await client.send(parts[1], to=parts[0][1:])
+                elif line.startswith("#"):
+                    parts = line.split(" ", 1)
+                    if len(parts) != 2:
+                        print("Invalid room message format. Use '#room message'")
+                        continue
+                    await client.send(parts[1], room=parts[0][1:])
+                else:
+                    await client.send(line)
 
             except Exception as e:
                 logging.error(f"Error reading input: {e}")
+    finally:
+        printer.cancel()
+        await client.close()
 
 if __name__ == "__main__":
     try:
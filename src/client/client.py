@@ -0,0 +1,335 @@
+#client.py
+import asyncio
+import json
+import logging
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Callable, Optional, Sequence
+
+from aioquic.asyncio import connect, QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.events import ConnectionTerminated, DatagramFrameReceived, HandshakeCompleted, StreamDataReceived
+from aioquic.tls import SessionTicket
+
+from src.protocol.message import MsgType, JSON_VERSION, ALPN_BINARY, ALPN_JSON, pack, unpack, wire_version_for_alpn
+from src.protocol.presence import decode_presence_delta, decode_presence_snapshot
+from src.protocol.framing import STREAM_MODE_SESSION, FrameWriter, StreamReassembler
+from src.protocol.compression import DICTIONARY_ID, Compressor
+from src.protocol.datagram import MAX_DATAGRAM_FRAME_SIZE, MAX_PENDING_DATAGRAMS, datagram_payload_limit
+from src.protocol.states import ConnectionState
+from .client_state import ClientStateManager
+
+class ChatClientProtocol(QuicConnectionProtocol):
+    """
+    Client side of a chat connection.
+
+    Decoded messages update the local state (token, presence, rooms, history
+    cursor) and are then queued in a bounded inbox read by messages(). If
+    the consumer falls more than `inbox_size` messages behind, the oldest
+    queued message is dropped and counted in `dropped`.
+
+    Writes are pipelined: write() frames the message into QUIC at once and
+    transmits on the next loop iteration, so a burst of sends shares
+    datagrams. send_message() additionally waits while more than
+    `send_buffer` bytes are unacknowledged by the server.
+
+    With `compression` on, the AUTH_REQ offers the shared dictionary and,
+    once the server agrees in AUTH_OK, larger outgoing messages are deflated.
+
+    Ephemeral messages (typing, presence pings) go through send_ephemeral():
+    as QUIC DATAGRAMs when both sides negotiated them, else over the stream.
+
+    keep_alive() holds an idle connection open with QUIC PING frames, which
+    the server's QUIC stack acknowledges without involving the chat server.
+    """
+    def __init__(self, *args, stream_mode: str = STREAM_MODE_SESSION, inbox_size: int = 1024,
+                 send_buffer: int = 1024 * 1024, compression: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.state_manager = ClientStateManager()
+        self.token: Optional[str] = None
+        self.wire_version = JSON_VERSION  # Wire format used for frames sent to the server
+        self.reassembler = StreamReassembler()
+        self.writer = FrameWriter(self._quic, mode=stream_mode)
+        self.history_cursor: Optional[int] = None  # Where the next /more page starts
+        self.auth_done = asyncio.Event()  # Set once the server answers the AUTH_REQ
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=inbox_size)
+        self.inbox_closed = False
+        self.dropped = 0  # Messages discarded because the inbox was full
+        self.send_buffer = send_buffer
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self.compressor = Compressor() if compression else None
+        self.compressed = False  # Set once the server agrees to compression
+        self.datagram_limit = 0  # Largest DATAGRAM payload; 0 until negotiated in the handshake
+        self.last_seen = self._loop.time()  # Loop time of the last packet from the server
+        self.pings = 0  # Keep-alive PINGs sent
+
+    def quic_event_received(self, event) -> None:
+        if isinstance(event, HandshakeCompleted):
+            self.wire_version = wire_version_for_alpn(event.alpn_protocol)
+            self.datagram_limit = datagram_payload_limit(self._quic)
+        elif isinstance(event, DatagramFrameReceived):
+            try:
+                message = unpack(event.data)
+            except Exception as e:
+                logging.debug(f"Dropping undecodable datagram: {e}")
+                return
+            self.handle_message(message)
+        elif isinstance(event, StreamDataReceived):
+            try:
+                payloads = self.reassembler.feed(event.stream_id, event.data, event.end_stream)
+            except ValueError as e:
+                logging.error(f"Error reassembling stream {event.stream_id}: {e}")
+                return
+            for payload in payloads:
+                try:
+                    message = unpack(payload)
+                except Exception as e:
+                    logging.error(f"Error decoding message: {e}")
+                    continue
+                self.handle_message(message)
+        elif isinstance(event, ConnectionTerminated):
+            self.auth_done.set()
+            self._writable.set()
+            self.close_inbox()
+
+    def datagram_received(self, data, addr) -> None:
+        self.last_seen = self._loop.time()
+        super().datagram_received(data, addr)
+        # Acknowledgements may have freed send buffer
+        if not self._writable.is_set() and self.writer.buffered() < self.send_buffer:
+            self._writable.set()
+
+    def handle_message(self, message: dict) -> None:
+        """Apply a message to the local state, then hand it to the consumer"""
+        t = message.get("t")
+        if t == MsgType.AUTH_OK:
+            self.token = message.get("token")
+            self.compressed = self.compressor is not None and message.get("zdict") == DICTIONARY_ID
+            self.state_manager.transition_to(ConnectionState.AUTHENTICATED)
+            self.auth_done.set()
+        elif t == MsgType.AUTH_BAD:
+            self.auth_done.set()
+        elif t == MsgType.PRESENCE_SNAPSHOT:
+            self.state_manager.apply_presence_snapshot(message.get("seq", 0), decode_presence_snapshot(message.get("body")))
+        elif t == MsgType.PRESENCE:
+            joined, left = decode_presence_delta(message.get("body"))
+            if not self.state_manager.apply_presence_delta(message.get("seq", 0), joined, left):
+                # Missed a delta; ask for the full list again
+                self.write({"t": MsgType.PRESENCE_SNAPSHOT})
+        elif t == MsgType.ROOM_JOIN:
+            self.state_manager.rooms.add(message.get("room"))
+        elif t == MsgType.ROOM_LEAVE:
+            self.state_manager.rooms.discard(message.get("room"))
+        elif t == MsgType.HISTORY:
+            page = json.loads(message.get("body") or "{}")
+            self.history_cursor = message.get("seq") if page.get("more") else None
+        self.deliver(message)
+
+    def deliver(self, message: Optional[dict]) -> None:
+        """Queue a message for messages(), dropping the oldest one if the consumer is behind"""
+        if self.inbox.full():
+            self.inbox.get_nowait()
+            self.dropped += 1
+        self.inbox.put_nowait(message)
+
+    def close_inbox(self) -> None:
+        """End messages() once everything already queued has been read"""
+        if not self.inbox_closed:
+            self.inbox_closed = True
+            if not self.inbox.full():
+                self.inbox.put_nowait(None)  # Wakes a consumer waiting on an empty inbox
+
+    async def messages(self) -> AsyncIterator[dict]:
+        """Yield received messages until the connection closes"""
+        while not (self.inbox_closed and self.inbox.empty()):
+            message = await self.inbox.get()
+            if message is None:
+                return
+            yield message
+
+    def write(self, msg: dict) -> None:
+        """Frame a message into QUIC without waiting; it is transmitted on the next loop iteration"""
+        payload = pack({"v": self.wire_version, **msg})
+        if self.compressed:
+            payload = self.compressor.compress(payload)
+        self.writer.write(self.writer.encode(payload))
+        self._transmit_soon()
+
+    def send_ephemeral(self, msg: dict) -> None:
+        """Send a message that may be lost, as a DATAGRAM when possible"""
+        if self.datagram_limit:
+            payload = pack({"v": self.wire_version, **msg})
+            if len(payload) <= self.datagram_limit:
+                if len(self._quic._datagrams_pending) < MAX_PENDING_DATAGRAMS:
+                    self._quic.send_datagram_frame(payload)
+                    self._transmit_soon()
+                return
+        self.write(msg)
+
+    async def keep_alive(self, interval: float) -> None:
+        """Send a QUIC PING whenever nothing has been received for `interval` seconds"""
+        while not self._closed.is_set():
+            wait = self.last_seen + interval - self._loop.time()
+            if wait <= 0:
+                self._quic.send_ping(0)  # Nobody waits for this one; see ping() for that
+                self.transmit()
+                self.pings += 1
+                wait = interval
+            await asyncio.sleep(wait)
+
+    async def send_message(self, msg: dict):
+        try:
+            self.write(msg)
+        except Exception as e:
+            logging.error(f"Error sending message: {e}")
+            return
+        if self.writer.buffered() >= self.send_buffer:
+            self._writable.clear()
+            await self._writable.wait()
+
+    async def authenticate(self, username: str, password: Optional[str] = None,
+                           token: Optional[str] = None, timeout: float = 10) -> bool:
+        """Send an AUTH_REQ with a password or a resume token and wait for the answer"""
+        self.auth_done.clear()
+        self.token = None
+        await self.send_message({"t": MsgType.AUTH_REQ, "to": username, "body": password, "token": token,
+                                 "zdict": DICTIONARY_ID if self.compressor is not None else None})
+        try:
+            await asyncio.wait_for(self.auth_done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.token is not None
+
+class ChatClient:
+    """
+    Importable chat client for bots and integrations.
+
+        async with ChatClient("localhost", 4433) as client:
+            if await client.login("bot", "secret"):
+                await client.send("hello")
+                async for message in client.messages():
+                    ...
+
+    Every received message, including AUTH_OK and presence updates, is
+    yielded by messages() as a dict with the wire fields ("t", "body", ...).
+    """
+    def __init__(self, host: str, port: int, alpn_protocols: Sequence[str] = (ALPN_BINARY, ALPN_JSON),
+                 stream_mode: str = STREAM_MODE_SESSION, verify: bool = False, inbox_size: int = 1024,
+                 send_buffer: int = 1024 * 1024, session_ticket: Optional[SessionTicket] = None,
+                 session_ticket_handler: Optional[Callable[[SessionTicket], None]] = None,
+                 compression: bool = True, datagrams: bool = True, idle_timeout: float = 60.0,
+                 keep_alive_interval: Optional[float] = 20.0, protocol_class=ChatClientProtocol):
+        self.host = host
+        self.port = port
+        self.configuration = QuicConfiguration(is_client=True, alpn_protocols=list(alpn_protocols))
+        if not verify:
+            self.configuration.verify_mode = 0  # Accept self-signed certificates
+        self.configuration.session_ticket = session_ticket  # Resumes the TLS session, allowing 0-RTT
+        if datagrams:
+            self.configuration.max_datagram_frame_size = MAX_DATAGRAM_FRAME_SIZE
+        # Keep-alive PINGs must come well inside both sides' idle timeouts
+        self.configuration.idle_timeout = idle_timeout
+        self.keep_alive_interval = keep_alive_interval
+        self.session_ticket_handler = session_ticket_handler
+        self.stream_mode = stream_mode
+        self.inbox_size = inbox_size
+        self.send_buffer = send_buffer
+        self.compression = compression
+        self.protocol_class = protocol_class
+        self.protocol: Optional[ChatClientProtocol] = None
+        self.username: Optional[str] = None
+        self._stack: Optional[AsyncExitStack] = None
+
+    async def connect(self, wait_connected: bool = True) -> ChatClientProtocol:
+        """Open the connection; without waiting, login() can go out as 0-RTT early data"""
+        self._stack = AsyncExitStack()
+        self.protocol = await self._stack.enter_async_context(connect(
+            self.host,
+            self.port,
+            configuration=self.configuration,
+            create_protocol=lambda *args, **kwargs: self.protocol_class(
+                *args, stream_mode=self.stream_mode, inbox_size=self.inbox_size,
+                send_buffer=self.send_buffer, compression=self.compression, **kwargs
+            ),
+            session_ticket_handler=self.session_ticket_handler,
+            wait_connected=False
+        ))
+        if self.keep_alive_interval:
+            keep_alive = asyncio.create_task(self.protocol.keep_alive(self.keep_alive_interval))
+            self._stack.callback(keep_alive.cancel)
+        if wait_connected:
+            await self.protocol.wait_connected()
+        return self.protocol
+
+    async def close(self) -> None:
+        if self._stack is not None:
+            stack, self._stack = self._stack, None
+            await stack.aclose()
+            self.protocol.close_inbox()
+
+    async def __aenter__(self) -> 'ChatClient':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    @property
+    def token(self) -> Optional[str]:
+        return self.protocol.token if self.protocol else None
+
+    @property
+    def online_users(self) -> set:
+        return self.protocol.state_manager.online_users
+
+    @property
+    def rooms(self) -> set:
+        return self.protocol.state_manager.rooms
+
+    async def login(self, username: str, password: Optional[str] = None, token: Optional[str] = None,
+                    timeout: float = 10) -> bool:
+        """Authenticate with a password or an earlier session token; resolves on AUTH_OK or AUTH_BAD"""
+        if await self.protocol.authenticate(username, password=password, token=token, timeout=timeout):
+            self.username = username
+            return True
+        return False
+
+    def messages(self) -> AsyncIterator[dict]:
+        """Iterate over received messages until the connection closes"""
+        return self.protocol.messages()
+
+    async def send(self, body: str, to: Optional[str] = None, room: Optional[str] = None) -> None:
+        """Send a chat message to everyone, one user (`to`) or a room"""
+        msg = {"t": MsgType.CHAT, "body": body, "to": to}
+        if room:
+            msg["room"] = room
+        await self.protocol.send_message(msg)
+
+    def typing(self, to: Optional[str] = None, room: Optional[str] = None) -> None:
+        """Tell others that this user is typing; the server rate-limits and merges these"""
+        self.protocol.send_ephemeral({"t": MsgType.TYPING, "to": to, "room": room})
+
+    def ping(self) -> None:
+        """Send a presence ping"""
+        self.protocol.send_ephemeral({"t": MsgType.PING})
+
+    async def join(self, room: str) -> None:
+        await self.protocol.send_message({"t": MsgType.ROOM_JOIN, "room": room})
+
+    async def leave(self, room: str) -> None:
+        await self.protocol.send_message({"t": MsgType.ROOM_LEAVE, "room": room})
+
+    async def list_rooms(self) -> None:
+        """Ask for the room list; the answer arrives as a ROOM_LIST message"""
+        await self.protocol.send_message({"t": MsgType.ROOM_LIST})
+
+    async def history(self, count: Optional[int] = None) -> None:
+        """Ask for the last `count` messages (the server's page size by default)"""
+        await self.protocol.send_message({"t": MsgType.HISTORY, "body": str(count or "")})
+
+    async def more_history(self) -> bool:
+        """Ask for the next history page; returns False when there is none"""
+        if self.protocol.history_cursor is None:
+            return False
+        await self.protocol.send_message({"t": MsgType.HISTORY, "seq": self.protocol.history_cursor})
+        return True
\ No newline at end of file
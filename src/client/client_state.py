@@ -38,7 +38,7 @@
 
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Iterable, Optional, Set
 from src.protocol.states import StateManager, ConnectionState
 
 @dataclass
@@ -51,6 +51,9 @@ class ClientStateManager:
     def __init__(self):
         self.state_manager = StateManager()
         self.config = ClientConfig(username="")
+        self.online_users: Set[str] = set()
+        self.presence_version: Optional[int] = None  # None until the first snapshot arrives
+        self.rooms: Set[str] = set()  # Rooms joined in this session
         
     def set_username(self, username: str):
         self.config.username = username
@@ -61,6 +64,23 @@ class ClientStateManager:
     def set_last_message(self, message: str):
         self.config.last_message = message
         
+    def apply_presence_snapshot(self, version: int, users: Iterable[str]):
+        self.online_users = set(users)
+        self.presence_version = version
+
+    def apply_presence_delta(self, version: int, joined: Iterable[str], left: Iterable[str]) -> bool:
+        """
+        Apply a presence delta.
+        Returns False if deltas were missed and a fresh snapshot is needed.
+        """
+        if self.presence_version is None or version > self.presence_version + 1:
+            return False
+        if version == self.presence_version + 1:
+            self.online_users.update(joined)
+            self.online_users.difference_update(left)
+            self.presence_version = version
+        return True  # Older deltas are already covered by the snapshot
+        
     def transition_to(self, state: ConnectionState, error_msg: str = None) -> bool:
         return self.state_manager.transition_to(state, error_msg)
     
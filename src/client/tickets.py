@@ -0,0 +1,122 @@
+#tickets.py
+import base64
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from aioquic.tls import CipherSuite, SessionTicket
+
+@dataclass
+class ResumeEntry:
+    """What a client keeps per server to reconnect quickly"""
+    ticket: Optional[SessionTicket] = None  # TLS session ticket for resumption and 0-RTT
+    username: Optional[str] = None
+    token: Optional[str] = None  # Session token from the last AUTH_OK, sent instead of the password
+    wire_version: Optional[int] = None  # Wire format negotiated last time, used before ALPN is known
+
+def ticket_to_json(ticket: SessionTicket) -> Dict[str, Any]:
+    """The fields of a session ticket as JSON values, bytes in base64"""
+    return {
+        "age_add": ticket.age_add,
+        "cipher_suite": int(ticket.cipher_suite),
+        "not_valid_after": ticket.not_valid_after.isoformat(),
+        "not_valid_before": ticket.not_valid_before.isoformat(),
+        "resumption_secret": base64.b64encode(ticket.resumption_secret).decode(),
+        "server_name": ticket.server_name,
+        "ticket": base64.b64encode(ticket.ticket).decode(),
+        "max_early_data_size": ticket.max_early_data_size,
+        "other_extensions": [[kind, base64.b64encode(value).decode()] for kind, value in ticket.other_extensions],
+    }
+
+def ticket_from_json(data: Dict[str, Any]) -> SessionTicket:
+    return SessionTicket(
+        age_add=int(data["age_add"]),
+        cipher_suite=CipherSuite(data["cipher_suite"]),
+        not_valid_after=datetime.fromisoformat(data["not_valid_after"]),
+        not_valid_before=datetime.fromisoformat(data["not_valid_before"]),
+        resumption_secret=base64.b64decode(data["resumption_secret"]),
+        server_name=str(data["server_name"]),
+        ticket=base64.b64decode(data["ticket"]),
+        max_early_data_size=data.get("max_early_data_size"),
+        other_extensions=[(int(kind), base64.b64decode(value)) for kind, value in data.get("other_extensions", [])],
+    )
+
+class TicketCache:
+    """
+    On-disk cache of session tickets and resume tokens, keyed by server address.
+
+    The file is plain JSON, so a tampered one can at worst hold bad
+    credentials; entries that do not parse are dropped.
+    """
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self._entries: Dict[str, ResumeEntry] = {}
+        self._load()
+
+    @staticmethod
+    def key(host: str, port: int) -> str:
+        return f"{host}:{port}"
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable ticket cache {self.path}: {e}")
+            return
+        if not isinstance(data, dict):
+            logging.warning(f"Ignoring unreadable ticket cache {self.path}")
+            return
+        for key, fields in data.items():
+            try:
+                ticket = fields.get("ticket")
+                self._entries[key] = ResumeEntry(
+                    ticket=ticket_from_json(ticket) if ticket is not None else None,
+                    username=fields.get("username"), token=fields.get("token"),
+                    wire_version=fields.get("wire_version"))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                logging.warning(f"Ignoring bad ticket cache entry for {key}: {e}")
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Tickets and tokens are credentials: keep the file private to the user
+        fd = os.open(self.path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        data = {key: dict(asdict(entry), ticket=ticket_to_json(entry.ticket) if entry.ticket else None)
+                for key, entry in self._entries.items()}
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def get(self, host: str, port: int) -> ResumeEntry:
+        """Return the entry for a server, dropping a ticket that has expired"""
+        entry = self._entries.get(self.key(host, port)) or ResumeEntry()
+        if entry.ticket is not None and not entry.ticket.is_valid:
+            entry.ticket = None
+        return entry
+
+    def store_ticket(self, host: str, port: int, ticket: SessionTicket) -> None:
+        """session_ticket_handler for connect(): keep the newest ticket"""
+        entry = self._entries.setdefault(self.key(host, port), ResumeEntry())
+        entry.ticket = ticket
+        self._save()
+
+    def store_session(self, host: str, port: int, username: str, token: Optional[str],
+                      wire_version: Optional[int]) -> None:
+        """Remember the session token issued on login"""
+        entry = self._entries.setdefault(self.key(host, port), ResumeEntry())
+        entry.username = username
+        entry.token = token
+        entry.wire_version = wire_version
+        self._save()
+
+    def drop_token(self, host: str, port: int) -> None:
+        """Forget a session token the server rejected"""
+        entry = self._entries.get(self.key(host, port))
+        if entry is not None and entry.token is not None:
+            entry.token = None
+            self._save()
\ No newline at end of file
@@ -1,13 +1,29 @@
 from .message import MsgType, pack, unpack, Message  # Added Message to imports
+from .message import pack_binary, unpack_binary, wire_version_for_alpn
+from .message import JSON_VERSION, BINARY_VERSION, ALPN_JSON, ALPN_BINARY
 from .states import ConnectionState, StateManager
 from .auth import AuthManager
+from .user_store import UserStore, MemoryUserStore, SQLiteUserStore
+from .compression import Compressor, DICTIONARY_ID
 
 __all__ = [
     'Message',  # Added Message to __all__
     'MsgType',
     'pack',
     'unpack',
+    'pack_binary',
+    'unpack_binary',
+    'wire_version_for_alpn',
+    'JSON_VERSION',
+    'BINARY_VERSION',
+    'ALPN_JSON',
+    'ALPN_BINARY',
     'ConnectionState',
     'StateManager',
-    'AuthManager'
+    'AuthManager',
+    'UserStore',
+    'MemoryUserStore',
+    'SQLiteUserStore',
+    'Compressor',
+    'DICTIONARY_ID'
 ]
\ No newline at end of file
@@ -1,52 +1,139 @@
+import asyncio
+import secrets
 import time
 import bcrypt
-from typing import Optional, Dict
+from collections import OrderedDict
+from typing import Any, Optional, Dict
 from jose import jwt
 
+from .user_store import MemoryUserStore, UserStore
+
+# What a token may be used for, in its "use" claim
+TOKEN_ACCESS = "access"
+TOKEN_RESUME = "resume"  # Stands in for the password on reconnect; short-lived
+
+def hash_password(password: str, rounds: int = 12) -> bytes:
+    """Hash a password with bcrypt (CPU heavy, safe to run in a worker)"""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds))
+
+def check_password(password: str, hashed: bytes) -> bool:
+    """Compare a password with a bcrypt hash (CPU heavy, safe to run in a worker)"""
+    return bcrypt.checkpw(password.encode("utf-8"), hashed)
+
+class ClaimsCache:
+    """Small LRU cache of decoded token claims; entries are dropped once their exp has passed"""
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._claims: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return the cached claims of a token that has not expired yet"""
+        claims = self._claims.get(token)
+        if claims is None:
+            self.misses += 1
+            return None
+        if claims.get("exp", 0) <= time.time():
+            del self._claims[token]
+            self.misses += 1
+            return None
+        self._claims.move_to_end(token)
+        self.hits += 1
+        return claims
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        self._claims[token] = claims
+        self._claims.move_to_end(token)
+        while len(self._claims) > self.max_size:
+            self._claims.popitem(last=False)
+
 class AuthManager:
-    def __init__(self, secret_key: str = "your-very-secret-key"):
+    def __init__(self, secret_key: Optional[str] = None, bcrypt_rounds: int = 12,
+                 claims_cache_size: int = 1024, store: Optional[UserStore] = None, resume_lifetime: int = 900):
         # Initialize with secret key, algorithm, and token expiration time
-        self._SECRET = secret_key
+        # Without a key, tokens are signed with a random one and only accepted by this instance
+        self._SECRET = secret_key or secrets.token_urlsafe(32)
         self._ALGORITHM = "HS256"  # Algorithm for JWT encoding
         self._EXPIRATION = 3600  # Token expiration in seconds
-        self._users: Dict[str, bytes] = {}  # Dictionary for storing username and hashed passwords
+        self._LIFETIMES = {TOKEN_ACCESS: self._EXPIRATION, TOKEN_RESUME: resume_lifetime}
+        self.bcrypt_rounds = bcrypt_rounds  # Work factor for new password hashes
+        self.store = store if store is not None else MemoryUserStore()  # Usernames and hashed passwords
+        self._claims = ClaimsCache(claims_cache_size)  # Saves decoding a token checked again
 
     def register(self, username: str, password: str) -> bool:
         """Register a new user"""
         # Check if username already exists
-        if username in self._users:
+        if self.store.get_hash(username) is not None:
             return False  # Registration fails if user exists
         
         # Hash the password and store it
-        hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-        self._users[username] = hashed
-        return True  # Registration is successful
+        return self.store_hash(username, hash_password(password, self.bcrypt_rounds))
 
     def verify(self, username: str, password: str) -> bool:
         """Verify user credentials"""
         # Retrieve the hashed password
-        hashed = self._users.get(username)
+        hashed = self.store.get_hash(username)
         if not hashed:
             return False  # Return false if user is not found
         
         # Compare provided password with stored hash
-        return bcrypt.checkpw(password.encode("utf-8"), hashed)
+        return check_password(password, hashed)
+
+    def get_hash(self, username: str) -> Optional[bytes]:
+        """Return the stored password hash of a user"""
+        return self.store.get_hash(username)
 
-    def issue_token(self, username: str) -> str:
-        """Issue a JWT token for authenticated user"""
-        # Create payload with subject and expiration
+    def store_hash(self, username: str, hashed: bytes) -> bool:
+        """Store a precomputed password hash for a new user"""
+        return self.store.add(username, hashed)  # False when another registration won the race
+
+    async def get_hash_async(self, username: str) -> Optional[bytes]:
+        """Return the stored password hash of a user, looked up off the event loop"""
+        return await self.store.get_hash_async(username)
+
+    async def store_hash_async(self, username: str, hashed: bytes) -> bool:
+        """Store a precomputed password hash for a new user off the event loop"""
+        return await self.store.add_async(username, hashed)
+
+    async def register_async(self, username: str, password: str) -> bool:
+        """Register a new user; hashing and storage run off the event loop"""
+        if await self.store.get_hash_async(username) is not None:
+            return False
+        hashed = await asyncio.get_running_loop().run_in_executor(None, hash_password, password, self.bcrypt_rounds)
+        return await self.store.add_async(username, hashed)
+
+    async def verify_async(self, username: str, password: str) -> bool:
+        """Verify user credentials; lookup and hash check run off the event loop"""
+        hashed = await self.store.get_hash_async(username)
+        if not hashed:
+            return False
+        return await asyncio.get_running_loop().run_in_executor(None, check_password, password, hashed)
+
+    def issue_token(self, username: str, use: str = TOKEN_ACCESS) -> str:
+        """Issue a JWT token for authenticated user, good for one kind of use"""
+        # Create payload with subject, purpose and expiration
         payload = {
             "sub": username,
-            "exp": int(time.time()) + self._EXPIRATION  # Set token expiration
+            "use": use,
+            "exp": int(time.time()) + self._LIFETIMES[use]  # Set token expiration
         }
         # Encode the payload to create a JWT
         return jwt.encode(payload, self._SECRET, algorithm=self._ALGORITHM)
 
-    def validate_token(self, token: str) -> Optional[str]:
+    def validate_token(self, token: str, use: str = TOKEN_ACCESS) -> Optional[str]:
         """Validate JWT token and return username if valid"""
-        try:
-            # Decode the token to retrieve data
-            data = jwt.decode(token, self._SECRET, algorithms=[self._ALGORITHM])
-            return data.get("sub")  # Return username if token is valid
-        except Exception:
-            return None  # Return None if token is invalid or expired
\ No newline at end of file
+        claims = self.token_claims(token, use)
+        return claims.get("sub") if claims else None  # Return username if token is valid
+
+    def token_claims(self, token: str, use: str = TOKEN_ACCESS) -> Optional[Dict[str, Any]]:
+        """Return the claims of a valid, unexpired token issued for `use`"""
+        data = self._claims.get(token)
+        if data is None:
+            try:
+                # Decode the token to retrieve data
+                data = jwt.decode(token, self._SECRET, algorithms=[self._ALGORITHM])
+            except Exception:
+                return None  # Return None if token is invalid or expired
+            self._claims.put(token, data)
+        return data if data.get("use") == use else None
\ No newline at end of file
@@ -0,0 +1,122 @@
+#compression.py
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, Optional
+
+# First byte of a compressed message; JSON starts with "{" and binary with its version (2)
+COMPRESSED_TAG = b"\x03"
+
+# Raw deflate with a 4 KiB window: no zlib header or checksum, and the
+# per-message compressor state stays small. The dictionary fits the window.
+_WBITS = -12
+_MEM_LEVEL = 5
+DICTIONARY_SIZE = 4096
+MAX_MESSAGE_SIZE = 1 << 20  # Same bound as a frame
+
+# Representative traffic the preset dictionary is trained from: wire-format
+# fragments, the server's system messages and everyday chat.
+_SAMPLE_TRAFFIC = (
+    '{"v": 1, "t": 3, "body": "alice: hi", "to": null, "token": null}',
+    '{"v": 1, "t": 4, "body": "User \'bob\' joined the chat.", "to": null, "token": null}',
+    '{"v": 1, "t": 3, "body": "[general] carol: ok", "to": null, "token": null, "room": "general"}',
+    '{"v": 1, "t": 1, "body": "Welcome, dave", "to": null, "token": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9"}',
+    '{"v": 1, "t": 5, "body": "", "to": null, "token": null, "seq": 12}',
+    "User 'alice' joined the chat.", "User 'bob' left the chat.", "User 'carol' joined the chat.",
+    "User 'dave' left the chat.", "Online users: alice, bob, carol, dave",
+    "Authentication failed.", "Please authenticate first.", "Unknown command.",
+    "Joined room 'general'.", "Left room 'general'.", "Not in room 'random'.", "Already in room 'random'.",
+    "User 'erin' is not online.", "History is not enabled.", "Welcome, erin",
+    "[Private] alice: are you there?", "[Private to bob] are you there?",
+    "[Private] bob: yes, what's up?", "[Private to alice] yes, what's up?",
+    "[general] carol: good morning everyone", "[random] dave: has anyone seen the latest build?",
+    "alice: hello everyone", "bob: hello everyone, how is it going?", "carol: good morning everyone",
+    "dave: thanks, that is great", "erin: I think that is a good idea", "alice: what do you think about it?",
+    "bob: I don't know, let me check", "carol: sounds good to me", "dave: can you send me the link?",
+    "erin: I will be there in five minutes", "alice: thank you so much", "bob: see you later",
+    "carol: yes, I think so", "dave: no problem, happy to help", "erin: did you see the message?",
+    "alice: the meeting is at 3 pm today", "bob: I'm working on it right now",
+    "carol: let me know if you need anything", "dave: that makes sense, thanks for the update",
+    "erin: good night everyone", "alice: lol that is so funny", "bob: are you coming to the meeting?",
+    "carol: I have a question about the project", "dave: please check the latest version",
+    "erin: ok, I will do that", "alice: it works for me now", "bob: can we talk about this tomorrow?",
+)
+
+def train_dictionary(samples: Iterable[bytes], size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    Build a preset dictionary from sample messages.
+
+    Runs of one to four words that recur across the samples are scored by
+    how many bytes they would save and packed until `size` is reached, most
+    valuable last: deflate reaches the end of the dictionary with the
+    shortest back-references.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        tokens = [token for token in re.split(rb"(?<=[ ,.:'\"])", sample) if token]
+        for n in range(1, 5):
+            for i in range(len(tokens) - n + 1):
+                counts[b"".join(tokens[i:i + n])] += 1
+    ranked = sorted(((count * len(text), text) for text, count in counts.items()
+                     if count > 1 and len(text) >= 3), reverse=True)
+    chosen, total = [], 0
+    for _, text in ranked:
+        if total + len(text) > size or any(text in kept for kept in chosen):
+            continue
+        chosen.append(text)
+        total += len(text)
+    return b"".join(reversed(chosen))
+
+CHAT_DICTIONARY = train_dictionary(sample.encode("utf-8") for sample in _SAMPLE_TRAFFIC)
+# Sent in the "zdict" field to negotiate compression; peers with another dictionary do not match
+DICTIONARY_ID = zlib.adler32(CHAT_DICTIONARY)
+
+class Compressor:
+    """
+    Per-message deflate against the shared chat dictionary.
+
+    Every message is compressed on its own, so one compressed payload can be
+    written to any number of connections. The dictionary is primed once and
+    each message starts from a copy of that state. Messages shorter than
+    `threshold` bytes, or that do not shrink, are sent as they are.
+    """
+    def __init__(self, threshold: int = 64, level: int = 6, dictionary: bytes = CHAT_DICTIONARY):
+        self.threshold = threshold
+        self._template = zlib.compressobj(level, zlib.DEFLATED, _WBITS, _MEM_LEVEL,
+                                          zlib.Z_DEFAULT_STRATEGY, dictionary)
+        self.messages = 0    # Payloads offered
+        self.compressed = 0  # Payloads sent compressed
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['Compressor']:
+        """Build the compressor from a configuration; None when compression is off"""
+        if not config.get("compression", True):
+            return None
+        return cls(threshold=config.get("compression_threshold", 64),
+                   level=config.get("compression_level", 6))
+
+    def compress(self, payload: bytes) -> bytes:
+        """Return the payload to send: tagged deflate data, or the payload itself"""
+        self.messages += 1
+        self.bytes_in += len(payload)
+        if len(payload) >= self.threshold:
+            deflate = self._template.copy()
+            data = COMPRESSED_TAG + deflate.compress(payload) + deflate.flush()
+            if len(data) < len(payload):
+                self.compressed += 1
+                payload = data
+        self.bytes_out += len(payload)
+        return payload
+
+def decompress(data: bytes, max_size: int = MAX_MESSAGE_SIZE, dictionary: bytes = CHAT_DICTIONARY) -> bytes:
+    """Inflate a payload produced by Compressor.compress()"""
+    inflate = zlib.decompressobj(_WBITS, dictionary)
+    try:
+        payload = inflate.decompress(memoryview(data)[1:], max_size)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt compressed message: {e}")
+    if inflate.unconsumed_tail or not inflate.eof:
+        raise ValueError("Compressed message is truncated or inflates past the size limit")
+    return payload
\ No newline at end of file
@@ -0,0 +1,25 @@
+#datagram.py
+from typing import Optional
+
+from .message import MsgType
+
+# Advertised in the max_datagram_frame_size transport parameter
+MAX_DATAGRAM_FRAME_SIZE = 65536
+
+# Largest message sent as a DATAGRAM. A datagram must fit in one packet:
+# aioquic keeps an oversized one at the head of its queue forever, so larger
+# messages go over the stream instead.
+DATAGRAM_MAX_PAYLOAD = 1000
+
+# Datagrams queued inside QUIC per connection before new ones are dropped
+MAX_PENDING_DATAGRAMS = 64
+
+# Messages that may travel as unreliable datagrams; anything else is ignored there
+EPHEMERAL_TYPES = frozenset((MsgType.TYPING, MsgType.PING))
+
+def datagram_payload_limit(quic) -> int:
+    """Largest datagram payload both peers accept; 0 when DATAGRAM was not negotiated"""
+    remote: Optional[int] = quic._remote_max_datagram_frame_size
+    if remote is None or quic.configuration.max_datagram_frame_size is None:
+        return 0
+    return min(DATAGRAM_MAX_PAYLOAD, remote)
\ No newline at end of file
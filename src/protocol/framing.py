@@ -0,0 +1,135 @@
+#framing.py
+import struct
+from typing import Dict, List, Optional
+
+from .message import BINARY_VERSION
+
+# Stream usage modes
+STREAM_MODE_SESSION = "session"          # One long-lived stream per direction
+STREAM_MODE_PER_MESSAGE = "per_message"  # A new stream for every frame
+
+# Each frame is a 4-byte big-endian length followed by the encoded message
+_LENGTH = struct.Struct("!I")
+MAX_FRAME_SIZE = 1 << 20
+
+# First bytes of messages sent without framing: a JSON document or a binary message
+_UNFRAMED_TAGS = (b"{", bytes([BINARY_VERSION]))
+
+def frame(payload: bytes) -> bytes:
+    """Prefix an encoded message with its length"""
+    return _LENGTH.pack(len(payload)) + payload
+
+class FrameBuffer:
+    """Reassembly buffer for a stream of length-prefixed frames"""
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self._buffer = bytearray()
+        self._max_frame_size = max_frame_size
+
+    def feed(self, data: bytes, end_stream: bool = False) -> List[bytes]:
+        """Append received data and return every frame it completes"""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        offset = 0
+        size = len(buffer)
+        header = _LENGTH.size
+        while size - offset >= header:
+            (length,) = _LENGTH.unpack_from(buffer, offset)
+            if length > self._max_frame_size:
+                raise ValueError(f"Frame of {length} bytes exceeds limit of {self._max_frame_size}")
+            end = offset + header + length
+            if end > size:
+                break
+            frames.append(bytes(buffer[offset + header:end]))
+            offset = end
+        if offset:
+            del buffer[:offset]
+        return frames
+
+    @property
+    def pending(self) -> int:
+        """Number of buffered bytes belonging to an incomplete frame"""
+        return len(self._buffer)
+
+class UnframedBuffer:
+    """Reassembly buffer for a stream carrying exactly one unframed message"""
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes, end_stream: bool = False) -> List[bytes]:
+        """Append received data and return the message once the stream ends"""
+        self._buffer += data
+        if end_stream and self._buffer:
+            return [bytes(self._buffer)]
+        return []
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+class StreamReassembler:
+    """
+    Per-stream receive buffers for one connection.
+
+    Each stream is classified by its first byte: streams opened by legacy
+    peers carry one unframed message and end with the stream, while framed
+    streams may carry any number of frames split across any number of events.
+    """
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self._streams: Dict[int, object] = {}
+        self._max_frame_size = max_frame_size
+        self.framed: Optional[bool] = None  # Whether the peer frames its messages
+
+    def feed(self, stream_id: int, data: bytes, end_stream: bool) -> List[bytes]:
+        """Feed a StreamDataReceived payload and return the complete messages"""
+        buffer = self._streams.get(stream_id)
+        if buffer is None:
+            if not data:
+                return []
+            if data[:1] in _UNFRAMED_TAGS:
+                buffer = UnframedBuffer()
+                self.framed = False
+            else:
+                buffer = FrameBuffer(self._max_frame_size)
+                self.framed = True
+            self._streams[stream_id] = buffer
+        try:
+            return buffer.feed(data, end_stream)
+        finally:
+            if end_stream:
+                del self._streams[stream_id]
+
+    @property
+    def pending(self) -> int:
+        """Total number of buffered bytes across all streams"""
+        return sum(buffer.pending for buffer in self._streams.values())
+
+class FrameWriter:
+    """Writes encoded messages to a QUIC connection using the configured stream mode"""
+    def __init__(self, quic, mode: str = STREAM_MODE_SESSION, framed: bool = True):
+        self._quic = quic
+        self.mode = mode
+        self.framed = framed  # Legacy peers only understand one unframed message per stream
+        self._stream_id: Optional[int] = None
+
+    def encode(self, payload: bytes) -> bytes:
+        """Turn an encoded message into the bytes written to the stream"""
+        return frame(payload) if self.framed else payload
+
+    def buffered(self) -> int:
+        """Bytes handed to QUIC that the peer has not acknowledged yet"""
+        streams = self._quic._streams
+        if self.framed and self.mode == STREAM_MODE_SESSION:
+            stream = streams.get(self._stream_id)
+            return len(stream.sender._buffer) if stream is not None else 0
+        return sum(len(stream.sender._buffer) for stream in streams.values())
+
+    def write(self, data: bytes) -> None:
+        """Queue bytes produced by encode() on the appropriate stream"""
+        if self.framed and self.mode == STREAM_MODE_SESSION:
+            if self._stream_id is None:
+                self._stream_id = self._quic.get_next_available_stream_id()
+            self._quic.send_stream_data(self._stream_id, data, end_stream=False)
+        else:
+            stream_id = self._quic.get_next_available_stream_id()
+            self._quic.send_stream_data(stream_id, data, end_stream=True)
@@ -1,15 +1,33 @@
 #message.py
 import json
+import struct
 from enum import IntEnum
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
 
+from .compression import COMPRESSED_TAG, decompress
+
+JSON_VERSION = 1    # Original JSON wire format
+BINARY_VERSION = 2  # Compact struct-based wire format
+
+# ALPN identifiers, one per wire format
+ALPN_JSON = "chat/1"
+ALPN_BINARY = "chat/2"
+
 class MsgType(IntEnum):
     AUTH_REQ = 0  # Client authentication request
     AUTH_OK = 1   # Server authentication success
     AUTH_BAD = 2  # Authentication failure
     CHAT = 3      # Chat messages
     SYS = 4       # System messages
+    PRESENCE = 5           # Presence delta: users joined/left since the previous version
+    PRESENCE_SNAPSHOT = 6  # Full online-user list; also sent by clients to request one
+    ROOM_JOIN = 7   # Join the room named in "room"
+    ROOM_LEAVE = 8  # Leave the room named in "room"
+    ROOM_LIST = 9   # Request / reply with the list of rooms and their sizes
+    HISTORY = 10    # Request ("seq": since, or "body": last N) / reply with a page of past messages
+    TYPING = 11     # "To" / "room" / everyone is being typed to; relayed with the typers' names in "body"
+    PING = 12       # Presence ping from a client; needs no answer
 
 @dataclass
 class Message:
@@ -38,10 +56,88 @@ class Message:
             token=data.get("token")
         )
 
+# Binary header: version, message type, field-presence bits
+_HEADER = struct.Struct("!BBH")
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+_U64 = struct.Struct("!Q")
+_BINARY_TAG = bytes([BINARY_VERSION])  # JSON documents never start with this byte
+
+# Optional fields in wire order as (key, struct, is_text). Text fields are UTF-8
+# preceded by a length of the given struct; other fields are the packed value.
+# Bit i of the presence bits is set when field i is present.
+_FIELDS = (
+    ("body", _U32, True),
+    ("to", _U16, True),
+    ("token", _U16, True),
+    ("seq", _U64, False),
+    ("room", _U16, True),
+    ("zdict", _U32, False),  # Compression dictionary id, negotiated in AUTH_REQ / AUTH_OK
+)
+
+# Fields decoded as None when absent; any other absent field is left out
+_CORE_FIELDS = ("body", "to", "token")
+
+_FIELD_TABLE = tuple(
+    (1 << bit, key, field_struct, is_text, key in _CORE_FIELDS)
+    for bit, (key, field_struct, is_text) in enumerate(_FIELDS)
+)
+
+def wire_version_for_alpn(alpn_protocol: Optional[str]) -> int:
+    """Map a negotiated ALPN protocol to a wire format version"""
+    if alpn_protocol == ALPN_BINARY:
+        return BINARY_VERSION
+    return JSON_VERSION
+
+def pack_binary(msg: Dict[str, Any]) -> bytes:
+    """Serialize message to the binary wire format"""
+    flags = 0
+    parts = [b""]
+    for bit, key, field_struct, is_text, _ in _FIELD_TABLE:
+        value = msg.get(key)
+        if value is None:
+            continue
+        flags |= bit
+        if is_text:
+            raw = value.encode("utf-8")
+            parts.append(field_struct.pack(len(raw)))
+            parts.append(raw)
+        else:
+            parts.append(field_struct.pack(value))
+    parts[0] = _HEADER.pack(BINARY_VERSION, int(msg.get("t", MsgType.CHAT)), flags)
+    return b"".join(parts)
+
+def unpack_binary(data: bytes) -> Dict[str, Any]:
+    """Deserialize message from the binary wire format"""
+    version, msg_type, flags = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+    msg: Dict[str, Any] = {"v": version, "t": msg_type}
+    for bit, key, field_struct, is_text, core in _FIELD_TABLE:
+        if not flags & bit:
+            if core:
+                msg[key] = None
+            continue
+        (value,) = field_struct.unpack_from(data, offset)
+        offset += field_struct.size
+        if is_text:
+            end = offset + value
+            if end > len(data):
+                raise ValueError(f"Truncated binary message: field '{key}'")
+            value = bytes(data[offset:end]).decode("utf-8")
+            offset = end
+        msg[key] = value
+    return msg
+
 def pack(msg: Dict[str, Any]) -> bytes:
-    """Serialize message to bytes"""
+    """Serialize message to bytes using the format selected by its "v" field"""
+    if msg.get("v") == BINARY_VERSION:
+        return pack_binary(msg)
     return json.dumps(msg).encode("utf-8")
 
 def unpack(data: bytes) -> Dict[str, Any]:
-    """Deserialize message from bytes"""
+    """Deserialize message from bytes, detecting JSON or binary format and compression"""
+    if data[:1] == COMPRESSED_TAG:
+        data = decompress(data)
+    if data[:1] == _BINARY_TAG:
+        return unpack_binary(data)
     return json.loads(data.decode("utf-8"))
\ No newline at end of file
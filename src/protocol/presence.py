@@ -0,0 +1,27 @@
+#presence.py
+from typing import Iterable, List, Tuple
+
+# Presence bodies hold one username per line; delta lines start with "+" or "-".
+# Deltas are set operations, so applying one twice is harmless.
+
+def encode_presence_delta(joined: Iterable[str], left: Iterable[str]) -> str:
+    """Build the body of a PRESENCE message"""
+    return "\n".join([f"+{u}" for u in joined] + [f"-{u}" for u in left])
+
+def decode_presence_delta(body: str) -> Tuple[List[str], List[str]]:
+    """Split the body of a PRESENCE message into (joined, left)"""
+    joined, left = [], []
+    for line in body.split("\n") if body else []:
+        if line.startswith("+"):
+            joined.append(line[1:])
+        elif line.startswith("-"):
+            left.append(line[1:])
+    return joined, left
+
+def encode_presence_snapshot(users: Iterable[str]) -> str:
+    """Build the body of a PRESENCE_SNAPSHOT message"""
+    return "\n".join(users)
+
+def decode_presence_snapshot(body: str) -> List[str]:
+    """Read the usernames from a PRESENCE_SNAPSHOT message"""
+    return body.split("\n") if body else []
@@ -1,15 +1,34 @@
 #state.py
-from enum import Enum
+from enum import IntEnum
 from typing import Optional
 
-class ConnectionState(Enum):
-    DISCONNECTED = "DISCONNECTED"
-    CONNECTING = "CONNECTING"
-    AUTHENTICATING = "AUTHENTICATING"
-    AUTHENTICATED = "AUTHENTICATED"
-    ERROR = "ERROR"
+class ConnectionState(IntEnum):
+    """Small ints, so tables of many sessions store a state in no more than a reference"""
+    DISCONNECTED = 0
+    CONNECTING = 1
+    AUTHENTICATING = 2
+    AUTHENTICATED = 3
+    ERROR = 4
+
+def _mask(*states: ConnectionState) -> int:
+    return sum(1 << state for state in states)
+
+# Allowed transitions, indexed by the current state: bit n is set when state n may follow
+TRANSITIONS = (
+    _mask(ConnectionState.CONNECTING),                                     # DISCONNECTED
+    _mask(ConnectionState.AUTHENTICATING, ConnectionState.ERROR),          # CONNECTING
+    _mask(ConnectionState.AUTHENTICATED, ConnectionState.ERROR),           # AUTHENTICATING
+    _mask(ConnectionState.DISCONNECTED, ConnectionState.ERROR),            # AUTHENTICATED
+    _mask(ConnectionState.DISCONNECTED),                                   # ERROR
+)
+
+def can_transition(current: int, new: int) -> bool:
+    """Whether a connection in state `current` may move to state `new`"""
+    return bool(TRANSITIONS[current] >> new & 1)
 
 class StateManager:
+    __slots__ = ("state", "error_message")
+
     def __init__(self):
         self.state = ConnectionState.DISCONNECTED
         self.error_message: Optional[str] = None
@@ -19,15 +38,7 @@ class StateManager:
         Attempt to transition to a new state.
         Returns True if transition is valid and successful.
         """
-        valid_transitions = {
-            ConnectionState.DISCONNECTED: [ConnectionState.CONNECTING],
-            ConnectionState.CONNECTING: [ConnectionState.AUTHENTICATING, ConnectionState.ERROR],
-            ConnectionState.AUTHENTICATING: [ConnectionState.AUTHENTICATED, ConnectionState.ERROR],
-            ConnectionState.AUTHENTICATED: [ConnectionState.DISCONNECTED, ConnectionState.ERROR],
-            ConnectionState.ERROR: [ConnectionState.DISCONNECTED]
-        }
-
-        if new_state in valid_transitions[self.state]:
+        if can_transition(self.state, new_state):
             self.state = new_state
             self.error_message = error_msg if new_state == ConnectionState.ERROR else None
             return True
@@ -39,7 +50,7 @@ class StateManager:
 
     @property
     def is_connected(self) -> bool:
-        return self.state in [ConnectionState.AUTHENTICATED]
+        return self.state == ConnectionState.AUTHENTICATED
 
     @property
     def has_error(self) -> bool:
@@ -0,0 +1,244 @@
+#user_store.py
+import asyncio
+import os
+import queue
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Credential backends
+USER_STORE_MEMORY = "memory"
+USER_STORE_SQLITE = "sqlite"
+
+_USER_STORES = (USER_STORE_MEMORY, USER_STORE_SQLITE)
+
+class UserStore(ABC):
+    """
+    Where AuthManager keeps usernames and their password hashes.
+
+    Records are only ever added: a user keeps the hash registered first. The
+    server calls the async methods, which a backend doing I/O runs off the
+    event loop.
+    """
+    hits = 0    # Lookups answered from memory, for backends with a cache
+    misses = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'UserStore':
+        """Build the user store named in the server configuration"""
+        kind = config.get("user_store", USER_STORE_MEMORY)
+        if kind not in _USER_STORES:
+            raise ValueError(f"Unknown user store: {kind}")
+        if kind == USER_STORE_MEMORY:
+            return MemoryUserStore()
+        return SQLiteUserStore(config.get("user_store_path", "data/users.db"),
+                               pool_size=config.get("user_store_pool_size", 4),
+                               cache_size=config.get("user_cache_size", 10000))
+
+    @abstractmethod
+    def get_hash(self, username: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def add(self, username: str, hashed: bytes) -> bool:
+        """Store the hash of a new user; False if the name is taken"""
+
+    def add_many(self, records: Iterable[Tuple[str, bytes]]) -> int:
+        """Store many new users at once, skipping taken names; returns how many were added"""
+        return sum(self.add(username, hashed) for username, hashed in records)
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    async def get_hash_async(self, username: str) -> Optional[bytes]:
+        return self.get_hash(username)
+
+    async def add_async(self, username: str, hashed: bytes) -> bool:
+        return self.add(username, hashed)
+
+    def close(self) -> None:
+        pass
+
+class MemoryUserStore(UserStore):
+    """Users in a dict: gone on restart and private to the process"""
+    def __init__(self):
+        self._users: Dict[str, bytes] = {}
+
+    def get_hash(self, username: str) -> Optional[bytes]:
+        return self._users.get(username)
+
+    def add(self, username: str, hashed: bytes) -> bool:
+        if username in self._users:
+            return False
+        self._users[username] = hashed
+        return True
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID"
+_SELECT = "SELECT hash FROM users WHERE username = ?"
+_INSERT = "INSERT OR IGNORE INTO users (username, hash) VALUES (?, ?)"
+_COUNT = "SELECT COUNT(*) FROM users"
+
+class SQLiteUserStore(UserStore):
+    """
+    Users in an SQLite database, shared by every process opening the same file.
+
+    The database runs in WAL mode, so lookups go on while another connection
+    writes. Each of the `pool_size` connections keeps its statements
+    compiled, and a lookup is one probe of the primary key. The async
+    methods query on the store's own threads, one per connection. A
+    read-through LRU of `cache_size` records answers hot users on the loop.
+    The misses of one loop pass go to a thread as one batch, and concurrent
+    lookups of one name share a query. Unknown names are not cached, because
+    another process may register them at any time.
+    """
+    def __init__(self, path: str, pool_size: int = 4, cache_size: int = 10000, busy_timeout: float = 5.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._pool: queue.Queue = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect(busy_timeout))
+        with self._connection() as db:
+            db.execute(_SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="users")
+        self._lookups: Dict[str, asyncio.Future] = {}  # Queries queued or in flight, by username
+        self._batch: List[str] = []                    # Names waiting for the next batch
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self, busy_timeout: float) -> sqlite3.Connection:
+        # Autocommit: every insert is its own short transaction, and readers never hold one open
+        db = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None, check_same_thread=False,
+                             cached_statements=16)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # Durable across crashes of the process, not of the host
+        return db
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        db = self._pool.get()
+        try:
+            yield db
+        finally:
+            self._pool.put(db)
+
+    def _select(self, username: str) -> Optional[bytes]:
+        with self._connection() as db:
+            row = db.execute(_SELECT, (username,)).fetchone()
+        return row[0] if row else None
+
+    def _select_many(self, usernames: List[str]) -> List[Optional[bytes]]:
+        with self._connection() as db:
+            rows = [db.execute(_SELECT, (username,)).fetchone() for username in usernames]
+        return [row[0] if row else None for row in rows]
+
+    def _insert(self, username: str, hashed: bytes) -> bool:
+        with self._connection() as db:
+            return db.execute(_INSERT, (username, hashed)).rowcount == 1
+
+    def _cached(self, username: str) -> Optional[bytes]:
+        hashed = self._cache.get(username)
+        if hashed is None:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(username)
+        self.hits += 1
+        return hashed
+
+    def _remember(self, username: str, hashed: bytes) -> None:
+        if not self.cache_size:
+            return
+        self._cache[username] = hashed
+        self._cache.move_to_end(username)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get_hash(self, username: str) -> Optional[bytes]:
+        hashed = self._cached(username)
+        if hashed is None:
+            hashed = self._select(username)
+            if hashed is not None:
+                self._remember(username, hashed)
+        return hashed
+
+    def add(self, username: str, hashed: bytes) -> bool:
+        if not self._insert(username, hashed):
+            return False
+        self._remember(username, hashed)
+        return True
+
+    def add_many(self, records: Iterable[Tuple[str, bytes]]) -> int:
+        with self._connection() as db:
+            before = db.total_changes
+            db.execute("BEGIN")
+            try:
+                db.executemany(_INSERT, records)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return db.total_changes - before
+
+    def __len__(self) -> int:
+        with self._connection() as db:
+            return db.execute(_COUNT).fetchone()[0]
+
+    async def get_hash_async(self, username: str) -> Optional[bytes]:
+        hashed = self._cached(username)
+        if hashed is not None:
+            return hashed
+        lookup = self._lookups.get(username)
+        if lookup is None:
+            loop = asyncio.get_running_loop()
+            lookup = self._lookups[username] = loop.create_future()
+            if not self._batch:
+                loop.call_soon(self._submit_batch, loop)
+            self._batch.append(username)
+        # Shielded, as other logins may be waiting on the same query
+        return await asyncio.shield(lookup)
+
+    def _submit_batch(self, loop: asyncio.AbstractEventLoop) -> None:
+        usernames, self._batch = self._batch, []
+        try:
+            query = loop.run_in_executor(self._executor, self._select_many, usernames)
+        except RuntimeError as e:  # The executor is shut down
+            query = loop.create_future()
+            query.set_exception(e)
+        query.add_done_callback(lambda _: self._resolve(usernames, query))
+
+    def _resolve(self, usernames: List[str], query: asyncio.Future) -> None:
+        # Every waiting lookup is settled, so later logins for these names start a fresh query
+        if query.cancelled():
+            for username in usernames:
+                self._lookups.pop(username).cancel()
+            return
+        error = query.exception()
+        hashes = query.result() if error is None else [None] * len(usernames)
+        for username, hashed in zip(usernames, hashes):
+            lookup = self._lookups.pop(username)
+            if error is not None:
+                lookup.set_exception(error)
+                continue
+            if hashed is not None:
+                self._remember(username, hashed)
+            lookup.set_result(hashed)
+
+    async def add_async(self, username: str, hashed: bytes) -> bool:
+        if not await asyncio.get_running_loop().run_in_executor(self._executor, self._insert, username, hashed):
+            return False
+        self._remember(username, hashed)
+        return True
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        while not self._pool.empty():
+            self._pool.get().close()
\ No newline at end of file
@@ -1,8 +1,52 @@
 from .chat_server import ChatProtocol
 from .server_state import ServerStateManager, ClientInfo
+from .fanout import fan_out
+from .auth_service import AuthService
+from .presence import PresenceBroadcaster
+from .cluster import MessageBus, WorkerQuicServer, serve_worker
+from .history import HistoryStore, ChatHistory
+from .outbound import OutboundLimits, OutboundQueue
+from .scheduler import TransmitScheduler
+from .tickets import SessionTicketStore
+from .metrics import ServerMetrics
+from .typing_relay import TypingRelay
+from .reaper import IdleReaper, TimerWheel
+from .rate_limit import RateLimiter, TokenBucket
+from .mailbox import OfflineMailbox
+from .admission import HandshakeAdmission, RetryTokens, ChatQuicServer, serve_chat
+from .federation import Federation, FederationLink, HashRing
+from .tracing import MessageTracer, Trace
 
 __all__ = [
     'ChatProtocol',
     'ServerStateManager',
-    'ClientInfo'
+    'ClientInfo',
+    'fan_out',
+    'AuthService',
+    'PresenceBroadcaster',
+    'MessageBus',
+    'WorkerQuicServer',
+    'serve_worker',
+    'HistoryStore',
+    'ChatHistory',
+    'OutboundLimits',
+    'OutboundQueue',
+    'TransmitScheduler',
+    'SessionTicketStore',
+    'ServerMetrics',
+    'TypingRelay',
+    'IdleReaper',
+    'TimerWheel',
+    'RateLimiter',
+    'TokenBucket',
+    'OfflineMailbox',
+    'HandshakeAdmission',
+    'RetryTokens',
+    'ChatQuicServer',
+    'serve_chat',
+    'Federation',
+    'FederationLink',
+    'HashRing',
+    'MessageTracer',
+    'Trace'
 ]
\ No newline at end of file
@@ -0,0 +1,280 @@
+#admission.py
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aioquic.asyncio.server import QuicServer
+from aioquic.buffer import Buffer
+from aioquic.quic.configuration import SMALLEST_MAX_DATAGRAM_SIZE, QuicConfiguration
+from aioquic.quic.packet import PACKET_TYPE_INITIAL, encode_quic_retry, pull_quic_header
+from aioquic.quic.retry import encode_address
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from .rate_limit import TokenBucket
+
+# When a new client must first echo a Retry token, proving its address is real
+RETRY_NEVER = "never"
+RETRY_UNDER_LOAD = "under_load"  # Once `retry_threshold` handshakes are in flight
+RETRY_ALWAYS = "always"
+
+_RETRY_MODES = (RETRY_NEVER, RETRY_UNDER_LOAD, RETRY_ALWAYS)
+
+# What HandshakeAdmission.admit() decides for the first packet of a new connection
+ADMIT = "admit"
+RETRY = "retry"
+REFUSE = "refuse"  # Dropped; the client retransmits its Initial a little later
+
+_TOKEN_MAC_SIZE = 16
+
+class RetryTokens:
+    """
+    Stateless Retry tokens: issue time and both connection IDs, under an HMAC
+    that also covers the client address.
+
+    Takes the place of aioquic's QuicRetryTokenHandler, whose tokens are
+    RSA-encrypted (a private-key operation to check each one) and never
+    expire, which would make Retry little cheaper than the handshake it
+    guards.
+    """
+    def __init__(self, lifetime: float = 10.0, key: Optional[bytes] = None):
+        self.lifetime = lifetime
+        self._key = key or os.urandom(32)
+
+    def create_token(self, addr, original_destination_connection_id: bytes,
+                     retry_source_connection_id: bytes) -> bytes:
+        body = (struct.pack("!d", time.time())
+                + bytes([len(original_destination_connection_id)]) + original_destination_connection_id
+                + bytes([len(retry_source_connection_id)]) + retry_source_connection_id)
+        return body + self._mac(addr, body)
+
+    def validate_token(self, addr, token: bytes) -> Tuple[bytes, bytes]:
+        """(original destination CID, retry source CID) of a token; ValueError if it is not valid"""
+        body, mac = token[:-_TOKEN_MAC_SIZE], token[-_TOKEN_MAC_SIZE:]
+        if len(body) < 10 or not hmac.compare_digest(mac, self._mac(addr, body)):
+            raise ValueError("Invalid retry token")
+        issued, = struct.unpack_from("!d", body)
+        if not 0 <= time.time() - issued <= self.lifetime:
+            raise ValueError("Expired retry token")
+        odcid_end = 9 + body[8]
+        odcid = body[9:odcid_end]
+        rscid = body[odcid_end + 1:odcid_end + 1 + body[odcid_end]]
+        return odcid, rscid
+
+    def _mac(self, addr, body: bytes) -> bytes:
+        return hmac.new(self._key, encode_address(addr) + body, hashlib.sha256).digest()[:_TOKEN_MAC_SIZE]
+
+class HandshakeAdmission:
+    """
+    Admission control for new connections, checked before a ChatProtocol is created.
+
+    At most `max_handshakes` handshakes run at once; the Initial of a further
+    connection is dropped, and the client retransmits it once its timer
+    fires, so a reconnect storm is spread out rather than signing for every
+    client at once while connected clients wait. Each source address may
+    start `rate_per_ip` handshakes per second, up to `burst_per_ip` at once
+    (0 turns the limit off). In `retry` mode "under_load", a new client must
+    first echo a Retry token once `retry_threshold` handshakes are in flight:
+    that costs an HMAC rather than a signature and proves the address, so a
+    spoofed flood neither gets handshakes nor drains the per-address budget
+    of the address it forges. A token is checked before anything else, and
+    one that is not valid (forged, or expired) is answered with a Retry
+    in any mode, without charging the address. A handshake not done after
+    `handshake_timeout` seconds is closed to give its slot back.
+    """
+    def __init__(self, max_handshakes: int = 100, rate_per_ip: float = 10.0, burst_per_ip: float = 20.0,
+                 retry: str = RETRY_UNDER_LOAD, retry_threshold: Optional[int] = None,
+                 handshake_timeout: float = 10.0, max_sources: int = 65536):
+        if retry not in _RETRY_MODES:
+            raise ValueError(f"Unknown retry mode: {retry}")
+        self.max_handshakes = max_handshakes
+        self.rate_per_ip = rate_per_ip
+        self.burst_per_ip = burst_per_ip
+        self.retry = retry
+        self.retry_threshold = max_handshakes // 2 if retry_threshold is None else retry_threshold
+        self.handshake_timeout = handshake_timeout
+        self.max_sources = max_sources  # Per-address buckets kept before full ones are dropped
+        self.tokens = RetryTokens()
+        self._pending: 'OrderedDict[object, float]' = OrderedDict()  # Protocol -> loop time it started
+        self._sources: Dict[str, TokenBucket] = {}
+        self.admitted = 0
+        self.completed = 0
+        self.retries = 0
+        self.invalid_tokens = 0
+        self.refused_busy = 0
+        self.refused_rate = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['HandshakeAdmission']:
+        """Build the admission control from the server configuration; None when it is disabled"""
+        if not config.get("handshake_admission", True):
+            return None
+        return cls(max_handshakes=config.get("max_handshakes", 100),
+                   rate_per_ip=config.get("handshake_rate_per_ip", 10.0),
+                   burst_per_ip=config.get("handshake_burst_per_ip", 20.0),
+                   retry=config.get("retry", RETRY_UNDER_LOAD), retry_threshold=config.get("retry_threshold"),
+                   handshake_timeout=config.get("handshake_timeout", 10.0))
+
+    @property
+    def in_flight(self) -> int:
+        """Handshakes started and not yet done"""
+        return len(self._pending)
+
+    def admit(self, addr, token: bytes, now: float) -> str:
+        """ADMIT, RETRY or REFUSE the Initial packet, carrying `token` (maybe empty), of a new connection from `addr`"""
+        if token:
+            try:
+                self.tokens.validate_token(addr, token)
+            except ValueError:
+                self.invalid_tokens += 1
+                self.retries += 1
+                return RETRY
+        self.expire(now)
+        if len(self._pending) >= self.max_handshakes:
+            self.refused_busy += 1
+            return REFUSE
+        if not token and (self.retry == RETRY_ALWAYS or
+                          (self.retry == RETRY_UNDER_LOAD and len(self._pending) >= self.retry_threshold)):
+            self.retries += 1
+            return RETRY
+        if self.rate_per_ip:
+            bucket = self._sources.get(addr[0])
+            if bucket is None:
+                if len(self._sources) >= self.max_sources:
+                    self._prune(now)
+                bucket = self._sources[addr[0]] = TokenBucket(self.burst_per_ip, now)
+            if bucket.wait(self.rate_per_ip, self.burst_per_ip, 1, now):
+                self.refused_rate += 1
+                return REFUSE
+            bucket.tokens -= 1
+        self.admitted += 1
+        return ADMIT
+
+    def _prune(self, now: float) -> None:
+        """Forget the addresses whose bucket has refilled; all of them if none has"""
+        refilled = [source for source, bucket in self._sources.items()
+                    if bucket.wait(self.rate_per_ip, self.burst_per_ip, self.burst_per_ip, now) == 0]
+        for source in refilled:
+            del self._sources[source]
+        if not refilled:
+            self._sources.clear()
+
+    def started(self, protocol, now: float) -> None:
+        self._pending[protocol] = now
+
+    def finished(self, protocol, completed: bool = True) -> None:
+        """A handshake completed, or its connection ended"""
+        if self._pending.pop(protocol, None) is not None and completed:
+            self.completed += 1
+
+    def is_pending(self, protocol) -> bool:
+        return protocol in self._pending
+
+    def expire(self, now: float) -> None:
+        """Close handshakes that have run past `handshake_timeout`; the oldest are first"""
+        while self._pending:
+            protocol, started = next(iter(self._pending.items()))
+            if now - started < self.handshake_timeout:
+                break
+            del self._pending[protocol]
+            self.timed_out += 1
+            protocol.close()
+
+class ChatQuicServer(QuicServer):
+    """
+    QuicServer running the first packet of every new connection past
+    handshake admission control, if any.
+
+    Short-header packets only ever belong to established connections and go
+    straight through; long-header ones are looked at to notice when a
+    handshake completes.
+    """
+    def __init__(self, *, admission: Optional[HandshakeAdmission] = None, create_protocol, **kwargs):
+        def create_admitted_protocol(connection, **protocol_kwargs):
+            protocol = create_protocol(connection, **protocol_kwargs)
+            admission.started(protocol, self._loop.time())
+            return protocol
+
+        super().__init__(create_protocol=create_admitted_protocol if admission is not None else create_protocol,
+                         **kwargs)
+        self.admission = admission
+
+    def datagram_received(self, data, addr) -> None:
+        admission = self.admission
+        if admission is None or not data or not data[0] & 0x80:
+            super().datagram_received(data, addr)
+            return
+        try:
+            header = pull_quic_header(Buffer(data=data), host_cid_length=self._configuration.connection_id_length)
+        except ValueError:
+            return
+
+        protocol = self._protocols.get(header.destination_cid)
+        if (protocol is None and header.packet_type == PACKET_TYPE_INITIAL
+                and len(data) >= SMALLEST_MAX_DATAGRAM_SIZE
+                and header.version in self._configuration.supported_versions):
+            verdict = admission.admit(addr, header.token, self._loop.time())
+            if verdict == REFUSE:
+                return
+            if verdict == RETRY:
+                self._send_retry(header, addr)
+                return
+            # Admitted with a valid token, QuicServer takes the connection IDs from it
+            self._retry = admission.tokens if header.token else None
+
+        super().datagram_received(data, addr)
+        if protocol is None:
+            protocol = self._protocols.get(header.destination_cid)
+        if protocol is not None and protocol._quic._handshake_complete and admission.is_pending(protocol):
+            admission.finished(protocol)
+
+    def _send_retry(self, header, addr) -> None:
+        """Answer an Initial with a Retry, as QuicServer does, also when it carries a token not valid here"""
+        source_cid = os.urandom(8)
+        self._transport.sendto(encode_quic_retry(
+            version=header.version, source_cid=source_cid, destination_cid=header.source_cid,
+            original_destination_cid=header.destination_cid,
+            retry_token=self.admission.tokens.create_token(addr, header.destination_cid, source_cid),
+        ), addr)
+
+    def _connection_terminated(self, protocol) -> None:
+        if self.admission is not None:
+            self.admission.finished(protocol, completed=False)
+        super()._connection_terminated(protocol)
+
+async def serve_chat(host: str, port: int, *, admission: Optional[HandshakeAdmission] = None,
+                     **kwargs) -> ChatQuicServer:
+    """Like aioquic's serve(), with handshake admission control in front of the protocol factory"""
+    loop = asyncio.get_running_loop()
+    _, server = await loop.create_datagram_endpoint(
+        lambda: ChatQuicServer(admission=admission, **kwargs),
+        local_addr=(host, port),
+    )
+    return server
+
+def load_certificate(configuration: QuicConfiguration, config: dict) -> str:
+    """
+    Load the certificate chain and key named in the server configuration.
+
+    cert_path may hold intermediate certificates after the leaf; key_path may
+    be omitted when the key is in the same file, and key_password unlocks an
+    encrypted key. Returns a description of the key: every full handshake
+    signs with it, and an ECDSA P-256 signature costs a small fraction of an
+    RSA-4096 one.
+    """
+    configuration.load_cert_chain(config["cert_path"], config.get("key_path"), password=config.get("key_password"))
+    key = configuration.private_key
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        return f"ECDSA {key.curve.name}"
+    if isinstance(key, rsa.RSAPrivateKey):
+        if key.key_size > 2048:
+            logging.warning(f"RSA-{key.key_size} keys make every handshake expensive; "
+                            "consider an ECDSA P-256 certificate")
+        return f"RSA-{key.key_size}"
+    return type(key).__name__
\ No newline at end of file
@@ -0,0 +1,121 @@
+#auth_service.py
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from src.protocol.auth import AuthManager, TOKEN_RESUME, check_password, hash_password
+from src.protocol.user_store import UserStore
+
+# Where password hashing runs
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+EXECUTOR_INLINE = "inline"  # On the event loop thread, for comparison only
+
+@dataclass
+class AuthSession:
+    """Authenticated context bound to one connection"""
+    username: str
+    token: str       # Resumption token returned in AUTH_OK; lets the client log in again without its password
+    expires_at: int  # When the token stops being accepted for resumption
+
+class AuthService:
+    """
+    Server-wide authentication shared by all connections.
+
+    bcrypt hashing and checking run in a thread or process pool so logins do
+    not stall the event loop; a semaphore caps how many hashing jobs are in
+    flight at once and the rest wait their turn. User records come from the
+    AuthManager's store, looked up off the loop too.
+    """
+    def __init__(self, auth_manager: Optional[AuthManager] = None, executor: str = EXECUTOR_THREAD,
+                 max_workers: int = 4, max_concurrent: Optional[int] = None):
+        self.auth_manager = auth_manager or AuthManager()
+        self.executor_kind = executor
+        self._executor: Optional[Executor] = None
+        if executor == EXECUTOR_THREAD:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="auth")
+        elif executor == EXECUTOR_PROCESS:
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif executor != EXECUTOR_INLINE:
+            raise ValueError(f"Unknown auth executor: {executor}")
+        self._slots = asyncio.Semaphore(max_concurrent or max_workers)
+        self.pending = 0  # Hashing jobs submitted and not finished yet
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'AuthService':
+        """Build the service from the server configuration; the token key comes from it or CHAT_AUTH_SECRET"""
+        # Every worker and restart must sign with the same key, and nobody else may know it
+        secret = config.get("auth_secret") or os.environ.get("CHAT_AUTH_SECRET")
+        if not secret:
+            raise ValueError("No token signing key: set auth_secret in the configuration or CHAT_AUTH_SECRET")
+        if len(secret) < 32:
+            raise ValueError("The token signing key must be at least 32 characters long")
+        return cls(
+            AuthManager(secret_key=secret, bcrypt_rounds=config.get("bcrypt_rounds", 12),
+                        store=UserStore.from_config(config),
+                        resume_lifetime=config.get("resume_token_lifetime", 900)),
+            executor=config.get("auth_executor", EXECUTOR_THREAD),
+            max_workers=config.get("auth_workers", 4),
+            max_concurrent=config.get("auth_max_concurrent"),
+        )
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        """Run a hashing job in the pool, respecting the concurrency cap"""
+        self.pending += 1
+        try:
+            async with self._slots:
+                if self._executor is None:
+                    return func(*args)
+                return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def verify(self, username: str, password: str) -> bool:
+        """Verify user credentials off the event loop"""
+        hashed = await self.auth_manager.get_hash_async(username)
+        if not hashed:
+            return False
+        return await self._run(check_password, password, hashed)
+
+    async def register(self, username: str, password: str, known_absent: bool = False) -> bool:
+        """Register a new user, hashing the password off the event loop"""
+        if not known_absent and await self.auth_manager.get_hash_async(username):
+            return False
+        hashed = await self._run(hash_password, password, self.auth_manager.bcrypt_rounds)
+        return await self.auth_manager.store_hash_async(username, hashed)
+
+    async def is_registered(self, username: str) -> bool:
+        return await self.auth_manager.get_hash_async(username) is not None
+
+    async def login(self, username: str, password: str) -> bool:
+        """Verify a known user or register a new one"""
+        hashed = await self.auth_manager.get_hash_async(username)
+        if hashed:
+            return await self._run(check_password, password, hashed)
+        # The lookup just missed; the store still refuses the name if a concurrent registration took it
+        return await self.register(username, password, known_absent=True)
+
+    def open_session(self, username: str) -> AuthSession:
+        """Start a session for a user who just logged in; its token is checked once, here"""
+        return self.resume_session(username, self.auth_manager.issue_token(username, TOKEN_RESUME))
+
+    def resume_session(self, username: str, token: str) -> Optional[AuthSession]:
+        """Accept a resumption token from an earlier login in place of the password"""
+        claims = self.auth_manager.token_claims(token, TOKEN_RESUME)
+        if claims is None or claims.get("sub") != username:
+            return None
+        return AuthSession(username=username, token=token, expires_at=claims["exp"])
+
+    def issue_token(self, username: str) -> str:
+        return self.auth_manager.issue_token(username)
+
+    def validate_token(self, token: str) -> Optional[str]:
+        return self.auth_manager.validate_token(token)
+
+    def shutdown(self) -> None:
+        """Stop the worker pool and close the user store"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self.auth_manager.store.close()
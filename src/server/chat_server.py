@@ -165,33 +165,117 @@
 
 import asyncio
 import logging
+import multiprocessing
+import re
+import shutil
+import tempfile
+import time
 from typing import Optional
-from aioquic.asyncio import serve, QuicConnectionProtocol
+from aioquic.asyncio import QuicConnectionProtocol
 from aioquic.quic.configuration import QuicConfiguration
-from aioquic.quic.events import HandshakeCompleted, StreamDataReceived, ConnectionTerminated
-
-from src.protocol.message import MsgType, pack, unpack
-from src.protocol.auth import AuthManager
+from aioquic.quic.packet import QuicErrorCode
+from aioquic.quic.events import HandshakeCompleted, StreamDataReceived, DatagramFrameReceived, ConnectionTerminated
+
+from src.protocol.message import MsgType, JSON_VERSION, BINARY_VERSION, pack, unpack, wire_version_for_alpn
+from src.protocol.framing import STREAM_MODE_SESSION, FrameWriter, StreamReassembler
+from src.protocol.compression import DICTIONARY_ID, Compressor
+from src.protocol.datagram import (MAX_DATAGRAM_FRAME_SIZE, MAX_PENDING_DATAGRAMS, EPHEMERAL_TYPES,
+                                   datagram_payload_limit)
 from src.utils.config_loader import load_config
 from .server_state import ServerStateManager
+from .auth_service import AuthService, AuthSession
+from .presence import PresenceBroadcaster
+from .fanout import fan_out
+from .cluster import MessageBus, serve_worker
+from .history import ChatHistory
+from .outbound import OutboundLimits, OutboundQueue
+from .scheduler import CountingTransport, TransmitScheduler
+from .tickets import SessionTicketStore
+from .metrics import ServerMetrics
+from .typing_relay import TypingRelay
+from .reaper import IdleReaper
+from .rate_limit import RateLimiter
+from .mailbox import OfflineMailbox
+from .admission import HandshakeAdmission, load_certificate, serve_chat
+from .federation import Federation
+from .tracing import MessageTracer
 
 logging.basicConfig(level=logging.INFO)
 
+_ROOM_NAME = re.compile(r"^[\w.-]{1,64}$")
+
 class ChatProtocol(QuicConnectionProtocol):
-    def __init__(self, *args, server_state: ServerStateManager = None, **kwargs):
+    def __init__(self, *args, server_state: ServerStateManager = None, auth_service: AuthService = None,
+                 presence: PresenceBroadcaster = None, bus: MessageBus = None, history: ChatHistory = None,
+                 outbound: OutboundLimits = None, scheduler: TransmitScheduler = None,
+                 metrics: ServerMetrics = None, compressor: Compressor = None, typing: TypingRelay = None,
+                 reaper: IdleReaper = None, rate_limiter: RateLimiter = None, mailbox: OfflineMailbox = None,
+                 tracer: MessageTracer = None, stream_mode: str = STREAM_MODE_SESSION, **kwargs):
         super().__init__(*args, **kwargs)
         self.server_state = server_state
-        self.auth_manager = AuthManager()
+        self.auth_service = auth_service  # Shared by every connection of the server
+        self.presence = presence
+        self.bus = bus  # Link to the other worker processes or federation nodes, if any
+        self.history = history  # Message log, if enabled
+        self.metrics = metrics or ServerMetrics.shared()
+        self.compressor = compressor  # Shared; None when compression is disabled
+        self.compressed = False  # Whether frames to this client may be compressed
+        self._compression_requested = False
+        self.typing = typing  # Shared typing-indicator relay, if enabled
+        self.datagram_limit = 0  # Largest DATAGRAM payload for this client; 0 when not negotiated
+        self.last_ping: Optional[float] = None  # When the client last sent a presence ping
+        self.reaper = reaper  # Closes this connection if it goes quiet, if enabled
+        self.connected_at = self.last_seen = self._loop.time()  # Loop time; last_seen moves with every packet
+        self.disconnected = False
+        self.rate_limiter = rate_limiter  # Shared; None when rate limiting is off
+        self.mailbox = mailbox  # Private messages for offline users, if enabled
+        self.tracer = tracer  # Samples messages for per-stage timing; None when tracing is off
+        self.traced_frames: Optional[list] = None  # Trace records of frames queued since the last transmit
+        self._auth_pending = False
+        self._auth_started = 0.0
+        self.handshake_complete = False
+        self._early_auth: Optional[dict] = None  # Login that came in 0-RTT early data, held until the handshake ends
         self.username: Optional[str] = None
         self.token: Optional[str] = None
+        self.session: Optional[AuthSession] = None  # Authenticated context of this connection
+        self.wire_version = JSON_VERSION  # Wire format used for frames sent to this client
+        self.reassembler = StreamReassembler()
+        # Unframed until the client shows it understands framing
+        self.writer = FrameWriter(self._quic, mode=stream_mode, framed=False)
+        # Every frame for this client goes through one bounded queue
+        self.outbound = OutboundQueue(self.writer, outbound, on_evict=self.evict_slow_consumer)
+        # Decides when written frames are transmitted; immediately unless shared and batching
+        self.scheduler = scheduler or TransmitScheduler(batching=False)
+
+    def connection_made(self, transport) -> None:
+        super().connection_made(CountingTransport(transport, self.scheduler.stats))
+        if self.reaper is not None:
+            self.reaper.watch(self)
+
+    def transmit(self) -> None:
+        self.scheduler.discard(self)
+        self.scheduler.stats.transmits += 1
+        super().transmit()
+        if self.traced_frames is not None:
+            self.tracer.transmitted(self.traced_frames)
+            self.traced_frames = None
 
     def quic_event_received(self, event) -> None:
+        self.metrics.quic_events.inc()
+        started = time.perf_counter()
         if isinstance(event, HandshakeCompleted):
             try:
                 # Find and use the appropriate event attribute for connection ID
                 logging.info(f"HandshakeCompleted event details: {event}")
                 cid = self._quic._version if hasattr(self._quic, '_version') else 'unknown'
-                logging.info(f"[HS] Handshake completed: CID={cid}, ALPN={event.alpn_protocol}")
+                logging.info(f"[HS] Handshake completed: CID={cid}, ALPN={event.alpn_protocol}, "
+                             f"resumed={event.session_resumed}, early_data={event.early_data_accepted}")
+                self.wire_version = wire_version_for_alpn(event.alpn_protocol)
+                self.datagram_limit = datagram_payload_limit(self._quic)
+                self.handshake_complete = True
+                if self._early_auth is not None:
+                    message, self._early_auth = self._early_auth, None
+                    self.handle_authentication(message)
 
             except Exception as e:
                 logging.error(f"Handshake error: {e}")
@@ -199,16 +283,117 @@ class ChatProtocol(QuicConnectionProtocol):
         elif isinstance(event, StreamDataReceived):
             self.handle_stream_data(event.stream_id, event.data, event.end_stream)
 
+        elif isinstance(event, DatagramFrameReceived):
+            self.handle_datagram(event.data)
+
         elif isinstance(event, ConnectionTerminated):
-            if self.username:
-                self.server_state.remove_client(self.username)
-                self.broadcast_system_message(f"User '{self.username}' left the chat.")
-                self.broadcast_online_users()
+            self.handle_disconnect()
+        self.metrics.quic_event_seconds.observe(time.perf_counter() - started)
+
+    def datagram_received(self, data, addr) -> None:
+        self.last_seen = self._loop.time()
+        super().datagram_received(data, addr)
+        # Acknowledgements may have freed room for queued frames
+        if self.outbound.depth:
+            self.frames_written(self.outbound.drain())
+
+    def evict_slow_consumer(self):
+        """Close a connection whose client does not read what it is sent"""
+        logging.warning(f"Evicting slow consumer '{self.username}'")
+        self._quic.close(error_code=QuicErrorCode.NO_ERROR, reason_phrase="Slow consumer")
+        self.transmit()
+
+    def reap(self, reason: str):
+        """Close a dead connection and drop its session without waiting for the close to complete"""
+        logging.info(f"Reaping connection of '{self.username}': {reason}")
+        self._quic.close(error_code=QuicErrorCode.NO_ERROR, reason_phrase=reason)
+        self.transmit()
+        self.handle_disconnect()
+
+    def handle_disconnect(self) -> bool:
+        """Remove this connection's session from the server state; returns False if there was none"""
+        if self.disconnected:
+            return False
+        self.disconnected = True
+        if self.reaper is not None:
+            self.reaper.forget(self)
+        client = self.server_state.get_client(self.username) if self.username else None
+        # A second login under the same name is not registered and must not remove the first
+        if client is None or client.protocol is not self:
+            return False
+        self.server_state.remove_client(self.username)
+        if self.rate_limiter is not None:
+            self.rate_limiter.forget(self.username)
+        if self.bus is not None:
+            self.bus.publish_presence(self.username, False)
+        self.broadcast_system_message(f"User '{self.username}' left the chat.")
+        self.notify_presence_change()
+        return True
 
     def handle_stream_data(self, stream_id: int, data: bytes, end_stream: bool):
+        metrics = self.metrics
+        started = time.perf_counter()
+        received = time.perf_counter_ns() if self.tracer is not None else 0
+        metrics.bytes_in.inc(len(data))
+        try:
+            payloads = self.reassembler.feed(stream_id, data, end_stream)
+        except ValueError as e:
+            logging.error(f"Error reassembling stream {stream_id}: {e}")
+            self.queue_send(MsgType.SYS, f"Error: {str(e)}")
+            return
+
+        # Answer framed clients with framed messages
+        if self.reassembler.framed:
+            self.writer.framed = True
+
+        metrics.messages_in.inc(len(payloads))
+        if self.tracer is None:
+            for payload in payloads:
+                self.handle_payload(payload)
+        else:
+            self.handle_traced_payloads(payloads, received)
+        metrics.stream_data_seconds.observe(time.perf_counter() - started)
+
+    def handle_traced_payloads(self, payloads: list, received: int):
+        """Handle payloads as handle_payload() does, tracing the sampled ones"""
+        tracer = self.tracer
+        reassembled = time.perf_counter_ns()
+        for payload in payloads:
+            trace = tracer.begin(received)
+            if trace is None:
+                self.handle_payload(payload)
+                continue
+            trace.mark("reassembled", reassembled)
+            trace.user = self.username
+            tracer.current = trace
+            try:
+                self.handle_payload(payload)
+            finally:
+                tracer.current = None
+            trace.mark("handled")
+
+    def handle_datagram(self, data: bytes):
+        """Handle a QUIC DATAGRAM; only ephemeral messages from authenticated clients are accepted"""
+        self.metrics.datagrams_in.inc()
+        if self.username is None:
+            return
         try:
             message = unpack(data)
-            
+        except Exception as e:
+            logging.debug(f"Dropping undecodable datagram: {e}")
+            return
+        if message.get("t") in EPHEMERAL_TYPES:
+            self.metrics.messages_in.inc()
+            self.handle_chat_message(message)
+
+    def handle_payload(self, data: bytes):
+        try:
+            message = unpack(data)
+            trace = self.tracer.current if self.tracer is not None else None
+            if trace is not None:
+                trace.kind = message.get("t")
+                trace.mark("decoded")
+
             if self.username is None:
                 self.handle_authentication(message)
             else:
@@ -216,112 +401,564 @@ class ChatProtocol(QuicConnectionProtocol):
 
         except Exception as e:
             logging.error(f"Error handling stream data: {e}")
-            asyncio.create_task(self.async_send(MsgType.SYS, f"Error: {str(e)}"))
+            self.queue_send(MsgType.SYS, f"Error: {str(e)}")
 
     def handle_authentication(self, message: dict):
         if message.get("t") != MsgType.AUTH_REQ:
-            asyncio.create_task(self.async_send(MsgType.AUTH_BAD, "Please authenticate first."))
+            self.queue_send(MsgType.AUTH_BAD, "Please authenticate first.")
+            return
+
+        # Early data can be replayed by anyone who captured it; a replay never finishes the handshake
+        if not self.handshake_complete:
+            if self._early_auth is not None:
+                self.queue_send(MsgType.AUTH_BAD, "Authentication already in progress.")
+                return
+            self._early_auth = message
             return
 
+        # The client may pick the wire format explicitly through the "v" field
+        if message.get("v") in (JSON_VERSION, BINARY_VERSION):
+            self.wire_version = message["v"]
+
         username = message.get("to")
         password = message.get("body")
+        # Compression is offered by naming the dictionary the client was built with
+        self._compression_requested = self.compressor is not None and message.get("zdict") == DICTIONARY_ID
+        # Reconnecting clients may present the token of an earlier login instead of the password
+        resume_token = message.get("token") if not password else None
+
+        if not username or not (password or resume_token):
+            self.queue_send(MsgType.AUTH_BAD, "Username and password required.")
+            return
 
-        if not username or not password:
-            asyncio.create_task(self.async_send(MsgType.AUTH_BAD, "Username and password required."))
+        if self._auth_pending:
+            self.queue_send(MsgType.AUTH_BAD, "Authentication already in progress.")
             return
 
-        if self.auth_manager.verify(username, password) or self.auth_manager.register(username, password):
+        # Password hashing runs in the auth pool; finish once it resolves
+        self._auth_pending = True
+        self._auth_started = time.perf_counter()
+        trace = self.tracer.current if self.tracer is not None else None
+        if trace is not None:
+            trace.mark("auth_queued")
+        asyncio.create_task(self.complete_authentication(username, password, resume_token, trace))
+
+    async def complete_authentication(self, username: str, password: Optional[str],
+                                      resume_token: Optional[str] = None, trace=None):
+        if trace is not None:
+            trace.mark("auth_started")  # After waiting for the task to be scheduled
+        try:
+            if resume_token:
+                session = self.auth_service.resume_session(username, resume_token)
+            elif await self.auth_service.login(username, password):
+                session = self.auth_service.open_session(username)
+            else:
+                session = None
+        except Exception as e:
+            logging.error(f"Authentication error for '{username}': {e}")
+            session = None
+        finally:
+            self._auth_pending = False
+        if trace is not None:
+            trace.mark("auth_checked")
+            trace.user = username
+            self.tracer.current = trace  # Until the replies are queued: they are the login's copies
+        try:
+            metrics = self.metrics
+            metrics.auth_seconds.observe(time.perf_counter() - self._auth_started)
+            (metrics.auth_ok if session is not None else metrics.auth_failed).inc()
+
+            if self._closed.is_set() or self.disconnected:
+                return  # Client went away while its password was being checked
+
+            if session is None:
+                self.queue_send(MsgType.AUTH_BAD, "Authentication failed.")
+                return
+            # The connection is now bound to this session; later frames carry no token
+            self.session = session
             self.username = username
-            self.token = self.auth_manager.issue_token(username)
-            asyncio.create_task(self.async_send(MsgType.AUTH_OK, f"Welcome, {username}", token=self.token))
+            self.token = session.token
+            # Agree to compression in the uncompressed AUTH_OK; later frames may be compressed
+            self.send({"t": int(MsgType.AUTH_OK), "body": f"Welcome, {username}", "to": None, "token": self.token,
+                       "zdict": DICTIONARY_ID if self._compression_requested else None})
+            self.compressed = self._compression_requested
             self.server_state.add_client(username, self)
+            if self.bus is not None:
+                self.bus.publish_presence(username, True)
+            self.send_presence_snapshot()
             self.broadcast_system_message(f"User '{username}' joined the chat.")
-            self.broadcast_online_users()
-        else:
-            asyncio.create_task(self.async_send(MsgType.AUTH_BAD, "Authentication failed."))
+            self.notify_presence_change()
+        finally:
+            if trace is not None:
+                self.tracer.current = None
+                trace.mark("replied")
+        if self.mailbox is not None and self.server_state.pending_mail(username):
+            await self.deliver_offline_mail()
+
+    async def deliver_offline_mail(self):
+        """Send the messages that arrived while this user was offline, all in one batch"""
+        mail = await self.mailbox.take(self.username)
+        if not mail:
+            return
+        self.queue_send(MsgType.SYS, f"{len(mail)} message(s) arrived while you were offline.")
+        for sent_at, body in mail:
+            self.queue_send(MsgType.CHAT, body)
 
-    def handle_chat_message(self, message: dict):
-        if message.get("t") != MsgType.CHAT:
-            asyncio.create_task(self.async_send(MsgType.SYS, "Unknown command."))
+    def handle_chat_message(self, message: dict, admitted: bool = False):
+        if not admitted and self.rate_limiter is not None and not self.admit(message):
+            return
+        if self.tracer is not None and self.tracer.current is not None:
+            self.tracer.current.mark("admitted")
+
+        msg_type = message.get("t")
+        if msg_type == MsgType.PRESENCE_SNAPSHOT:
+            self.send_presence_snapshot()
+            return
+
+        if msg_type in (MsgType.ROOM_JOIN, MsgType.ROOM_LEAVE, MsgType.ROOM_LIST):
+            self.handle_room_command(message)
+            return
+
+        if msg_type == MsgType.HISTORY:
+            asyncio.create_task(self.send_history(message))
+            return
+
+        if msg_type == MsgType.TYPING:
+            self.handle_typing(message)
+            return
+
+        # Older clients keep alive with a SYS "ping"; treat it as a presence ping rather than a command
+        if msg_type == MsgType.PING or (msg_type == MsgType.SYS and message.get("body") == "ping"):
+            self.last_ping = time.monotonic()
+            return
+
+        if msg_type != MsgType.CHAT:
+            self.queue_send(MsgType.SYS, "Unknown command.")
             return
 
         body = message.get("body", "")
         target = message.get("to")
+        room = message.get("room")
 
         if target:
             self.handle_private_message(target, body)
+        elif room:
+            self.broadcast_room_message(room, body)
         else:
             self.broadcast_chat_message(body)
 
+    def admit(self, message: dict) -> bool:
+        """Check the rate limits before any work is done; False when the message was dropped or held back"""
+        wait = self.rate_limiter.check(self.username, message.get("t"), self.fanout_cost(message))
+        if wait is None:
+            # Tell the sender, at most once in a while; lost ephemeral messages need no notice
+            if message.get("t") not in EPHEMERAL_TYPES and self.rate_limiter.notice_due(self.username):
+                self.queue_send(MsgType.SYS, "Rate limit exceeded, message dropped.")
+            return False
+        if wait:
+            trace = self.tracer.current if self.tracer is not None else None
+            if trace is not None:
+                trace.mark("delayed")
+            self._loop.call_later(wait, self.handle_delayed, message, trace)
+            return False
+        return True
+
+    def handle_delayed(self, message: dict, trace=None):
+        """Handle a message held back by the rate limiter, unless the client has gone"""
+        if self.disconnected or self._closed.is_set():
+            return
+        if trace is None:
+            self.handle_chat_message(message, admitted=True)
+            return
+        self.tracer.current = trace
+        try:
+            self.handle_chat_message(message, admitted=True)
+        finally:
+            self.tracer.current = None
+        trace.mark("handled")
+
+    def fanout_cost(self, message: dict) -> int:
+        """Recipients a chat message will be sent to, counted without visiting them"""
+        if message.get("t") != MsgType.CHAT:
+            return 0
+        if message.get("to"):
+            return 1
+        room = message.get("room")
+        if room:
+            return len(self.server_state.rooms.get(room, ()))
+        return len(self.server_state.clients)
+
+    def handle_room_command(self, message: dict):
+        msg_type = message.get("t")
+        if msg_type == MsgType.ROOM_LIST:
+            rooms = "\n".join(f"{room} {count}" for room, count in self.server_state.list_rooms())
+            self.send({"t": int(MsgType.ROOM_LIST), "body": rooms, "to": None, "token": None})
+            return
+
+        room = message.get("room")
+        if not room or not _ROOM_NAME.match(room):
+            self.queue_send(MsgType.SYS, "Invalid room name.")
+            return
+
+        if msg_type == MsgType.ROOM_JOIN:
+            if self.server_state.join_room(self.username, room):
+                self.send({"t": int(MsgType.ROOM_JOIN), "body": f"Joined room '{room}'.",
+                           "to": None, "token": None, "room": room})
+            else:
+                self.queue_send(MsgType.SYS, f"Already in room '{room}'.")
+        else:
+            if self.server_state.leave_room(self.username, room):
+                self.send({"t": int(MsgType.ROOM_LEAVE), "body": f"Left room '{room}'.",
+                           "to": None, "token": None, "room": room})
+            else:
+                self.queue_send(MsgType.SYS, f"Not in room '{room}'.")
+
+    def handle_typing(self, message: dict):
+        """Pass a typing indicator to the relay if its scope is valid; invalid ones are silently ignored"""
+        if self.typing is None:
+            return
+        room = message.get("room")
+        target = message.get("to")
+        if room is not None and not self.server_state.is_room_member(self.username, room):
+            return
+        if target is not None and (target == self.username or self.server_state.get_client(target) is None):
+            return
+        self.typing.typing(self.username, room=room, target=target)
+
+    async def send_history(self, message: dict):
+        """Answer a HISTORY request with one or more pages"""
+        if self.history is None:
+            await self.async_send(MsgType.SYS, "History is not enabled.")
+            return
+        try:
+            # A JSON client can send anything; only whole numbers get as far as the store
+            since = message.get("seq")
+            if since is not None and (isinstance(since, bool) or not isinstance(since, int)):
+                raise ValueError(f"bad seq: {since!r}")
+            count = message.get("body") or 0
+            if isinstance(count, bool) or not isinstance(count, (int, str)):
+                raise ValueError(f"bad count: {count!r}")
+            last = None if since is not None else max(int(count), 0) or None
+            pages = await self.history.fetch(self.username, since=since, last=last)
+        except ValueError:
+            await self.async_send(MsgType.SYS, "Invalid history request.")
+            return
+        if self._closed.is_set():
+            return
+        for page in pages:
+            self.send(page)
+
+    def queue_send(self, msg_type: MsgType, body: str, to: Optional[str] = None, token: Optional[str] = None):
+        """Queue a message for this client; never blocks and schedules no task"""
+        self.send_frame(self.encode_frame({"t": int(msg_type), "body": body, "to": to, "token": token}))
+
     async def async_send(self, msg_type: MsgType, body: str, to: Optional[str] = None, token: Optional[str] = None):
-        new_stream = self._quic.get_next_available_stream_id()
-        self._quic.send_stream_data(
-            new_stream,
-            pack({"v": 1, "t": int(msg_type), "body": body, "to": to, "token": token}),
-            end_stream=True
-        )
-        self.transmit()
+        self.queue_send(msg_type, body, to=to, token=token)
+
+    @property
+    def frame_key(self) -> tuple:
+        """Connections with equal keys receive byte-identical frames for the same message"""
+        return (self.wire_version, self.writer.framed, self.compressed)
+
+    def encode_frame(self, msg: dict) -> bytes:
+        """Serialize a message into the bytes written to this client's stream"""
+        payload = pack({**msg, "v": self.wire_version})
+        if self.compressed:
+            payload = self.compressor.compress(payload)
+        return self.writer.encode(payload)
+
+    def send_frame(self, data: bytes):
+        """Queue a frame produced by encode_frame() for this client"""
+        metrics = self.metrics
+        metrics.messages_out.inc()
+        metrics.bytes_out.inc(len(data))
+        written = self.outbound.put(data)
+        if self.tracer is not None and self.tracer.current is not None:
+            self.tracer.queued(self, held=not written)
+        self.frames_written(written)
+
+    @property
+    def ephemeral_key(self) -> tuple:
+        """Like frame_key, for payloads from encode_ephemeral()"""
+        return ("datagram", self.wire_version) if self.datagram_limit else self.frame_key
+
+    def encode_ephemeral(self, msg: dict) -> bytes:
+        """Serialize a message that may be lost: a datagram payload, or a frame without DATAGRAM support"""
+        if self.datagram_limit:
+            return pack({**msg, "v": self.wire_version})
+        return self.encode_frame(msg)
+
+    def send_ephemeral(self, data: bytes):
+        """Send a payload from encode_ephemeral() as a DATAGRAM, falling back to the stream when it is too big"""
+        if not self.datagram_limit:
+            self.send_frame(data)
+        elif len(data) > self.datagram_limit:
+            self.send_frame(self.writer.encode(data))
+        elif len(self._quic._datagrams_pending) < MAX_PENDING_DATAGRAMS:
+            self._quic.send_datagram_frame(data)
+            self.metrics.datagrams_out.inc()
+            self.frames_written(1)
+
+    def frames_written(self, count: int):
+        """Have frames just handed to QUIC transmitted by the scheduler"""
+        if count:
+            self.scheduler.stats.messages += count
+            self.scheduler.mark(self)
+
+    def send(self, msg: dict):
+        """Serialize and send a single message to this client"""
+        self.send_frame(self.encode_frame(msg))
 
     def broadcast_system_message(self, message: str):
-        for client_info in self.server_state.clients.values():
-            asyncio.create_task(client_info.protocol.async_send(MsgType.SYS, message))
-
-    def broadcast_online_users(self):
-        online_list = ", ".join(self.server_state.get_online_users())
-        msg = f"Online users: {online_list}"
-        for client_info in self.server_state.clients.values():
-            asyncio.create_task(client_info.protocol.async_send(MsgType.SYS, msg))
+        started = time.perf_counter()
+        msg = {"t": int(MsgType.SYS), "body": message, "to": None, "token": None}
+        sent = fan_out((client_info.protocol for client_info in self.server_state.clients.values()), msg)
+        self.observe_broadcast(sent, started)
+        if self.bus is not None:
+            self.bus.publish_message(msg)
+
+    def observe_broadcast(self, sent: int, started: float):
+        """Record the size and cost of a local fan-out"""
+        metrics = self.metrics
+        metrics.fanout_size.observe(sent)
+        metrics.broadcast_seconds.observe(time.perf_counter() - started)
+
+    def notify_presence_change(self):
+        """Let the presence broadcaster send a delta for recent joins and leaves"""
+        if self.presence is not None:
+            self.presence.changed()
+
+    def send_presence_snapshot(self):
+        """Send this client the full online-user list"""
+        if self.presence is not None:
+            self.send(self.presence.snapshot_message())
 
     def handle_private_message(self, target: str, body: str):
         target_client = self.server_state.get_client(target)
+        target_worker = self.server_state.get_client_worker(target)
+        if (target_client or (target_worker is not None and self.bus is not None)) and self.history is not None:
+            self.history.record({"t": int(MsgType.CHAT), "body": f"[Private] {self.username}: {body}"},
+                                sender=self.username, recipient=target)
         if target_client:
-            asyncio.create_task(target_client.protocol.async_send(
-                MsgType.CHAT, f"[Private] {self.username}: {body}"
-            ))
-            asyncio.create_task(self.async_send(
-                MsgType.CHAT, f"[Private to {target}] {body}"
-            ))
+            target_client.protocol.queue_send(MsgType.CHAT, f"[Private] {self.username}: {body}")
+            self.queue_send(MsgType.CHAT, f"[Private to {target}] {body}")
+        elif target_worker is not None and self.bus is not None:
+            self.bus.send_private(target_worker, target, {
+                "t": int(MsgType.CHAT), "body": f"[Private] {self.username}: {body}", "to": None, "token": None
+            }, sender=self.username)
+            self.queue_send(MsgType.CHAT, f"[Private to {target}] {body}")
+        elif self.mailbox is not None and self.mail_home(target) is not None:
+            self.queue_offline(target, body)
+        elif self.mailbox is not None:
+            # Only registered users get mail, and the user store is asked off the event loop
+            asyncio.create_task(self.queue_if_registered(target, body))
         else:
-            asyncio.create_task(self.async_send(
-                MsgType.SYS, f"User '{target}' is not online."
-            ))
+            self.queue_send(MsgType.SYS, f"User '{target}' is not online.")
+
+    async def queue_if_registered(self, target: str, body: str):
+        if not await self.auth_service.is_registered(target):
+            self.queue_send(MsgType.SYS, f"User '{target}' is not online.")
+        elif self.server_state.is_client_online(target):
+            self.handle_private_message(target, body)  # Logged in while the store was asked
+        else:
+            self.queue_offline(target, body)
+
+    def mail_home(self, target: str) -> Optional[int]:
+        """The federation node keeping offline mail for a user, if not this one"""
+        return self.bus.mail_home(target) if self.bus is not None else None
+
+    def queue_offline(self, target: str, body: str):
+        """Keep a private message for a registered user who is offline, here or on the user's home node"""
+        text = f"[Private] {self.username}: {body}"
+        home = self.mail_home(target)
+        if home is not None:
+            # Users register on the node they first log in to, so the home node takes it on trust
+            self.bus.send_mail(home, target, text)
+        elif not self.mailbox.put(target, text):
+            self.queue_send(MsgType.SYS, f"User '{target}' is offline and cannot take more messages.")
+            return
+        if self.history is not None:
+            self.history.record({"t": int(MsgType.CHAT), "body": text}, sender=self.username, recipient=target)
+        self.queue_send(MsgType.CHAT, f"[Private to {target}] {body}")
+        self.queue_send(MsgType.SYS, f"User '{target}' is offline; the message will be delivered when they log in.")
 
     def broadcast_chat_message(self, body: str):
-        for username, client_info in self.server_state.clients.items():
-            if username != self.username:
-                asyncio.create_task(client_info.protocol.async_send(
-                    MsgType.CHAT, f"{self.username}: {body}"
-                ))
+        started = time.perf_counter()
+        msg = {"t": int(MsgType.CHAT), "body": f"{self.username}: {body}", "to": None, "token": None}
+        sent = fan_out(
+            (client_info.protocol for username, client_info in self.server_state.clients.items()
+             if username != self.username),
+            msg
+        )
+        self.observe_broadcast(sent, started)
+        if self.bus is not None:
+            self.bus.publish_message(msg, exclude=self.username)
+        if self.history is not None:
+            self.history.record(msg, sender=self.username)
+
+    def broadcast_room_message(self, room: str, body: str):
+        if not self.server_state.is_room_member(self.username, room):
+            self.queue_send(MsgType.SYS, f"Not in room '{room}'.")
+            return
 
-async def main():
+        # Only the room's members are visited, not every connected client
+        started = time.perf_counter()
+        clients = self.server_state.clients
+        msg = {"t": int(MsgType.CHAT), "body": f"[{room}] {self.username}: {body}",
+               "to": None, "token": None, "room": room}
+        sent = fan_out(
+            (clients[username].protocol for username in self.server_state.get_room_members(room)
+             if username != self.username and username in clients),
+            msg
+        )
+        self.observe_broadcast(sent, started)
+        if self.bus is not None:
+            self.bus.publish_message(msg, exclude=self.username)
+        if self.history is not None:
+            self.history.record(msg, sender=self.username)
+
+async def main(config: Optional[dict] = None, worker_id: int = 0, bus_dir: Optional[str] = None):
     # Load configuration
-    config = load_config("server")
+    config = config or load_config("server")
+    workers = config.get("workers", 1)
     
-    # Initialize server state
+    # Initialize server state and the shared authentication service
     server_state = ServerStateManager()
+    auth_service = AuthService.from_config(config)
+    presence = PresenceBroadcaster(server_state, window=config.get("presence_window", 0.05))
+    history = ChatHistory.from_config(config, server_state, worker_id)
+    outbound = OutboundLimits.from_config(config)
+    scheduler = TransmitScheduler.from_config(config)
+    tickets = SessionTicketStore(config.get("session_ticket_max", 10000))
+    typing = TypingRelay.from_config(config, server_state)
+    reaper = IdleReaper.from_config(config, server_state)
+    rate_limiter = RateLimiter.from_config(config)
+    mailbox = OfflineMailbox.from_config(config, server_state, worker_id)
+    compressor = Compressor.from_config(config)
+    admission = HandshakeAdmission.from_config(config)
+    federation = Federation.from_config(config, server_state, presence, history, mailbox)
+    if federation is not None and workers > 1:
+        raise ValueError("A federation node is a single process; run more nodes rather than workers")
+    tracer = MessageTracer.from_config(config, worker_id)
+    if tracer is not None:
+        tracer.start()
+        logging.info(f"Tracing {tracer.sample_rate:.2%} of messages to {tracer.path}")
     
     # Setup QUIC configuration
     quic_config = QuicConfiguration(
         is_client=False,
         alpn_protocols=config["alpn_protocols"]
     )
-    quic_config.load_cert_chain(config["cert_path"], config["key_path"])
+    key_type = load_certificate(quic_config, config)
+    logging.info(f"Loaded certificate {config['cert_path']} with an {key_type} key")
+    # Clients keep alive with QUIC PING frames; a peer silent for this long is closed by QUIC itself
+    quic_config.idle_timeout = config.get("idle_timeout", 60.0)
+    if config.get("datagrams", True):
+        quic_config.max_datagram_frame_size = config.get("max_datagram_frame_size", MAX_DATAGRAM_FRAME_SIZE)
+
+    bus = None
+    if workers > 1:
+        bus = MessageBus(worker_id, workers, bus_dir, server_state, presence, history, mailbox)
+        await bus.start()
+    elif federation is not None:
+        # The links to the other nodes take the place of the worker bus
+        bus = federation
+        await federation.start()
+        logging.info(f"Federation node {federation.node_id} with peers {sorted(federation.peers)}")
+    metrics = ServerMetrics()
+    metrics.watch(server_state, auth_service, outbound, scheduler, compressor, reaper, rate_limiter, mailbox,
+                  admission, federation, tracer, bus if workers > 1 else None)
+
+    def create_protocol(*args, **kwargs):
+        return ChatProtocol(
+            *args, server_state=server_state, auth_service=auth_service, presence=presence, bus=bus,
+            history=history, outbound=outbound, scheduler=scheduler, metrics=metrics, compressor=compressor,
+            typing=typing, reaper=reaper, rate_limiter=rate_limiter, mailbox=mailbox, tracer=tracer,
+            stream_mode=config.get("stream_mode", STREAM_MODE_SESSION), **kwargs
+        )
 
-    logging.info(f"Starting QUIC chat server on {config['host']}:{config['port']}...")
-    
-    await serve(
-        config["host"],
-        config["port"],
-        configuration=quic_config,
-        create_protocol=lambda *args, **kwargs: ChatProtocol(
-            *args, server_state=server_state, **kwargs
+    if workers > 1:
+        logging.info(f"Starting QUIC chat worker {worker_id}/{workers} on {config['host']}:{config['port']}...")
+        await serve_worker(
+            config["host"],
+            config["port"],
+            worker_id=worker_id,
+            workers=workers,
+            bus=bus,
+            configuration=quic_config,
+            create_protocol=create_protocol,
+            session_ticket_fetcher=tickets.pop,
+            session_ticket_handler=tickets.add,
+            admission=admission
         )
-    )
+        bus.hello()
+    else:
+        logging.info(f"Starting QUIC chat server on {config['host']}:{config['port']}...")
+        await serve_chat(
+            config["host"],
+            config["port"],
+            configuration=quic_config,
+            create_protocol=create_protocol,
+            session_ticket_fetcher=tickets.pop,
+            session_ticket_handler=tickets.add,
+            admission=admission
+        )
+
+    exporters = await metrics.start_exporters(config, worker_id)
     
-    await asyncio.Future()  # run forever
+    try:
+        await asyncio.Future()  # run forever
+    finally:
+        metrics.stop_exporters(exporters)
+        presence.close()
+        typing.close()
+        reaper.close()
+        if mailbox is not None:
+            mailbox.close()
+        scheduler.close()
+        auth_service.shutdown()
+        if bus is not None:
+            bus.close()
+        if history is not None:
+            history.close()
+        if tracer is not None:
+            tracer.close()
+
+def run_worker(config: dict, worker_id: int, bus_dir: str):
+    """Entry point of one worker process"""
+    try:
+        asyncio.run(main(config, worker_id, bus_dir))
+    except KeyboardInterrupt:
+        pass
+
+def run(config: Optional[dict] = None):
+    """Run the server, as one process or as `workers` processes sharing the port"""
+    config = config or load_config("server")
+    workers = config.get("workers", 1)
+    if workers <= 1:
+        asyncio.run(main(config))
+        return
+
+    bus_dir = tempfile.mkdtemp(prefix="chat-bus-")
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(config, worker_id, bus_dir), name=f"chat-worker-{worker_id}")
+        for worker_id in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        shutil.rmtree(bus_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        run()
     except KeyboardInterrupt:
         logging.info("Server terminated by KeyboardInterrupt.")
\ No newline at end of file
@@ -0,0 +1,334 @@
+#cluster.py
+import asyncio
+import logging
+import os
+import socket
+import struct
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aioquic.buffer import Buffer
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.packet import PACKET_TYPE_INITIAL, pull_quic_header
+
+from src.protocol.message import MsgType, pack_binary, unpack_binary
+from .admission import ChatQuicServer
+from .fanout import fan_out
+from .server_state import ServerStateManager
+
+# Bus message kinds
+BUS_PACKET = 1    # QUIC datagram that reached a worker not owning its connection
+BUS_DELIVER = 2   # Message for clients connected to the receiving worker
+BUS_PRESENCE = 3  # A user came online or went offline on the sending worker
+BUS_HELLO = 4     # A worker started; peers answer with their online users
+BUS_PIECE = 5     # Part of a message too large for one datagram; the last part names its kind
+
+# Payload bytes per bus datagram, well within the default Unix socket buffer;
+# a chat body may be up to a megabyte, and goes over in pieces
+MAX_BUS_PAYLOAD = 32 * 1024
+
+_BUS_HEADER = struct.Struct("!BB")  # kind, source worker id
+_PIECE = struct.Struct("!B")        # kind of the whole message on its last piece, else 0
+_ADDR = struct.Struct("!HB")        # port, host length
+_NAME = struct.Struct("!H")         # length of a username
+_ONLINE = struct.Struct("!B")
+
+def stamp_cid(cid: bytes, worker_id: int) -> bytes:
+    """Mark a connection ID as owned by a worker through its first byte"""
+    return bytes([worker_id]) + cid[1:]
+
+class WorkerQuicConnection(QuicConnection):
+    """
+    QuicConnection whose host connection IDs all start with the owning worker id.
+
+    Relies on aioquic internals (_replenish_connection_ids, _host_cids,
+    _local_initial_source_connection_id), hence the exact aioquic pin in
+    requirements.txt; test_worker_connection_ids_carry_worker_id checks
+    them on every upgrade.
+    """
+    worker_id = 0
+
+    def _replenish_connection_ids(self) -> None:
+        start = len(self._host_cids)
+        super()._replenish_connection_ids()
+        for connection_id in self._host_cids[start:]:
+            connection_id.cid = stamp_cid(connection_id.cid, self.worker_id)
+
+def adopt_connection(connection: QuicConnection, worker_id: int) -> None:
+    """Stamp a freshly created server connection, before it sends anything, with its worker"""
+    connection.__class__ = WorkerQuicConnection
+    connection.worker_id = worker_id
+    first = connection._host_cids[0]
+    first.cid = stamp_cid(first.cid, worker_id)
+    connection.host_cid = first.cid
+    connection._local_initial_source_connection_id = first.cid
+
+class WorkerQuicServer(ChatQuicServer):
+    """
+    ChatQuicServer for one of several workers sharing a UDP port.
+
+    The kernel spreads datagrams over the workers by address, so a client
+    that changes address can land on the wrong worker. Packets for unknown
+    connections whose connection ID names another worker are handed to that
+    worker over the bus instead of being dropped.
+    """
+    def __init__(self, *, worker_id: int, workers: int, bus: 'MessageBus', create_protocol, **kwargs):
+        def create_owned_protocol(connection, **protocol_kwargs):
+            adopt_connection(connection, worker_id)
+            return create_protocol(connection, **protocol_kwargs)
+
+        super().__init__(create_protocol=create_owned_protocol, **kwargs)
+        self.worker_id = worker_id
+        self.workers = workers
+        self.bus = bus
+        self.forwarded = 0  # Datagrams handed to another worker
+
+    def datagram_received(self, data, addr) -> None:
+        try:
+            header = pull_quic_header(Buffer(data=data), host_cid_length=self._configuration.connection_id_length)
+        except ValueError:
+            return
+
+        cid = header.destination_cid
+        is_initial = header.is_long_header and header.packet_type == PACKET_TYPE_INITIAL
+        if cid and cid not in self._protocols and not is_initial:
+            owner = cid[0]
+            if owner != self.worker_id and owner < self.workers:
+                self.forwarded += 1
+                self.bus.forward_packet(owner, data, addr)
+                return
+
+        super().datagram_received(data, addr)
+
+class MessageBus(asyncio.DatagramProtocol):
+    """
+    Local bus between the workers of one server over Unix datagram sockets.
+
+    Carries misrouted QUIC packets, broadcasts, private messages and presence
+    so each worker can serve its own clients as if they shared one process.
+    Unix datagrams are neither lost nor reordered while the receiver is
+    running, so a message over MAX_BUS_PAYLOAD is sent as consecutive pieces
+    and put back together on arrival.
+    """
+    def __init__(self, worker_id: int, workers: int, bus_dir: str, server_state: ServerStateManager,
+                 presence=None, history=None, mailbox=None):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.bus_dir = bus_dir
+        self.server_state = server_state
+        self.presence = presence
+        self.history = history  # Every worker keeps the messages its clients could see
+        self.mailbox = mailbox  # Offline messages held here go to whichever worker the user logs in to
+        self.server: Optional[WorkerQuicServer] = None  # Set once the worker is serving
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._sending_to: Optional[int] = None  # Worker of the send in progress, for error_received()
+        self._unreachable: Set[int] = set()     # Workers whose users were forgotten after a failed send
+        self._pieces: Dict[int, List[bytes]] = {}  # Source worker -> pieces of the message it is sending
+        self.send_errors = 0  # Messages to other workers that could not be sent
+
+    def path_for(self, worker_id: int) -> str:
+        return os.path.join(self.bus_dir, f"worker-{worker_id}.sock")
+
+    async def start(self) -> None:
+        """Bind this worker's bus socket"""
+        path = self.path_for(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: self, local_addr=path, family=socket.AF_UNIX
+        )
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        path = self.path_for(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    # Outgoing
+
+    def _send(self, worker_id: int, kind: int, payload: bytes) -> None:
+        if self._transport is None:
+            return
+        # A failed send reports to error_received() before sendto() returns
+        self._sending_to = worker_id
+        path = self.path_for(worker_id)
+        if len(payload) <= MAX_BUS_PAYLOAD:
+            self._transport.sendto(_BUS_HEADER.pack(kind, self.worker_id) + payload, path)
+        else:
+            for start in range(0, len(payload), MAX_BUS_PAYLOAD):
+                end = start + MAX_BUS_PAYLOAD
+                piece = _PIECE.pack(kind if end >= len(payload) else 0) + payload[start:end]
+                self._transport.sendto(_BUS_HEADER.pack(BUS_PIECE, self.worker_id) + piece, path)
+        self._sending_to = None
+
+    def _publish(self, kind: int, payload: bytes) -> None:
+        for worker_id in range(self.workers):
+            if worker_id != self.worker_id:
+                self._send(worker_id, kind, payload)
+
+    def forward_packet(self, worker_id: int, data: bytes, addr: Tuple) -> None:
+        host = addr[0].encode("ascii")
+        self._send(worker_id, BUS_PACKET, _ADDR.pack(addr[1], len(host)) + host + data)
+
+    def publish_message(self, msg: Dict[str, Any], exclude: Optional[str] = None) -> None:
+        """Deliver a broadcast (or room message) to the clients of every other worker"""
+        self._publish(BUS_DELIVER, _encode_delivery(msg, "", exclude or ""))
+
+    def send_private(self, worker_id: int, target: str, msg: Dict[str, Any], sender: str = "") -> None:
+        """Deliver a message to one user connected to another worker; `sender` may see it in history there"""
+        self._send(worker_id, BUS_DELIVER, _encode_delivery(msg, target, sender))
+
+    def publish_presence(self, username: str, online: bool) -> None:
+        self._publish(BUS_PRESENCE, _ONLINE.pack(online) + username.encode("utf-8"))
+
+    def hello(self) -> None:
+        """Announce this worker so peers report the users they hold"""
+        self._publish(BUS_HELLO, b"")
+
+    # Incoming
+
+    def connection_made(self, transport) -> None:
+        self._transport = transport
+
+    def error_received(self, exc: Exception) -> None:
+        self.send_errors += 1
+        worker_id = self._sending_to
+        if isinstance(exc, (FileNotFoundError, ConnectionRefusedError)):
+            # A peer that has not started yet (or has exited) has no socket to send to
+            logging.debug(f"[bus {self.worker_id}] send failed: {exc}")
+            if worker_id is not None:
+                self.worker_gone(worker_id)
+        else:
+            logging.warning(f"[bus {self.worker_id}] lost a message to worker {worker_id}: {exc!r}")
+
+    def worker_gone(self, worker_id: int) -> None:
+        """Forget the users of a worker that no longer reads its socket; they log in again elsewhere"""
+        if worker_id in self._unreachable:
+            return
+        self._unreachable.add(worker_id)
+        gone = [username for username, owner in self.server_state.remote_clients.items() if owner == worker_id]
+        if not gone:
+            return
+        logging.warning(f"[bus {self.worker_id}] worker {worker_id} is gone; dropping its {len(gone)} user(s)")
+        for username in gone:
+            self.server_state.remove_remote_client(username, worker_id)
+        if self.presence is not None:
+            self.presence.changed()
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            kind, source = _BUS_HEADER.unpack_from(data, 0)
+            self._unreachable.discard(source)
+            payload = data[_BUS_HEADER.size:]
+            if kind == BUS_PIECE:
+                pieces = self._pieces.setdefault(source, [])
+                pieces.append(payload[_PIECE.size:])
+                (kind,) = _PIECE.unpack_from(payload, 0)
+                if not kind:
+                    return
+                del self._pieces[source]
+                payload = b"".join(pieces)
+            if kind == BUS_PACKET:
+                self._receive_packet(payload)
+            elif kind == BUS_DELIVER:
+                self._receive_delivery(payload)
+            elif kind == BUS_PRESENCE:
+                self._receive_presence(source, payload)
+            elif kind == BUS_HELLO:
+                self._pieces.pop(source, None)  # Whatever it was sending before it restarted
+                for username in self.server_state.clients:
+                    self._send(source, BUS_PRESENCE, _ONLINE.pack(True) + username.encode("utf-8"))
+        except Exception as e:
+            logging.error(f"[bus {self.worker_id}] bad message: {e}")
+
+    def _receive_packet(self, payload: bytes) -> None:
+        port, host_length = _ADDR.unpack_from(payload, 0)
+        offset = _ADDR.size
+        host = payload[offset:offset + host_length].decode("ascii")
+        addr = (host, port, 0, 0) if ":" in host else (host, port)
+        if self.server is not None:
+            self.server.datagram_received(payload[offset + host_length:], addr)
+
+    def _receive_delivery(self, payload: bytes) -> None:
+        msg, target, exclude = _decode_delivery(payload)
+        deliver_locally(self.server_state, self.history, msg, target, exclude)
+
+    def _receive_presence(self, source: int, payload: bytes) -> None:
+        (online,) = _ONLINE.unpack_from(payload, 0)
+        username = payload[_ONLINE.size:].decode("utf-8")
+        if online:
+            self.server_state.add_remote_client(username, source)
+            if self.mailbox is not None and self.server_state.pending_mail(username):
+                asyncio.ensure_future(self.forward_mail(username, source))
+        else:
+            self.server_state.remove_remote_client(username, source)
+        if self.presence is not None:
+            self.presence.changed()
+
+    def mail_home(self, username: str) -> Optional[int]:
+        """Where offline mail for a user is kept, if not here; workers keep what their clients send"""
+        return None
+
+    async def forward_mail(self, username: str, worker_id: int) -> None:
+        """Send the offline messages held here to the worker a user just logged in to"""
+        mail = await self.mailbox.take(username)
+        if mail:
+            self.send_private(worker_id, username, {"t": int(MsgType.SYS), "to": None, "token": None,
+                                                    "body": f"{len(mail)} message(s) arrived while you were offline."})
+        for sent_at, body in mail:
+            self.send_private(worker_id, username, {"t": int(MsgType.CHAT), "body": body, "to": None, "token": None})
+
+def deliver_locally(server_state: ServerStateManager, history, msg: Dict[str, Any], target: str,
+                    exclude: str) -> int:
+    """
+    Hand a message from another process to this one's clients: the target, or
+    the room's members, or everyone but `exclude`. Returns how many got it.
+    `exclude` is the sender, and is recorded as such in the history.
+    """
+    clients = server_state.clients
+    if target:
+        client_info = clients.get(target)
+        recipients = [client_info.protocol] if client_info else []
+    elif msg.get("room"):
+        recipients = (clients[u].protocol for u in server_state.get_room_members(msg["room"])
+                      if u != exclude and u in clients)
+    else:
+        recipients = (c.protocol for u, c in clients.items() if u != exclude)
+    sent = fan_out(recipients, msg)
+    if history is not None and msg.get("t") == MsgType.CHAT:
+        history.record(msg, sender=exclude, recipient=target)
+    return sent
+
+def _encode_delivery(msg: Dict[str, Any], target: str, exclude: str) -> bytes:
+    target_raw = target.encode("utf-8")
+    exclude_raw = exclude.encode("utf-8")
+    return b"".join((
+        _NAME.pack(len(target_raw)), target_raw,
+        _NAME.pack(len(exclude_raw)), exclude_raw,
+        pack_binary(msg),
+    ))
+
+def _decode_delivery(payload: bytes) -> Tuple[Dict[str, Any], str, str]:
+    (length,) = _NAME.unpack_from(payload, 0)
+    offset = _NAME.size
+    target = payload[offset:offset + length].decode("utf-8")
+    offset += length
+    (length,) = _NAME.unpack_from(payload, offset)
+    offset += _NAME.size
+    exclude = payload[offset:offset + length].decode("utf-8")
+    offset += length
+    msg = unpack_binary(payload[offset:])
+    del msg["v"]  # Re-encoded per recipient
+    return msg, target, exclude
+
+async def serve_worker(host: str, port: int, *, worker_id: int, workers: int, bus: MessageBus,
+                       **kwargs) -> WorkerQuicServer:
+    """Like aioquic's serve(), but sharing the port with the other workers (SO_REUSEPORT)"""
+    loop = asyncio.get_running_loop()
+    _, server = await loop.create_datagram_endpoint(
+        lambda: WorkerQuicServer(worker_id=worker_id, workers=workers, bus=bus, **kwargs),
+        local_addr=(host, port),
+        reuse_port=True,
+    )
+    bus.server = server
+    return server
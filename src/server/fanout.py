@@ -0,0 +1,58 @@
+#fanout.py
+import logging
+from typing import Any, Dict, Iterable
+
+def fan_out(recipients: Iterable['ChatProtocol'], msg: Dict[str, Any]) -> int:
+    """
+    Send one message to many connections.
+
+    The payload is serialized once per wire format and framing mode in use and
+    the same bytes are pushed straight into every recipient's connection,
+    without scheduling a task per recipient.
+
+    Args:
+        recipients: Protocols of the connections to deliver to
+        msg: Message fields; "v" is filled in per recipient
+
+    Returns:
+        Number of recipients the frame was handed to
+    """
+    frames: Dict[tuple, bytes] = {}
+    sent = 0
+    for protocol in recipients:
+        key = protocol.frame_key
+        data = frames.get(key)
+        if data is None:
+            data = frames[key] = protocol.encode_frame(msg)
+        try:
+            protocol.send_frame(data)
+            sent += 1
+        except Exception as e:
+            logging.error(f"Fan-out to {protocol.username} failed: {e}")
+    return sent
+
+
+def fan_out_ephemeral(recipients: Iterable['ChatProtocol'], msg: Dict[str, Any]) -> int:
+    """
+    Send a message that may be lost, such as a typing indicator.
+
+    Connections that negotiated QUIC DATAGRAM receive it as one datagram and
+    the rest over their stream; the payload is still encoded once per kind
+    of connection.
+
+    Returns:
+        Number of recipients the message was handed to
+    """
+    payloads: Dict[tuple, bytes] = {}
+    sent = 0
+    for protocol in recipients:
+        key = protocol.ephemeral_key
+        data = payloads.get(key)
+        if data is None:
+            data = payloads[key] = protocol.encode_ephemeral(msg)
+        try:
+            protocol.send_ephemeral(data)
+            sent += 1
+        except Exception as e:
+            logging.error(f"Ephemeral fan-out to {protocol.username} failed: {e}")
+    return sent
\ No newline at end of file
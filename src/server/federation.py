@@ -0,0 +1,634 @@
+#federation.py
+import asyncio
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+import random
+import socket
+import struct
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.protocol.message import MsgType
+from .cluster import _NAME, _decode_delivery, _encode_delivery, deliver_locally
+from .server_state import ServerStateManager
+
+# Link frame kinds
+FED_HELLO = 1     # First frame on a link: the dialing node's id and its proof of the shared secret
+FED_DELIVER = 2   # Message for clients on the receiving node, as on the worker bus
+FED_MAIL = 3      # Private message for an offline user, sent to the user's home node; kept there once returned
+FED_PRESENCE = 4  # Net presence changes of the sending node since its previous delta
+FED_SNAPSHOT = 5  # Every user online on one node, as far as the sender knows
+FED_SYNC = 6      # Request for a snapshot of one node's users
+FED_DIGEST = 7    # Presence version the sender knows for every node
+
+_FRAME = struct.Struct("!IB")   # payload length, kind
+_NODE = struct.Struct("!H")
+_VIEW = struct.Struct("!HQI")   # node id, incarnation, presence version
+_COUNT = struct.Struct("!I")
+_DIGEST = struct.Struct("!BH")  # reply flag, entries
+_HELLO = struct.Struct("!H16s32s")  # dialing node id, its nonce, proof
+_SEQ = struct.Struct("!Q")
+_RETURNED = struct.Struct("!B")  # Whether mail comes back from a node that missed the user
+_NONCE = 16
+_TAG = 16  # Bytes of keyed BLAKE2b after every frame of an authenticated link
+
+def _proof(secret: bytes, purpose: bytes, challenge: bytes, nonce: bytes, dialer: int, acceptor: int) -> bytes:
+    return hmac.digest(secret, purpose + challenge + nonce + _NODE.pack(dialer) + _NODE.pack(acceptor), "sha256")
+
+def _frame_mac(key: bytes) -> 'hashlib.blake2b':
+    """Keyed BLAKE2b state of a link; a copy per frame saves rekeying, a fraction of HMAC's cost"""
+    return hashlib.blake2b(key=key, digest_size=_TAG)
+
+def _tag(mac: 'hashlib.blake2b', seq: int, frame: bytes) -> bytes:
+    mac = mac.copy()
+    mac.update(_SEQ.pack(seq))
+    mac.update(frame)
+    return mac.digest()
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """("host", port) from "host:port" """
+    host, port = address.rsplit(":", 1)
+    return host.strip("[]"), int(port)
+
+def _encode_names(names: Iterable[str]) -> bytes:
+    raw = [name.encode("utf-8") for name in names]
+    return _COUNT.pack(len(raw)) + b"".join(_NAME.pack(len(name)) + name for name in raw)
+
+def _decode_names(payload: bytes, offset: int) -> Tuple[List[str], int]:
+    (count,) = _COUNT.unpack_from(payload, offset)
+    offset += _COUNT.size
+    names = []
+    for _ in range(count):
+        (length,) = _NAME.unpack_from(payload, offset)
+        offset += _NAME.size
+        names.append(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+    return names, offset
+
+class HashRing:
+    """
+    Consistent hashing of usernames onto node ids.
+
+    Every node sits at `replicas` points of a ring of 64-bit hashes, and a
+    user belongs to the node owning the first point at or after the hash of
+    the name. Adding a node only takes over the users between its points and
+    the ones before them, about 1/N of all users.
+    """
+    def __init__(self, nodes: Iterable[int] = (), replicas: int = 64):
+        self.replicas = replicas
+        self.nodes: Set[int] = set()
+        self._points: List[int] = []
+        self._owners: List[int] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def add(self, node: int) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = self._hash(f"node-{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def node_for(self, username: str) -> int:
+        """The home node of a user"""
+        if not self._points:
+            raise LookupError("The hash ring has no nodes")
+        return self._owners[bisect.bisect(self._points, self._hash(username)) % len(self._points)]
+
+class FederationLink:
+    """
+    Outgoing TCP connection to one peer node, batching frames.
+
+    Frames queued while the event loop works through a burst of packets are
+    written together once it gets to the scheduled flush (at the end of the
+    current loop pass, or after `batch_delay`), so one write carries many
+    messages; a negative `batch_delay` writes every frame on its own. The
+    link redials with backoff, keeping up to `max_pending_bytes` of frames
+    meanwhile and dropping the oldest beyond that. Frames written just
+    before a peer fails may be lost with its connection.
+
+    On connecting, the two nodes prove to each other that they know the
+    federation secret, answering one another's nonces, and derive a link
+    key from the nonces. Every frame then carries a MAC under that key and
+    its sequence number, so frames cannot be forged, altered or replayed.
+    Frames are not encrypted.
+    """
+    def __init__(self, federation: 'Federation', node_id: int, host: str, port: int,
+                 batch_delay: float = 0.0, max_pending_bytes: int = 8 * 1024 * 1024):
+        self.federation = federation
+        self.node_id = node_id
+        self.host = host
+        self.port = port
+        self.batch_delay = batch_delay
+        self.max_pending_bytes = max_pending_bytes
+        self._loop = asyncio.get_running_loop()
+        self._frames: deque = deque()
+        self._pending_bytes = 0
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._handle: Optional[asyncio.Handle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._mac = _frame_mac(b"")  # Keyed with the link key of the current connection
+        self._seq = 0
+        self.down_since: Optional[float] = self._loop.time()
+        self.frames_sent = 0
+        self.writes = 0
+        self.dropped = 0
+
+    @property
+    def up(self) -> bool:
+        return self._writer is not None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _run(self) -> None:
+        backoff = 0.1
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                logging.debug(f"[federation] cannot reach node {self.node_id}: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                await asyncio.wait_for(self._authenticate(reader, writer), self.federation.peer_timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                logging.warning(f"[federation] could not authenticate with node {self.node_id}: {e!r}")
+                writer.close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            backoff = 0.1
+            self._writer = writer
+            self.down_since = None
+            logging.info(f"[federation] linked to node {self.node_id} at {self.host}:{self.port}")
+            try:
+                self.federation.link_up(self)
+            except Exception:
+                logging.exception(f"[federation] could not compare notes with node {self.node_id}")
+            self.flush()
+            try:
+                await reader.read()  # Nothing comes back on this connection; EOF when the peer goes away
+            except OSError:
+                pass
+            finally:
+                self._writer = None
+                self.down_since = self._loop.time()
+                writer.close()
+            logging.warning(f"[federation] lost the link to node {self.node_id}")
+            self.federation.link_down(self)
+
+    async def _authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        secret, node_id = self.federation.secret, self.federation.node_id
+        challenge = await reader.readexactly(_NONCE)
+        nonce = os.urandom(_NONCE)
+        proof = _proof(secret, b"hello", challenge, nonce, node_id, self.node_id)
+        writer.write(_FRAME.pack(_HELLO.size, FED_HELLO) + _HELLO.pack(node_id, nonce, proof))
+        welcome = await reader.readexactly(len(proof))
+        if not hmac.compare_digest(welcome, _proof(secret, b"welcome", challenge, nonce, node_id, self.node_id)):
+            raise PermissionError("the peer does not know the federation secret")
+        self._mac = _frame_mac(_proof(secret, b"link", challenge, nonce, node_id, self.node_id))
+        self._seq = 0
+
+    def send(self, kind: int, payload: bytes) -> None:
+        frame = _FRAME.pack(len(payload), kind) + payload
+        self._frames.append(frame)
+        self._pending_bytes += len(frame)
+        while self._pending_bytes > self.max_pending_bytes:
+            self._pending_bytes -= len(self._frames.popleft())
+            self.dropped += 1
+        if self._writer is None or self._handle is not None:
+            return
+        if self.batch_delay < 0:
+            self.flush()
+        elif self.batch_delay:
+            self._handle = self._loop.call_later(self.batch_delay, self.flush)
+        else:
+            self._handle = self._loop.call_soon(self.flush)
+
+    def flush(self) -> None:
+        """Write every queued frame in one go"""
+        self._handle = None
+        writer = self._writer
+        if writer is None or not self._frames:
+            return
+        if writer.transport.get_write_buffer_size() > self.max_pending_bytes:
+            # The peer is not keeping up; let frames queue (and the oldest go) until it does
+            self._handle = self._loop.call_later(0.01, self.flush)
+            return
+        mac, seq = self._mac, self._seq
+        parts = []
+        for frame in self._frames:
+            parts.append(frame)
+            parts.append(_tag(mac, seq, frame))
+            seq += 1
+        self._seq = seq
+        writer.write(b"".join(parts))
+        self.frames_sent += len(self._frames)
+        self.writes += 1
+        self._frames.clear()
+        self._pending_bytes = 0
+
+class Federation:
+    """
+    Links this server to the other nodes of a federation, so they behave as one chat.
+
+    Offers ChatProtocol the interface of the worker bus (publish_message,
+    send_private, publish_presence), carried over a batching TCP link to
+    every peer. Users are placed on a consistent-hash ring: a user's home
+    node keeps the offline mail for them, so a private message to an
+    offline user goes there and is handed on when the user logs in at any
+    node. Presence is gossiped: each node pushes versioned deltas of its own
+    users, and every `gossip_interval` seconds swaps a digest of the
+    versions it knows with a random peer, which answers with snapshots of
+    whatever the other side missed. A peer whose link drops, or that stays
+    unreachable for `peer_timeout` seconds, is taken to have no users. Membership is fixed by the
+    configuration, and nodes admit each other by a shared `secret`.
+    """
+    def __init__(self, node_id: int, listen: Tuple[str, int], peers: Dict[int, Tuple[str, int]],
+                 server_state: ServerStateManager, presence=None, history=None, mailbox=None,
+                 replicas: int = 64, batch_delay: float = 0.0, gossip_interval: float = 1.0,
+                 peer_timeout: float = 10.0, max_pending_bytes: int = 8 * 1024 * 1024, secret: bytes = b""):
+        if len(secret) < 32:
+            raise ValueError("The federation secret must be at least 32 bytes long")
+        self.node_id = node_id
+        self.secret = secret
+        self.listen_address = listen
+        self.peers = dict(peers)
+        self.server_state = server_state
+        self.presence = presence
+        self.history = history
+        self.mailbox = mailbox
+        self.ring = HashRing([node_id, *peers], replicas)
+        self.batch_delay = batch_delay
+        self.gossip_interval = gossip_interval
+        self.peer_timeout = peer_timeout
+        self.max_pending_bytes = max_pending_bytes
+        # A restarted node counts its presence versions afresh; the incarnation tells them apart
+        self.incarnation = time.time_ns() // 1000
+        self.version = 0
+        self.views: Dict[int, Tuple[int, int]] = {}       # Node -> (incarnation, version) applied here
+        self.users_by_node: Dict[int, Set[str]] = {}      # Node -> its users, as applied here
+        self.links: Dict[int, FederationLink] = {}
+        self._delta: Dict[str, bool] = {}                 # Own users joining (True) or leaving since the last push
+        self._delta_handle: Optional[asyncio.Handle] = None
+        self._gossip_handle: Optional[asyncio.TimerHandle] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._accepted: Set[asyncio.StreamWriter] = set()  # Links dialed in by the peers
+        self.frames_received = 0
+        self.rejected = 0  # Incoming connections that failed to authenticate
+
+    @classmethod
+    def from_config(cls, config: dict, server_state: ServerStateManager, presence=None, history=None,
+                    mailbox=None) -> Optional['Federation']:
+        """Build the federation link from the server configuration; None when it is disabled"""
+        if not config.get("federation", False):
+            return None
+        secret = config.get("federation_secret") or os.environ.get("CHAT_FEDERATION_SECRET")
+        if not secret:
+            raise ValueError("Federation needs a shared secret: set federation_secret or CHAT_FEDERATION_SECRET")
+        peers = {int(node): parse_address(address) for node, address in config.get("federation_peers", {}).items()}
+        return cls(config.get("federation_node_id", 0),
+                   parse_address(config.get("federation_listen", "127.0.0.1:7400")),
+                   peers, server_state, presence, history, mailbox,
+                   replicas=config.get("federation_replicas", 64),
+                   batch_delay=config.get("federation_batch_delay", 0.0),
+                   gossip_interval=config.get("federation_gossip_interval", 1.0),
+                   peer_timeout=config.get("federation_peer_timeout", 10.0),
+                   max_pending_bytes=config.get("federation_max_pending_bytes", 8 * 1024 * 1024),
+                   secret=secret.encode("utf-8"))
+
+    async def listen(self) -> int:
+        """Accept links from the peers; returns the port listened on"""
+        host, port = self.listen_address
+        self._server = await asyncio.start_server(self._serve_peer, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    def add_peer(self, node_id: int, host: str, port: int) -> None:
+        """Start linking to a peer"""
+        self.peers[node_id] = (host, port)
+        self.ring.add(node_id)
+        link = self.links[node_id] = FederationLink(self, node_id, host, port, self.batch_delay,
+                                                   self.max_pending_bytes)
+        link.start()
+
+    async def start(self) -> None:
+        await self.listen()
+        for node_id, (host, port) in self.peers.items():
+            self.add_peer(node_id, host, port)
+        if self.gossip_interval:
+            self._gossip_handle = asyncio.get_running_loop().call_later(self.gossip_interval, self.gossip)
+
+    def close(self) -> None:
+        for handle in (self._delta_handle, self._gossip_handle):
+            if handle is not None:
+                handle.cancel()
+        for link in self.links.values():
+            link.close()
+        if self._server is not None:
+            self._server.close()
+        for writer in self._accepted:
+            writer.close()
+
+    # Outgoing
+
+    def _publish(self, kind: int, payload: bytes) -> None:
+        for link in self.links.values():
+            link.send(kind, payload)
+
+    def publish_message(self, msg: Dict[str, Any], exclude: Optional[str] = None) -> None:
+        """Deliver a broadcast (or room message) to the clients of every other node"""
+        self._publish(FED_DELIVER, _encode_delivery(msg, "", exclude or ""))
+
+    def send_private(self, node_id: int, target: str, msg: Dict[str, Any], sender: str = "") -> None:
+        """Deliver a message to one user connected to another node; `sender` may see it in history there"""
+        link = self.links.get(node_id)
+        if link is not None:
+            link.send(FED_DELIVER, _encode_delivery(msg, target, sender))
+
+    def mail_home(self, username: str) -> Optional[int]:
+        """The node keeping offline mail for a user, if not this one"""
+        home = self.ring.node_for(username)
+        return None if home == self.node_id else home
+
+    def send_mail(self, node_id: int, target: str, body: str, returned: bool = False) -> None:
+        """
+        Hand a private message for an offline user to the user's home node.
+        Mail `returned` by a node that missed the user is kept there, never
+        forwarded again, so mail cannot bounce between nodes.
+        """
+        raw = target.encode("utf-8")
+        self.links[node_id].send(FED_MAIL, _RETURNED.pack(returned) + _NAME.pack(len(raw)) + raw + body.encode("utf-8"))
+
+    def publish_presence(self, username: str, online: bool) -> None:
+        """Note that a user of this node came or went; the changes of one loop pass go out as one delta"""
+        self._delta[username] = online
+        if self._delta_handle is None:
+            self._delta_handle = asyncio.get_running_loop().call_soon(self._push_presence)
+
+    def _push_presence(self) -> None:
+        self._delta_handle = None
+        joined = [username for username, online in self._delta.items() if online]
+        left = [username for username, online in self._delta.items() if not online]
+        self._delta.clear()
+        self.version += 1
+        self._publish(FED_PRESENCE, _VIEW.pack(self.node_id, self.incarnation, self.version)
+                      + _encode_names(joined) + _encode_names(left))
+
+    def _snapshot(self, node_id: int) -> Optional[bytes]:
+        if node_id == self.node_id:
+            view, users = (self.incarnation, self.version), self.server_state.clients
+        elif node_id in self.views:
+            view, users = self.views[node_id], self.users_by_node.get(node_id, ())
+        else:
+            return None
+        return _VIEW.pack(node_id, *view) + _encode_names(users)
+
+    def _digest(self, reply: bool) -> bytes:
+        entries = [(self.node_id, self.incarnation, self.version)]
+        entries.extend((node_id, *view) for node_id, view in self.views.items())
+        return _DIGEST.pack(reply, len(entries)) + b"".join(_VIEW.pack(*entry) for entry in entries)
+
+    def link_up(self, link: FederationLink) -> None:
+        """A link (re)connected: compare notes so either side learns what it missed"""
+        link.send(FED_DIGEST, self._digest(reply=False))
+
+    def link_down(self, link: FederationLink) -> None:
+        """A link dropped: its node's users are no longer reachable, so stop routing to them"""
+        self._drop_users(link.node_id)
+
+    def _drop_users(self, node_id: int) -> None:
+        if not self.users_by_node.get(node_id):
+            return
+        logging.warning(f"[federation] node {node_id} unreachable; dropping its users")
+        self._apply_users(node_id, set())
+        # Whatever it reports once it is back, even unchanged, counts as news
+        self.views.pop(node_id, None)
+
+    def gossip(self) -> None:
+        """Drop peers gone for too long, and swap digests with a random peer"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        try:
+            for node_id, link in self.links.items():
+                if link.down_since is not None and now - link.down_since > self.peer_timeout:
+                    self._drop_users(node_id)
+            up = [link for link in self.links.values() if link.up]
+            if up:
+                random.choice(up).send(FED_DIGEST, self._digest(reply=False))
+        except Exception:
+            logging.exception("[federation] gossip round failed")
+        finally:
+            self._gossip_handle = loop.call_later(self.gossip_interval, self.gossip)
+
+    # Incoming
+
+    async def _admit_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Tuple[int, Any]:
+        """Challenge a connecting node; its id and the link's frame MAC once it has proved it knows the secret"""
+        challenge = os.urandom(_NONCE)
+        writer.write(challenge)
+        hello = await asyncio.wait_for(reader.readexactly(_FRAME.size + _HELLO.size), self.peer_timeout)
+        if _FRAME.unpack_from(hello) != (_HELLO.size, FED_HELLO):
+            raise PermissionError("no hello")
+        source, nonce, proof = _HELLO.unpack_from(hello, _FRAME.size)
+        if not hmac.compare_digest(proof, _proof(self.secret, b"hello", challenge, nonce, source, self.node_id)):
+            raise PermissionError("bad proof of the federation secret")
+        if source not in self.peers:
+            raise PermissionError(f"node {source} is not a peer")
+        writer.write(_proof(self.secret, b"welcome", challenge, nonce, source, self.node_id))
+        return source, _frame_mac(_proof(self.secret, b"link", challenge, nonce, source, self.node_id))
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b""
+        seq = 0
+        self._accepted.add(writer)
+        try:
+            try:
+                source, mac = await self._admit_peer(reader, writer)
+            except (asyncio.TimeoutError, PermissionError) as e:
+                self.rejected += 1
+                logging.warning(f"[federation] refused a link from {writer.get_extra_info('peername')}: {e!r}")
+                return
+            while True:
+                data = await reader.read(256 * 1024)
+                if not data:
+                    break
+                buffer += data
+                offset = 0
+                # Every complete frame of what arrived, handled in one go
+                while len(buffer) - offset >= _FRAME.size:
+                    length, kind = _FRAME.unpack_from(buffer, offset)
+                    end = offset + _FRAME.size + length
+                    if end + _TAG > len(buffer):
+                        break
+                    if not hmac.compare_digest(buffer[end:end + _TAG], _tag(mac, seq, buffer[offset:end])):
+                        logging.warning(f"[federation] bad MAC on a frame from node {source}; dropping the link")
+                        return
+                    seq += 1
+                    payload = buffer[offset + _FRAME.size:end]
+                    offset = end + _TAG
+                    self.receive(source, kind, payload)
+                buffer = buffer[offset:]
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._accepted.discard(writer)
+            writer.close()
+
+    def receive(self, source: int, kind: int, payload: bytes) -> None:
+        self.frames_received += 1
+        try:
+            if kind == FED_DELIVER:
+                self._receive_delivery(source, payload)
+            elif kind == FED_MAIL:
+                self._receive_mail(source, payload)
+            elif kind == FED_PRESENCE:
+                self._receive_presence(source, payload)
+            elif kind == FED_SNAPSHOT:
+                self._receive_snapshot(payload)
+            elif kind == FED_SYNC:
+                (node_id,) = _NODE.unpack(payload)
+                snapshot = self._snapshot(node_id)
+                if snapshot is not None and source in self.links:
+                    self.links[source].send(FED_SNAPSHOT, snapshot)
+            elif kind == FED_DIGEST:
+                self._receive_digest(source, payload)
+        except Exception as e:
+            logging.error(f"[federation] bad frame {kind} from node {source}: {e}")
+
+    def _receive_delivery(self, source: int, payload: bytes) -> None:
+        msg, target, exclude = _decode_delivery(payload)
+        if target and target not in self.server_state.clients:
+            # The user left before the message arrived: it becomes offline mail, kept at home
+            if msg.get("t") == MsgType.CHAT:
+                home = self.mail_home(target)
+                if home is not None:
+                    self.send_mail(home, target, msg["body"], returned=True)
+                else:
+                    self._keep_mail(target, msg["body"])
+            return
+        deliver_locally(self.server_state, self.history, msg, target, exclude)
+
+    def _receive_mail(self, source: int, payload: bytes) -> None:
+        (returned,) = _RETURNED.unpack_from(payload, 0)
+        offset = _RETURNED.size
+        (length,) = _NAME.unpack_from(payload, offset)
+        target = payload[offset + _NAME.size:offset + _NAME.size + length].decode("utf-8")
+        body = payload[offset + _NAME.size + length:].decode("utf-8")
+        msg = {"t": int(MsgType.CHAT), "body": body, "to": None, "token": None}
+        if returned:
+            # The sender knows its own users: the user is not there, whatever presence said
+            self.users_by_node.get(source, set()).discard(target)
+            self.server_state.remove_remote_client(target, source)
+        node_id = self.server_state.get_client_worker(target)
+        if target in self.server_state.clients:
+            deliver_locally(self.server_state, self.history, msg, target, "")
+        elif node_id is not None and not returned:
+            # Logged in elsewhere while the mail was on its way
+            self.send_private(node_id, target, msg)
+        else:
+            # Kept here even if this node is not the user's home by its own ring: mail takes no further hops
+            self._keep_mail(target, body)
+
+    def _keep_mail(self, target: str, body: str) -> None:
+        if self.mailbox is not None and not self.mailbox.put(target, body):
+            logging.warning(f"[federation] no room for offline mail to '{target}'")
+
+    def _newer(self, node_id: int, incarnation: int, version: int) -> bool:
+        view = self.views.get(node_id)
+        return view is None or (incarnation, version) > view
+
+    def _receive_presence(self, source: int, payload: bytes) -> None:
+        node_id, incarnation, version = _VIEW.unpack_from(payload, 0)
+        if node_id == self.node_id or not self._newer(node_id, incarnation, version):
+            return
+        if self.views.get(node_id) != (incarnation, version - 1):
+            # Missed a delta (or the node restarted): ask for the whole list instead
+            if source in self.links:
+                self.links[source].send(FED_SYNC, _NODE.pack(node_id))
+            return
+        joined, offset = _decode_names(payload, _VIEW.size)
+        left, _ = _decode_names(payload, offset)
+        self.views[node_id] = (incarnation, version)
+        users = self.users_by_node.setdefault(node_id, set())
+        for username in left:
+            users.discard(username)
+            self.server_state.remove_remote_client(username, node_id)
+        for username in joined:
+            users.add(username)
+            self._user_online(username, node_id)
+        if self.presence is not None:
+            self.presence.changed()
+
+    def _receive_snapshot(self, payload: bytes) -> None:
+        node_id, incarnation, version = _VIEW.unpack_from(payload, 0)
+        if node_id == self.node_id or not self._newer(node_id, incarnation, version):
+            return
+        users, _ = _decode_names(payload, _VIEW.size)
+        self.views[node_id] = (incarnation, version)
+        self._apply_users(node_id, set(users))
+
+    def _apply_users(self, node_id: int, users: Set[str]) -> None:
+        """Replace what is known about the users of a node"""
+        known = self.users_by_node.get(node_id, set())
+        for username in known - users:
+            self.server_state.remove_remote_client(username, node_id)
+        for username in users - known:
+            self._user_online(username, node_id)
+        self.users_by_node[node_id] = users
+        if self.presence is not None:
+            self.presence.changed()
+
+    def _user_online(self, username: str, node_id: int) -> None:
+        self.server_state.add_remote_client(username, node_id)
+        if self.mailbox is not None and self.server_state.pending_mail(username):
+            asyncio.ensure_future(self.forward_mail(username, node_id))
+
+    def _receive_digest(self, source: int, payload: bytes) -> None:
+        reply, count = _DIGEST.unpack_from(payload, 0)
+        link = self.links.get(source)
+        if link is None:
+            return
+        theirs = {}
+        for i in range(count):
+            node_id, incarnation, version = _VIEW.unpack_from(payload, _DIGEST.size + i * _VIEW.size)
+            theirs[node_id] = (incarnation, version)
+        mine = dict(self.views)
+        mine[self.node_id] = (self.incarnation, self.version)
+        for node_id, view in mine.items():
+            if node_id != source and view > theirs.get(node_id, (-1, -1)):
+                link.send(FED_SNAPSHOT, self._snapshot(node_id))
+        behind = any(view > mine.get(node_id, (-1, -1)) for node_id, view in theirs.items())
+        if behind and not reply:
+            link.send(FED_DIGEST, self._digest(reply=True))
+
+    async def forward_mail(self, username: str, node_id: int) -> None:
+        """Send the offline messages held here to the node a user just logged in to"""
+        mail = await self.mailbox.take(username)
+        if mail:
+            self.send_private(node_id, username, {"t": int(MsgType.SYS), "to": None, "token": None,
+                                                  "body": f"{len(mail)} message(s) arrived while you were offline."})
+        for sent_at, body in mail:
+            self.send_private(node_id, username, {"t": int(MsgType.CHAT), "body": body, "to": None, "token": None})
\ No newline at end of file
@@ -0,0 +1,377 @@
+#history.py
+import asyncio
+import bisect
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.protocol.message import MsgType, pack_binary, unpack_binary
+
+# Log record: sequence number, unix timestamp, payload length, then the payload
+_RECORD = struct.Struct("!QdI")
+# Sparse index entry: sequence number, byte offset of its record in the segment
+_INDEX = struct.Struct("!QQ")
+_NAME = struct.Struct("!H")
+
+Record = Tuple[int, float, bytes]
+
+class _Segment:
+    """One log file holding records from base_seq onwards, plus its sparse index"""
+    def __init__(self, directory: str, base_seq: int):
+        self.base_seq = base_seq
+        self.log_path = os.path.join(directory, f"{base_seq:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_seq:020d}.idx")
+        self.size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        self.flushed = self.size  # Bytes readers may look at
+        self.index: List[Tuple[int, int]] = []
+        self.last_seq = base_seq - 1
+        self._map: Optional[mmap.mmap] = None
+        self._map_size = 0
+
+    def load(self) -> None:
+        """Read the sparse index and find the last record of an existing segment"""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % _INDEX.size
+            self.index = [_INDEX.unpack_from(data, i) for i in range(0, usable, _INDEX.size)]
+            self.index = [(seq, offset) for seq, offset in self.index if offset < self.size]
+        offset = self.index[-1][1] if self.index else 0
+        # Scan the unindexed tail; a torn final record is cut off
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        position = 0
+        while position + _RECORD.size <= len(data):
+            seq, _, length = _RECORD.unpack_from(data, position)
+            if position + _RECORD.size + length > len(data):
+                break
+            self.last_seq = seq
+            position += _RECORD.size + length
+        if offset + position < self.size:
+            with open(self.log_path, "r+b") as f:
+                f.truncate(offset + position)
+            self.size = self.flushed = offset + position
+
+    def view(self, size: int) -> mmap.mmap:
+        """Map the first `size` bytes of the log, remapping when the file has grown"""
+        if self._map is None or self._map_size < size:
+            # The old map is left to the garbage collector; another reader may still hold it
+            with open(self.log_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._map_size = size
+        return self._map
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class HistoryStore:
+    """
+    Segmented, append-only message log.
+
+    append() only assigns a sequence number and queues the record; a writer
+    thread puts it on disk, so the event loop never waits for file I/O. Each
+    segment keeps a sparse index (one entry every `index_interval` records)
+    and is read through mmap, so a range read touches only the pages it needs.
+    Recent records are also kept in memory and served from there.
+    """
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 index_interval: int = 64, tail_records: int = 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._segments: List[_Segment] = []
+        self._open_segments()
+        self.last_seq = self._segments[-1].last_seq if self._segments else 0
+        self._durable_seq = self.last_seq  # Highest sequence number on disk
+        self._tail: deque = deque(maxlen=tail_records)
+
+        self._queue: "queue.Queue[Optional[Record]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _open_segments(self) -> None:
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log"))
+        for base in bases:
+            segment = _Segment(self.directory, base)
+            segment.load()
+            self._segments.append(segment)
+
+    @property
+    def first_seq(self) -> int:
+        return self._segments[0].base_seq if self._segments else self.last_seq + 1
+
+    def append(self, payload: bytes) -> int:
+        """Queue a record for writing and return its sequence number"""
+        with self._lock:
+            self.last_seq += 1
+            record = (self.last_seq, time.time(), payload)
+            self._tail.append(record)
+        self._queue.put(record)
+        return record[0]
+
+    def _write_loop(self) -> None:
+        log = None
+        index = None
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                batch = [record]
+                # Write whatever else is already waiting in one go
+                while len(batch) < 1024:
+                    try:
+                        record = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(record)
+
+                for seq, timestamp, payload in batch:
+                    segment = self._segments[-1] if self._segments else None
+                    if segment is None or segment.size >= self.segment_bytes:
+                        if log is not None:
+                            log.close()
+                            index.close()
+                        new_segment = _Segment(self.directory, seq)
+                        with self._lock:
+                            if segment is not None:
+                                segment.flushed = segment.size
+                            self._segments.append(new_segment)
+                        segment = new_segment
+                        log = index = None
+                    if log is None:
+                        log = open(segment.log_path, "ab")
+                        index = open(segment.index_path, "ab")
+                    if (seq - segment.base_seq) % self.index_interval == 0:
+                        index.write(_INDEX.pack(seq, segment.size))
+                        segment.index.append((seq, segment.size))
+                    log.write(_RECORD.pack(seq, timestamp, len(payload)))
+                    log.write(payload)
+                    segment.size += _RECORD.size + len(payload)
+                    segment.last_seq = seq
+                log.flush()
+                index.flush()
+                with self._written:
+                    segment.flushed = segment.size
+                    self._durable_seq = batch[-1][0]
+                    self._written.notify_all()
+        except Exception as e:
+            logging.error(f"History writer stopped: {e}")
+        finally:
+            if log is not None:
+                log.close()
+                index.close()
+
+    def read(self, start_seq: int, limit: int) -> List[Record]:
+        """
+        Read up to `limit` records with sequence numbers >= start_seq.
+
+        Blocks on file I/O; call it from an executor, not the event loop.
+        """
+        start_seq = max(start_seq, self.first_seq)
+        with self._lock:
+            tail = list(self._tail)
+        if tail and start_seq >= tail[0][0]:
+            return [r for r in tail if r[0] >= start_seq][:limit]
+
+        end_seq = start_seq + limit - 1
+        with self._written:
+            # Records older than the in-memory tail must be on disk first
+            wanted = min(end_seq, tail[0][0] - 1 if tail else self.last_seq)
+            self._written.wait_for(lambda: self._durable_seq >= wanted, timeout=5)
+            segments = list(self._segments)
+
+        records: List[Record] = []
+        position = bisect.bisect_right([s.base_seq for s in segments], start_seq) - 1
+        for segment in segments[max(position, 0):]:
+            records.extend(self._read_segment(segment, start_seq, limit - len(records)))
+            if len(records) >= limit:
+                break
+        if len(records) < limit and tail:
+            after = records[-1][0] if records else start_seq - 1
+            records.extend(r for r in tail if r[0] > after)
+        return records[:limit]
+
+    def _read_segment(self, segment: _Segment, start_seq: int, limit: int) -> List[Record]:
+        with self._lock:
+            size = segment.flushed
+            entry = bisect.bisect_right(segment.index, (start_seq, float("inf"))) - 1
+            offset = segment.index[entry][1] if entry >= 0 else 0
+            view = segment.view(size) if size else None
+        records = []
+        while view is not None and offset + _RECORD.size <= size and len(records) < limit:
+            seq, timestamp, length = _RECORD.unpack_from(view, offset)
+            offset += _RECORD.size
+            if seq >= start_seq:
+                records.append((seq, timestamp, view[offset:offset + length]))
+            offset += length
+        return records
+
+    def flush(self, timeout: float = 5) -> bool:
+        """Wait until every queued record is on disk"""
+        with self._written:
+            target = self.last_seq
+            return self._written.wait_for(lambda: self._durable_seq >= target, timeout=timeout)
+
+    def close(self) -> None:
+        """Write out queued records and stop the writer thread"""
+        self._queue.put(None)
+        self._writer.join()
+        for segment in self._segments:
+            segment.close()
+
+def encode_entry(msg: Dict[str, Any], sender: str = "", recipient: str = "") -> bytes:
+    """History payload: who may see the message, then the message as delivered"""
+    sender_raw = sender.encode("utf-8")
+    recipient_raw = recipient.encode("utf-8")
+    return b"".join((
+        _NAME.pack(len(sender_raw)), sender_raw,
+        _NAME.pack(len(recipient_raw)), recipient_raw,
+        pack_binary(msg),
+    ))
+
+def decode_entry(payload: bytes) -> Tuple[Dict[str, Any], str, str]:
+    """Split a history payload into (message, sender, recipient)"""
+    (length,) = _NAME.unpack_from(payload, 0)
+    offset = _NAME.size
+    sender = bytes(payload[offset:offset + length]).decode("utf-8")
+    offset += length
+    (length,) = _NAME.unpack_from(payload, offset)
+    offset += _NAME.size
+    recipient = bytes(payload[offset:offset + length]).decode("utf-8")
+    offset += length
+    msg = unpack_binary(bytes(payload[offset:]))
+    del msg["v"]
+    return msg, sender, recipient
+
+class ChatHistory:
+    """
+    Chat messages kept by the server and served back in pages.
+
+    Global messages are visible to everyone, room messages to the room's
+    current members and private messages to their two participants.
+    """
+    def __init__(self, store: HistoryStore, server_state, page_size: int = 50, max_request: int = 500):
+        self.store = store
+        self.server_state = server_state
+        self.page_size = page_size
+        self.max_request = max_request  # Most records returned for one request
+
+    @classmethod
+    def from_config(cls, config: dict, server_state, worker_id: int = 0) -> Optional['ChatHistory']:
+        """Build the history from the server configuration; None when it is disabled"""
+        directory = config.get("history_dir")
+        if not directory:
+            return None
+        if config.get("workers", 1) > 1:
+            directory = os.path.join(directory, f"worker-{worker_id}")
+        store = HistoryStore(
+            directory,
+            segment_bytes=config.get("history_segment_bytes", 64 * 1024 * 1024),
+            index_interval=config.get("history_index_interval", 64),
+        )
+        return cls(store, server_state, page_size=config.get("history_page_size", 50),
+                   max_request=config.get("history_max_request", 500))
+
+    def record(self, msg: Dict[str, Any], sender: str = "", recipient: str = "") -> int:
+        """Append a delivered message; `recipient` marks it as private"""
+        return self.store.append(encode_entry(msg, sender, recipient))
+
+    def visible_to(self, username: str, msg: Dict[str, Any], sender: str, recipient: str) -> bool:
+        if recipient:
+            return username in (sender, recipient)
+        room = msg.get("room")
+        return not room or self.server_state.is_room_member(username, room)
+
+    def _collect(self, username: str, start_seq: int, limit: int, scan_limit: int) -> Tuple[List[list], int]:
+        """Read visible records from start_seq on; runs in an executor thread"""
+        records: List[list] = []
+        cursor = start_seq - 1
+        scanned = 0
+        while len(records) < limit and scanned < scan_limit:
+            chunk = self.store.read(cursor + 1, min(self.page_size, scan_limit - scanned))
+            if not chunk:
+                break
+            for seq, timestamp, payload in chunk:
+                cursor = seq
+                msg, sender, recipient = decode_entry(payload)
+                if self.visible_to(username, msg, sender, recipient):
+                    records.append([seq, timestamp, msg.get("body"), msg.get("room")])
+                    if len(records) >= limit:
+                        break
+            scanned += len(chunk)
+        return records, cursor
+
+    def _collect_last(self, username: str, end_seq: int, limit: int, scan_limit: int) -> List[list]:
+        """Read the last visible records up to end_seq, oldest first; runs in an executor thread"""
+        records: List[list] = []
+        scanned = 0
+        first_seq = self.store.first_seq
+        while len(records) < limit and scanned < scan_limit and end_seq >= first_seq:
+            start_seq = max(end_seq - self.page_size + 1, first_seq)
+            chunk = self.store.read(start_seq, end_seq - start_seq + 1)
+            if not chunk:
+                break
+            for seq, timestamp, payload in reversed(chunk):
+                msg, sender, recipient = decode_entry(payload)
+                if self.visible_to(username, msg, sender, recipient):
+                    records.append([seq, timestamp, msg.get("body"), msg.get("room")])
+                    if len(records) >= limit:
+                        break
+            scanned += len(chunk)
+            end_seq = start_seq - 1
+        records.reverse()
+        return records
+
+    async def fetch(self, username: str, since: Optional[int] = None,
+                    last: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Build the HISTORY pages answering one request: the records after
+        sequence number `since`, or among the `last` records of the log.
+        """
+        limit = min(last or self.page_size, self.max_request)
+        loop = asyncio.get_running_loop()
+        if since is not None:
+            start_seq = since + 1
+            records, cursor = await loop.run_in_executor(
+                None, self._collect, username, max(start_seq, 1), limit, limit * 10
+            )
+            cursor = max(cursor, start_seq - 1)
+        else:
+            # The newest `limit` records this user may see, not the visible share of the newest `limit`
+            cursor = self.store.last_seq
+            records = await loop.run_in_executor(None, self._collect_last, username, cursor, limit, limit * 10)
+        more = cursor < self.store.last_seq
+
+        pages = []
+        for i in range(0, max(len(records), 1), self.page_size):
+            page = records[i:i + self.page_size]
+            last_page = i + self.page_size >= len(records)
+            pages.append({
+                "t": int(MsgType.HISTORY),
+                "body": json.dumps({"records": page, "more": more if last_page else True}),
+                "to": None, "token": None,
+                # Cursor for the next request: pass it back as "seq"
+                "seq": cursor if last_page else page[-1][0],
+            })
+        return pages
+
+    def close(self) -> None:
+        self.store.close()
\ No newline at end of file
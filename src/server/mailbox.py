@@ -0,0 +1,293 @@
+#mailbox.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .server_state import ServerStateManager
+
+# A queued message: its expiry, and the JSON line [expires_at, sent_at, body] it is spilled as
+Mail = Tuple[float, bytes]
+
+class _Box:
+    """Queued messages of one recipient: newest in memory, older ones possibly spilled to a file"""
+    __slots__ = ("memory", "memory_bytes", "on_disk", "disk_bytes", "disk_expires", "unspilled")
+
+    def __init__(self):
+        self.memory: deque = deque()  # Mail, oldest first
+        self.memory_bytes = 0
+        self.on_disk = 0
+        self.disk_bytes = 0
+        self.disk_expires = float("inf")  # Earliest expiry among the spilled messages
+        self.unspilled: List[Mail] = []  # Spilled by a failed append after take() had claimed the box
+
+    def __len__(self) -> int:
+        return len(self.memory) + self.on_disk
+
+class OfflineMailbox:
+    """
+    Private messages held for users who are offline.
+
+    Each recipient may have up to `max_per_user` messages waiting. All
+    mailboxes together hold at most `max_bytes` in memory; past that, whole
+    mailboxes are spilled to files in `spill_dir` in turn (up to
+    `spill_max_bytes`), or new messages are refused when spilling is off.
+    Messages expire after `ttl` seconds. The number waiting for each user is
+    indexed in ServerStateManager.offline_mail, so a login checks for mail
+    without touching the mailbox. Spilled files only relieve memory and do
+    not outlive the process. File work runs in the default executor, one
+    job at a time per user, and the counts are settled on the event loop.
+    """
+    def __init__(self, server_state: ServerStateManager, max_per_user: int = 100,
+                 max_bytes: int = 8 * 1024 * 1024, ttl: float = 7 * 24 * 3600.0,
+                 spill_dir: Optional[str] = None, spill_max_bytes: int = 256 * 1024 * 1024,
+                 sweep_interval: float = 60.0):
+        self.server_state = server_state
+        self.max_per_user = max_per_user
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.sweep_interval = sweep_interval
+        self._boxes: 'OrderedDict[str, _Box]' = OrderedDict()  # Next to spill first
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._file_jobs: Dict[str, asyncio.Future] = {}  # Latest file job per user; the next one waits for it
+        self.queued = 0
+        self.refused = 0
+        self.expired = 0
+        self.delivered = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Left over from an earlier run whose mailboxes are gone
+            for name in os.listdir(spill_dir):
+                if name.endswith(".jsonl"):
+                    os.unlink(os.path.join(spill_dir, name))
+
+    @classmethod
+    def from_config(cls, config: dict, server_state: ServerStateManager,
+                    worker_id: int = 0) -> Optional['OfflineMailbox']:
+        """Build the mailbox from the server configuration; None when it is disabled"""
+        if not config.get("mailbox", True):
+            return None
+        spill_dir = config.get("mailbox_spill_dir")
+        if spill_dir and config.get("workers", 1) > 1:
+            spill_dir = os.path.join(spill_dir, f"worker-{worker_id}")
+        return cls(server_state, max_per_user=config.get("mailbox_max_per_user", 100),
+                   max_bytes=config.get("mailbox_max_bytes", 8 * 1024 * 1024),
+                   ttl=config.get("mailbox_ttl", 7 * 24 * 3600.0), spill_dir=spill_dir,
+                   spill_max_bytes=config.get("mailbox_spill_max_bytes", 256 * 1024 * 1024))
+
+    def put(self, recipient: str, body: str, now: Optional[float] = None) -> bool:
+        """Queue a message body for an offline user; False when a cap refuses it"""
+        if now is None:
+            now = time.time()
+        if self.server_state.pending_mail(recipient) >= self.max_per_user:
+            self.refused += 1
+            return False
+        line = json.dumps([now + self.ttl, now, body]).encode("utf-8") + b"\n"
+        if self.memory_bytes + len(line) > self.max_bytes and not self._make_room(len(line)):
+            self.refused += 1
+            return False
+
+        box = self._boxes.get(recipient)
+        if box is None:
+            box = self._boxes[recipient] = _Box()
+        box.memory.append((now + self.ttl, line))
+        box.memory_bytes += len(line)
+        self.memory_bytes += len(line)
+        self.server_state.offline_mail[recipient] = len(box)
+        self.queued += 1
+        if self._handle is None and self.sweep_interval:
+            self._handle = asyncio.get_running_loop().call_later(self.sweep_interval, self.sweep)
+        return True
+
+    def _make_room(self, size: int) -> bool:
+        """Spill mailboxes in turn until `size` more bytes fit in memory"""
+        if not self.spill_dir:
+            return False
+        for _ in range(len(self._boxes)):
+            if self.memory_bytes + size <= self.max_bytes:
+                break
+            username, box = next(iter(self._boxes.items()))
+            if box.memory and self.disk_bytes + box.memory_bytes <= self.spill_max_bytes:
+                self._spill(username, box)
+            self._boxes.move_to_end(username)
+        return self.memory_bytes + size <= self.max_bytes
+
+    def path_for(self, username: str) -> str:
+        return os.path.join(self.spill_dir, hashlib.sha1(username.encode("utf-8")).hexdigest() + ".jsonl")
+
+    def _file_job(self, username: str, func: Callable, *args) -> asyncio.Future:
+        """Run `func` in the executor once the earlier file jobs for the same user are done"""
+        loop = asyncio.get_running_loop()
+        previous = self._file_jobs.get(username)
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait([previous])
+            return await loop.run_in_executor(None, func, *args)
+
+        def done(_):
+            if self._file_jobs.get(username) is job:
+                del self._file_jobs[username]
+
+        job = self._file_jobs[username] = asyncio.ensure_future(run())
+        job.add_done_callback(done)
+        return job
+
+    async def flush(self) -> None:
+        """Wait for the file jobs queued so far"""
+        if self._file_jobs:
+            await asyncio.wait(list(self._file_jobs.values()))
+
+    def _spill(self, username: str, box: _Box) -> None:
+        """Count a box's messages as on disk now; they are appended to its file in the executor"""
+        mail = list(box.memory)
+        box.on_disk += len(mail)
+        box.disk_bytes += box.memory_bytes
+        box.disk_expires = min(box.disk_expires, mail[0][0])
+        self.disk_bytes += box.memory_bytes
+        self.memory_bytes -= box.memory_bytes
+        box.memory.clear()
+        box.memory_bytes = 0
+        job = self._file_job(username, self._append_spilled, username, b"".join(line for _, line in mail))
+        job.add_done_callback(lambda job: self._spilled(username, box, mail, job))
+
+    def _append_spilled(self, username: str, data: bytes) -> bool:
+        try:
+            with open(self.path_for(username), "ab") as f:
+                f.write(data)
+        except OSError as e:
+            logging.error(f"Could not spill the mailbox of '{username}': {e}")
+            return False
+        return True
+
+    def _spilled(self, username: str, box: _Box, mail: List[Mail], job: asyncio.Future) -> None:
+        if job.cancelled() or job.result():
+            return
+        if self._boxes.get(username) is not box:
+            # take() has the box and reads the file after this job; it picks these up instead
+            box.unspilled.extend(mail)
+            return
+        # Back to memory, ahead of what came since, until a later spill succeeds
+        size = sum(len(line) for _, line in mail)
+        box.on_disk -= len(mail)
+        box.disk_bytes -= size
+        self.disk_bytes -= size
+        box.memory.extendleft(reversed(mail))
+        box.memory_bytes += size
+        self.memory_bytes += size
+
+    async def take(self, username: str, now: Optional[float] = None) -> List[Tuple[float, str]]:
+        """Remove and return the (sent_at, body) of every unexpired message waiting for a user"""
+        box = self._boxes.pop(username, None)
+        self.server_state.offline_mail.pop(username, None)
+        if box is None:
+            return []
+        if now is None:
+            now = time.time()
+        lines = []
+        if box.on_disk:
+            lines = await self._file_job(username, self._read_spilled, username)
+            self.disk_bytes -= box.disk_bytes
+            lines.extend(line for _, line in box.unspilled)
+        lines.extend(line for _, line in box.memory)
+        self.memory_bytes -= box.memory_bytes
+
+        mail = []
+        for line in lines:
+            expires_at, sent_at, body = json.loads(line)
+            if expires_at > now:
+                mail.append((sent_at, body))
+        if box.unspilled:
+            mail.sort(key=lambda item: item[0])  # Those came back out of turn
+        self.expired += len(lines) - len(mail)
+        self.delivered += len(mail)
+        return mail
+
+    def _read_spilled(self, username: str) -> List[bytes]:
+        path = self.path_for(username)
+        try:
+            with open(path, "rb") as f:
+                lines = f.readlines()
+            os.unlink(path)
+        except OSError as e:
+            logging.error(f"Could not read the spilled mailbox of '{username}': {e}")
+            return []
+        return lines
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Drop expired messages; returns how many were in memory. Spilled files
+        holding expired messages are rewritten in the executor. Reschedules
+        itself while mail is waiting.
+        """
+        self.close()
+        if now is None:
+            now = time.time()
+        dropped = 0
+        for username in list(self._boxes):
+            box = self._boxes[username]
+            # Messages are queued in order, so expired ones are at the front
+            while box.memory and box.memory[0][0] <= now:
+                _, line = box.memory.popleft()
+                box.memory_bytes -= len(line)
+                self.memory_bytes -= len(line)
+                dropped += 1
+            if box.on_disk and box.disk_expires <= now:
+                box.disk_expires = float("inf")  # Set again from what the rewrite keeps
+                job = self._file_job(username, self._rewrite_spilled, username, now)
+                job.add_done_callback(lambda job, username=username, box=box: self._expired(username, box, job))
+            if len(box):
+                self.server_state.offline_mail[username] = len(box)
+            else:
+                del self._boxes[username]
+                self.server_state.offline_mail.pop(username, None)
+        self.expired += dropped
+        if self._boxes and self.sweep_interval:
+            self._handle = asyncio.get_running_loop().call_later(self.sweep_interval, self.sweep)
+        return dropped
+
+    def _rewrite_spilled(self, username: str, now: float) -> Tuple[int, int, float]:
+        """Rewrite a spilled file without its expired messages: (dropped, bytes dropped, earliest expiry kept)"""
+        lines = self._read_spilled(username)
+        expiries = [json.loads(line)[0] for line in lines]
+        kept = [line for line, expires_at in zip(lines, expiries) if expires_at > now]
+        if kept:
+            try:
+                with open(self.path_for(username), "wb") as f:
+                    f.write(b"".join(kept))
+            except OSError as e:
+                logging.error(f"Could not rewrite the spilled mailbox of '{username}': {e}")
+                kept = []
+        earliest = min((expires_at for expires_at in expiries if expires_at > now), default=float("inf"))
+        return len(lines) - len(kept), sum(map(len, lines)) - sum(map(len, kept)), earliest if kept else float("inf")
+
+    def _expired(self, username: str, box: _Box, job: asyncio.Future) -> None:
+        if job.cancelled():
+            return
+        dropped, size, earliest = job.result()
+        self.expired += dropped
+        if self._boxes.get(username) is not box:
+            return  # Taken meanwhile; take() settled the disk counts
+        box.on_disk -= dropped
+        box.disk_bytes -= size
+        self.disk_bytes -= size
+        box.disk_expires = min(box.disk_expires, earliest)
+        if len(box):
+            self.server_state.offline_mail[username] = len(box)
+        else:
+            del self._boxes[username]
+            self.server_state.offline_mail.pop(username, None)
+
+    def close(self) -> None:
+        """Cancel the sweep timer"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
\ No newline at end of file
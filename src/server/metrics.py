@@ -0,0 +1,165 @@
+#metrics.py
+import asyncio
+import logging
+from typing import List, Optional
+
+from src.utils.metrics import MetricsRegistry, serve_metrics, write_snapshots
+
+# Recipients per broadcast
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+class ServerMetrics:
+    """
+    The instruments the chat server updates, registered in one registry.
+
+    Handlers hold direct references to counters and histograms, so recording
+    a message costs a few attribute increments. Gauges for state that already
+    lives elsewhere (connected clients, queued frames, pending hashing jobs)
+    read it through callbacks at export time instead of being kept in sync.
+    """
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry = registry or MetricsRegistry()
+        self.quic_events = registry.counter("chat_quic_events_total", "QUIC events received")
+        self.messages_in = registry.counter("chat_messages_in_total", "Messages received from clients")
+        self.bytes_in = registry.counter("chat_bytes_in_total", "Stream bytes received from clients")
+        self.messages_out = registry.counter("chat_messages_out_total", "Frames queued to clients")
+        self.bytes_out = registry.counter("chat_bytes_out_total", "Frame bytes queued to clients")
+        self.datagrams_in = registry.counter("chat_datagrams_in_total", "QUIC DATAGRAM frames received")
+        self.datagrams_out = registry.counter("chat_datagrams_out_total", "QUIC DATAGRAM frames queued to clients")
+        self.auth_ok = registry.counter("chat_auth_total", "Authentication attempts", {"result": "ok"})
+        self.auth_failed = registry.counter("chat_auth_total", "Authentication attempts", {"result": "failed"})
+        self.auth_seconds = registry.histogram("chat_auth_seconds", "Time from AUTH_REQ to the verdict")
+        self.fanout_size = registry.histogram("chat_fanout_recipients", "Local recipients per broadcast",
+                                              buckets=FANOUT_BUCKETS)
+        self.quic_event_seconds = self.handler("quic_event")
+        self.stream_data_seconds = self.handler("stream_data")
+        self.broadcast_seconds = self.handler("broadcast")
+        self.pending_tasks = registry.gauge("chat_pending_tasks", "Tasks alive on the event loop",
+                                            fn=lambda: len(asyncio.all_tasks()))
+
+    def handler(self, name: str):
+        """Latency histogram of one handler"""
+        return self.registry.histogram("chat_handler_seconds", "Time spent in a handler", {"handler": name})
+
+    def watch(self, server_state=None, auth_service=None, outbound=None, scheduler=None, compressor=None,
+              reaper=None, rate_limiter=None, mailbox=None, admission=None, federation=None,
+              tracer=None, bus=None) -> None:
+        """Expose gauges read from the server's shared services"""
+        registry = self.registry
+        if server_state is not None:
+            registry.gauge("chat_connected_clients", "Authenticated clients on this process",
+                           fn=lambda: len(server_state.clients))
+        if auth_service is not None:
+            registry.gauge("chat_auth_pending", "Password hashing jobs in flight",
+                           fn=lambda: auth_service.pending)
+            store = auth_service.auth_manager.store
+            registry.gauge("chat_user_cache_hits", "User records found in the user store's cache",
+                           fn=lambda: store.hits)
+            registry.gauge("chat_user_cache_misses", "User records looked up in the user store itself",
+                           fn=lambda: store.misses)
+        if outbound is not None:
+            stats = outbound.stats
+            registry.gauge("chat_outbound_depth", "Frames waiting in outbound queues", fn=lambda: stats.depth)
+            registry.gauge("chat_outbound_drops", "Frames dropped by slow-consumer policy", fn=lambda: stats.drops)
+            registry.gauge("chat_outbound_evictions", "Slow consumers disconnected", fn=lambda: stats.evictions)
+        if scheduler is not None:
+            stats = scheduler.stats
+            registry.gauge("chat_datagrams_sent", "UDP datagrams sent", fn=lambda: stats.datagrams)
+            registry.gauge("chat_transmits", "Transmit passes", fn=lambda: stats.transmits)
+        if compressor is not None:
+            registry.gauge("chat_compression_bytes_in", "Payload bytes offered to compression",
+                           fn=lambda: compressor.bytes_in)
+            registry.gauge("chat_compression_bytes_out", "Payload bytes after compression",
+                           fn=lambda: compressor.bytes_out)
+        if reaper is not None:
+            registry.gauge("chat_reaper_watched", "Connections watched by the idle reaper", fn=lambda: len(reaper.wheel))
+            registry.gauge("chat_reaped_idle", "Connections closed after going quiet", fn=lambda: reaper.reaped_idle)
+            registry.gauge("chat_reaped_unauthenticated", "Connections closed for not authenticating in time",
+                           fn=lambda: reaper.reaped_unauthenticated)
+        if rate_limiter is not None:
+            registry.gauge("chat_rate_limited_dropped", "Messages dropped over a rate limit",
+                           fn=lambda: rate_limiter.dropped)
+            registry.gauge("chat_rate_limited_delayed", "Messages delayed by a rate limit",
+                           fn=lambda: rate_limiter.delayed)
+            registry.gauge("chat_rate_limited_warned", "Messages let through over a rate limit",
+                           fn=lambda: rate_limiter.warned)
+        if mailbox is not None:
+            registry.gauge("chat_mailbox_users", "Offline users with messages waiting",
+                           fn=lambda: len(mailbox.server_state.offline_mail))
+            registry.gauge("chat_mailbox_memory_bytes", "Offline messages held in memory",
+                           fn=lambda: mailbox.memory_bytes)
+            registry.gauge("chat_mailbox_disk_bytes", "Offline messages spilled to disk", fn=lambda: mailbox.disk_bytes)
+        if admission is not None:
+            registry.gauge("chat_handshakes_in_flight", "QUIC handshakes started and not yet done",
+                           fn=lambda: admission.in_flight)
+            registry.gauge("chat_handshakes_completed", "QUIC handshakes completed", fn=lambda: admission.completed)
+            registry.gauge("chat_handshakes_refused_busy", "New connections dropped at the handshake cap",
+                           fn=lambda: admission.refused_busy)
+            registry.gauge("chat_handshakes_refused_rate", "New connections dropped over the per-address rate",
+                           fn=lambda: admission.refused_rate)
+            registry.gauge("chat_handshakes_timed_out", "Handshakes closed for taking too long",
+                           fn=lambda: admission.timed_out)
+            registry.gauge("chat_retries_sent", "Retry packets sent to validate addresses", fn=lambda: admission.retries)
+            registry.gauge("chat_retry_tokens_invalid", "Initials whose token was forged or expired",
+                           fn=lambda: admission.invalid_tokens)
+        if federation is not None:
+            links = federation.links
+            registry.gauge("chat_federation_links_up", "Links to peer nodes that are connected",
+                           fn=lambda: sum(link.up for link in links.values()))
+            registry.gauge("chat_federation_remote_users", "Users online on other nodes",
+                           fn=lambda: len(federation.server_state.remote_clients))
+            registry.gauge("chat_federation_frames_sent", "Frames sent to peer nodes",
+                           fn=lambda: sum(link.frames_sent for link in links.values()))
+            registry.gauge("chat_federation_writes", "Batched writes to peer nodes",
+                           fn=lambda: sum(link.writes for link in links.values()))
+            registry.gauge("chat_federation_frames_dropped", "Frames dropped while a peer was unreachable",
+                           fn=lambda: sum(link.dropped for link in links.values()))
+            registry.gauge("chat_federation_frames_received", "Frames received from peer nodes",
+                           fn=lambda: federation.frames_received)
+        if bus is not None:
+            registry.gauge("chat_bus_send_errors", "Messages to other workers lost to a failed send",
+                           fn=lambda: bus.send_errors)
+        if tracer is not None:
+            registry.gauge("chat_traces_sampled", "Messages sampled for tracing", fn=lambda: tracer.sampled)
+            registry.gauge("chat_traces_written", "Traces written to the trace file", fn=lambda: tracer.written)
+
+    async def start_exporters(self, config: dict, worker_id: int = 0) -> List[object]:
+        """
+        Start the exporters enabled in the configuration.
+
+        Keys: metrics_port (HTTP text endpoint on metrics_host, offset by the
+        worker id; 0 or absent disables it), metrics_snapshot_path and
+        metrics_snapshot_interval (periodic JSON snapshot). Returns handles
+        for stop_exporters().
+        """
+        handles = []
+        port = config.get("metrics_port")
+        if port:
+            host = config.get("metrics_host", "127.0.0.1")
+            server = await serve_metrics(self.registry, host, port + worker_id)
+            logging.info(f"Serving metrics on http://{host}:{port + worker_id}/metrics")
+            handles.append(server)
+        path = config.get("metrics_snapshot_path")
+        if path:
+            if worker_id:
+                path = f"{path}.{worker_id}"
+            handles.append(asyncio.create_task(
+                write_snapshots(self.registry, path, config.get("metrics_snapshot_interval", 10.0))))
+        return handles
+
+    @staticmethod
+    def stop_exporters(handles: List[object]) -> None:
+        for handle in handles:
+            if isinstance(handle, asyncio.Task):
+                handle.cancel()
+            else:
+                handle.close()
+
+    _shared: Optional['ServerMetrics'] = None
+
+    @classmethod
+    def shared(cls) -> 'ServerMetrics':
+        """Process-wide instance for protocols built without one"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
\ No newline at end of file
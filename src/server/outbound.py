@@ -0,0 +1,132 @@
+#outbound.py
+import logging
+from collections import deque
+from typing import Callable, Optional
+
+# What to do when a client's outbound queue is full
+POLICY_DROP_OLDEST = "drop_oldest"  # Discard the oldest queued frame to make room
+POLICY_DROP_NEWEST = "drop_newest"  # Discard the frame being queued
+POLICY_DISCONNECT = "disconnect"    # Close the connection of the slow consumer
+
+_POLICIES = (POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_DISCONNECT)
+
+class OutboundStats:
+    """Counters shared by the outbound queues of one server"""
+    def __init__(self):
+        self.depth = 0      # Frames queued across all connections
+        self.drops = 0      # Frames discarded because a queue was full
+        self.evictions = 0  # Connections closed for not keeping up
+
+class OutboundLimits:
+    """Server-wide outbound queue settings"""
+    def __init__(self, max_frames: int = 1024, max_bytes: int = 1024 * 1024,
+                 high_watermark: int = 256 * 1024, policy: str = POLICY_DROP_OLDEST):
+        if policy not in _POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.high_watermark = high_watermark  # Unacknowledged bytes allowed inside QUIC
+        self.policy = policy
+        self.stats = OutboundStats()
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'OutboundLimits':
+        """Build the limits from the server configuration"""
+        return cls(
+            max_frames=config.get("outbound_max_frames", 1024),
+            max_bytes=config.get("outbound_max_bytes", 1024 * 1024),
+            high_watermark=config.get("outbound_high_watermark", 256 * 1024),
+            policy=config.get("slow_consumer_policy", POLICY_DROP_OLDEST),
+        )
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded frames waiting to be written to one connection.
+
+    Frames move into QUIC only while the bytes QUIC still holds for the peer
+    (sent but unacknowledged, or blocked by flow control) stay under the high
+    watermark. A client that stops reading therefore fills this queue instead
+    of growing QUIC's send buffers, and once the queue is full the configured
+    policy drops frames or evicts the client.
+    """
+    def __init__(self, writer, limits: Optional[OutboundLimits] = None,
+                 on_evict: Optional[Callable[[], None]] = None):
+        self.writer = writer
+        self.limits = limits or OutboundLimits()
+        self.stats = self.limits.stats
+        self.on_evict = on_evict
+        self._frames: deque = deque()
+        self._bytes = 0
+        self.drops = 0
+        self.peak_depth = 0
+        self.evicted = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    def put(self, data: bytes) -> int:
+        """Queue a frame and write whatever fits; returns the number of frames written"""
+        if self.evicted:
+            return 0
+        limits = self.limits
+        if len(self._frames) >= limits.max_frames or self._bytes + len(data) > limits.max_bytes:
+            if not self._make_room(len(data)):
+                return 0
+        self._frames.append(data)
+        self._bytes += len(data)
+        self.stats.depth += 1
+        if len(self._frames) > self.peak_depth:
+            self.peak_depth = len(self._frames)
+        return self.drain()
+
+    def _make_room(self, size: int) -> bool:
+        """Apply the slow-consumer policy; returns whether the new frame may be queued"""
+        limits = self.limits
+        if limits.policy == POLICY_DROP_NEWEST:
+            self._count_drops(1)
+            return False
+        if limits.policy == POLICY_DISCONNECT:
+            self.evict()
+            return False
+        dropped = 0
+        while self._frames and (len(self._frames) >= limits.max_frames or self._bytes + size > limits.max_bytes):
+            self._bytes -= len(self._frames.popleft())
+            dropped += 1
+        self._count_drops(dropped)
+        self.stats.depth -= dropped
+        return True
+
+    def _count_drops(self, count: int) -> None:
+        self.drops += count
+        self.stats.drops += count
+
+    def drain(self) -> int:
+        """Move queued frames into QUIC while it has room; returns the number written"""
+        frames = self._frames
+        writer = self.writer
+        high_watermark = self.limits.high_watermark
+        written = 0
+        while frames and writer.buffered() < high_watermark:
+            data = frames.popleft()
+            self._bytes -= len(data)
+            writer.write(data)
+            written += 1
+        self.stats.depth -= written
+        return written
+
+    def evict(self) -> None:
+        """Drop everything queued and close the connection"""
+        if self.evicted:
+            return
+        self.evicted = True
+        self._count_drops(len(self._frames))
+        self.stats.depth -= len(self._frames)
+        self.stats.evictions += 1
+        self._frames.clear()
+        self._bytes = 0
+        if self.on_evict is not None:
+            try:
+                self.on_evict()
+            except Exception as e:
+                logging.error(f"Evicting slow consumer failed: {e}")
\ No newline at end of file
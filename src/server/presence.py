@@ -0,0 +1,55 @@
+#presence.py
+import asyncio
+from typing import Any, Dict, Optional
+
+from src.protocol.message import MsgType
+from src.protocol.presence import encode_presence_delta, encode_presence_snapshot
+from .fanout import fan_out
+from .server_state import ServerStateManager
+
+class PresenceBroadcaster:
+    """
+    Sends presence deltas to every online client.
+
+    Changes recorded by ServerStateManager are coalesced for `window` seconds
+    and then sent as a single versioned delta, so a burst of joins and leaves
+    costs one fan-out instead of one full user list per event.
+    """
+    def __init__(self, server_state: ServerStateManager, window: float = 0.05):
+        self.server_state = server_state
+        self.window = window
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def changed(self) -> None:
+        """Schedule a delta for the changes recorded in server state"""
+        if self._handle is not None:
+            return
+        if self.window <= 0:
+            self.flush()
+        else:
+            self._handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self) -> int:
+        """Send pending changes now; returns the number of recipients"""
+        self._handle = None
+        delta = self.server_state.drain_presence_delta()
+        if delta is None:
+            return 0
+        version, joined, left = delta
+        return fan_out(
+            (client_info.protocol for client_info in self.server_state.clients.values()),
+            {"t": int(MsgType.PRESENCE), "body": encode_presence_delta(joined, left),
+             "to": None, "token": None, "seq": version}
+        )
+
+    def snapshot_message(self) -> Dict[str, Any]:
+        """Build a PRESENCE_SNAPSHOT message for a single client"""
+        version, users = self.server_state.presence_snapshot()
+        return {"t": int(MsgType.PRESENCE_SNAPSHOT), "body": encode_presence_snapshot(users),
+                "to": None, "token": None, "seq": version}
+
+    def close(self) -> None:
+        """Cancel any scheduled delta"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
@@ -0,0 +1,137 @@
+#rate_limit.py
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from src.protocol.message import MsgType
+
+# What to do with a message over its limit
+ACTION_DROP = "drop"    # Discard it and tell the sender
+ACTION_DELAY = "delay"  # Handle it once the bucket has refilled, if that is soon enough
+ACTION_WARN = "warn"    # Handle it anyway and log a warning; for trying out limits
+
+_ACTIONS = (ACTION_DROP, ACTION_DELAY, ACTION_WARN)
+
+# Messages per second and burst for each client message type; unlisted types are not limited
+DEFAULT_LIMITS = {
+    MsgType.CHAT: (5.0, 20.0),
+    MsgType.PRESENCE_SNAPSHOT: (1.0, 3.0),
+    MsgType.ROOM_JOIN: (5.0, 10.0),
+    MsgType.ROOM_LEAVE: (5.0, 10.0),
+    MsgType.ROOM_LIST: (1.0, 5.0),
+    MsgType.HISTORY: (2.0, 5.0),
+    MsgType.TYPING: (5.0, 10.0),
+    MsgType.PING: (1.0, 5.0),
+}
+
+class TokenBucket:
+    """Tokens refilled at `rate` per second up to `burst`; the rate itself is kept by the owner"""
+    __slots__ = ("tokens", "stamp")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.stamp = now
+
+    def wait(self, rate: float, burst: float, cost: float, now: float) -> float:
+        """Refill, then return how long until `cost` tokens are available (0 if they are now)"""
+        self.tokens = min(burst, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        cost = min(cost, burst)  # Anything larger needs a full bucket rather than never passing
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / rate
+
+class RateLimiter:
+    """
+    Token-bucket limits checked before a client message is handled.
+
+    Every user has one bucket per limited message type, created on first
+    use and dropped by forget(), and all users share one fan-out bucket
+    counting recipient sends per second. A check is a couple of dict
+    lookups and some arithmetic. Over a limit, `action` decides: drop the
+    message, delay it until the buckets allow it (going into debt, so later
+    messages wait their turn; anything due later than `max_delay` seconds
+    is dropped), or let it through with a warning.
+    """
+    def __init__(self, limits: Optional[Dict[int, Tuple[float, float]]] = None,
+                 fanout_rate: float = 200000.0, fanout_burst: float = 400000.0,
+                 action: str = ACTION_DROP, max_delay: float = 2.0, notice_interval: float = 1.0):
+        if action not in _ACTIONS:
+            raise ValueError(f"Unknown rate-limit action: {action}")
+        self.limits = {int(t): limit for t, limit in (DEFAULT_LIMITS if limits is None else limits).items()}
+        self.fanout_rate = fanout_rate
+        self.fanout_burst = fanout_burst
+        self.action = action
+        self.max_delay = max_delay
+        self.notice_interval = notice_interval  # Least time between two notices to the same user
+        self._buckets: Dict[str, Dict[int, TokenBucket]] = {}
+        self._noticed: Dict[str, float] = {}
+        self._fanout: Optional[TokenBucket] = None
+        self.dropped = 0
+        self.delayed = 0
+        self.warned = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['RateLimiter']:
+        """Build the limiter from the server configuration; None when rate limiting is off"""
+        if not config.get("rate_limiting", True):
+            return None
+        limits = dict(DEFAULT_LIMITS)
+        for name, limit in config.get("rate_limits", {}).items():
+            limits[MsgType[name.upper()]] = (limit["rate"], limit["burst"])
+        return cls(limits, fanout_rate=config.get("fanout_rate", 200000.0),
+                   fanout_burst=config.get("fanout_burst", 400000.0),
+                   action=config.get("rate_limit_action", ACTION_DROP),
+                   max_delay=config.get("rate_limit_max_delay", 2.0))
+
+    def check(self, username: str, msg_type: int, recipients: int = 0,
+              now: Optional[float] = None) -> Optional[float]:
+        """Seconds to hold the message back (0 to handle it now), or None to drop it"""
+        if now is None:
+            now = time.monotonic()
+        wait = 0.0
+        bucket = None
+        limit = self.limits.get(msg_type)
+        if limit is not None:
+            buckets = self._buckets.get(username)
+            if buckets is None:
+                buckets = self._buckets[username] = {}
+            bucket = buckets.get(msg_type)
+            if bucket is None:
+                bucket = buckets[msg_type] = TokenBucket(limit[1], now)
+            wait = bucket.wait(limit[0], limit[1], 1, now)
+        fanout = None
+        if recipients:
+            fanout = self._fanout
+            if fanout is None:
+                fanout = self._fanout = TokenBucket(self.fanout_burst, now)
+            wait = max(wait, fanout.wait(self.fanout_rate, self.fanout_burst, recipients, now))
+
+        if wait:
+            if self.action == ACTION_DROP or (self.action == ACTION_DELAY and wait > self.max_delay):
+                self.dropped += 1
+                return None
+            if self.action == ACTION_WARN:
+                self.warned += 1
+                if self.notice_due(username, now):
+                    logging.warning(f"'{username}' is over the rate limit for message type {msg_type}")
+                return 0.0  # Nothing taken, so the buckets do not sink ever deeper
+            self.delayed += 1
+        # Taken now even when delayed, so messages queued behind this one wait longer
+        if bucket is not None:
+            bucket.tokens -= 1
+        if fanout is not None:
+            fanout.tokens -= min(recipients, self.fanout_burst)
+        return wait
+
+    def notice_due(self, username: str, now: Optional[float] = None) -> bool:
+        """Whether the user may be told (or logged about) being limited again"""
+        if now is None:
+            now = time.monotonic()
+        if now - self._noticed.get(username, float("-inf")) < self.notice_interval:
+            return False
+        self._noticed[username] = now
+        return True
+
+    def forget(self, username: str) -> None:
+        """Drop the buckets of a user who went offline"""
+        self._buckets.pop(username, None)
+        self._noticed.pop(username, None)
\ No newline at end of file
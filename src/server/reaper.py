@@ -0,0 +1,128 @@
+#reaper.py
+import asyncio
+import math
+from typing import Dict, Hashable, Optional, Set
+
+from .server_state import ServerStateManager
+
+class TimerWheel:
+    """
+    Hashed timer wheel: `slots` buckets, one per `tick` seconds.
+
+    schedule() and cancel() are O(1) and advance() hands back the items of
+    the next bucket. A delay longer than one turn of the wheel lands in the
+    farthest bucket, so items may come up early; callers check the real
+    deadline and schedule them again.
+    """
+    def __init__(self, tick: float = 1.0, slots: int = 128):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}  # Item -> index of its bucket
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._where
+
+    def schedule(self, item: Hashable, delay: float) -> None:
+        """Put `item` in the bucket due after `delay` seconds, moving it if already scheduled"""
+        self.cancel(item)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self._slots) - 1)
+        index = (self._cursor + ticks) % len(self._slots)
+        self._slots[index].add(item)
+        self._where[item] = index
+
+    def cancel(self, item: Hashable) -> bool:
+        index = self._where.pop(item, None)
+        if index is None:
+            return False
+        self._slots[index].discard(item)
+        return True
+
+    def advance(self) -> Set[Hashable]:
+        """Move one tick forward and return the items that came due"""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        due = self._slots[self._cursor]
+        if due:
+            self._slots[self._cursor] = set()
+            for item in due:
+                del self._where[item]
+        return due
+
+class IdleReaper:
+    """
+    Closes dead sessions and removes them from the server state.
+
+    A connection is reaped when nothing has been received from it for
+    `idle_timeout` seconds, or when it has not authenticated within
+    `auth_timeout` seconds; a connection that closed without its session
+    being cleaned up is cleaned up. Every connection sits in one timer wheel
+    driven by a single loop timer, so a packet only stamps `last_seen`: a
+    connection is looked at when its bucket comes up and rescheduled if it
+    was heard from in the meantime. The timer stops while nothing is watched.
+    """
+    def __init__(self, server_state: ServerStateManager, idle_timeout: float = 90.0,
+                 auth_timeout: float = 30.0, tick: float = 1.0, slots: int = 128):
+        self.server_state = server_state
+        self.idle_timeout = idle_timeout
+        self.auth_timeout = auth_timeout
+        self.wheel = TimerWheel(tick, slots)
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self.reaped_idle = 0
+        self.reaped_unauthenticated = 0
+        self.cleaned = 0  # Closed connections whose session was still registered
+
+    @classmethod
+    def from_config(cls, config: dict, server_state: ServerStateManager) -> 'IdleReaper':
+        """Build the reaper from the server configuration"""
+        return cls(server_state, idle_timeout=config.get("reaper_idle_timeout", 90.0),
+                   auth_timeout=config.get("auth_timeout", 30.0), tick=config.get("reaper_tick", 1.0))
+
+    def watch(self, protocol) -> None:
+        """Start watching a new connection"""
+        self.wheel.schedule(protocol, min(self.auth_timeout, self.idle_timeout))
+        if self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(self.wheel.tick, self.tick)
+
+    def forget(self, protocol) -> None:
+        """Stop watching a connection that has gone away"""
+        self.wheel.cancel(protocol)
+
+    def deadline(self, protocol) -> float:
+        """Loop time at which the connection is reaped unless it is heard from"""
+        deadline = protocol.last_seen + self.idle_timeout
+        if protocol.username is None:
+            deadline = min(deadline, protocol.connected_at + self.auth_timeout)
+        return deadline
+
+    def tick(self) -> int:
+        """Check the connections that came due; returns how many were closed"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        closed = 0
+        for protocol in self.wheel.advance():
+            if protocol._closed.is_set():
+                if protocol.handle_disconnect():
+                    self.cleaned += 1
+                continue
+            deadline = self.deadline(protocol)
+            if now < deadline:
+                self.wheel.schedule(protocol, deadline - now)
+            elif protocol.username is None:
+                self.reaped_unauthenticated += 1
+                closed += 1
+                protocol.reap("Authentication timeout")
+            else:
+                self.reaped_idle += 1
+                closed += 1
+                protocol.reap("Idle timeout")
+        self._handle = loop.call_later(self.wheel.tick, self.tick) if len(self.wheel) else None
+        return closed
+
+    def close(self) -> None:
+        """Cancel the timer"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
\ No newline at end of file
@@ -0,0 +1,87 @@
+#scheduler.py
+import asyncio
+from typing import Dict, Optional
+
+class TransmitStats:
+    """Counters for how written frames turn into UDP datagrams"""
+    def __init__(self):
+        self.messages = 0   # Frames handed to QUIC
+        self.transmits = 0  # transmit() passes
+        self.datagrams = 0  # Datagrams sent, one sendto() syscall each
+
+    @property
+    def messages_per_datagram(self) -> float:
+        return self.messages / self.datagrams if self.datagrams else 0.0
+
+    @property
+    def syscalls_per_message(self) -> float:
+        return self.datagrams / self.messages if self.messages else 0.0
+
+class CountingTransport:
+    """Wraps the server's UDP transport to count datagrams sent for a connection"""
+    def __init__(self, transport, stats: TransmitStats):
+        self._transport = transport
+        self._stats = stats
+
+    def sendto(self, data, addr=None) -> None:
+        self._stats.datagrams += 1
+        self._transport.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+class TransmitScheduler:
+    """
+    Coalesces transmit() calls across sends.
+
+    Connections written to are only marked dirty; every dirty connection is
+    transmitted once on the next loop iteration (or after `flush_delay`
+    seconds), so a burst of frames for one client leaves in as few datagrams
+    as QUIC can pack them into. With batching off every mark transmits at
+    once, which is how sends worked before.
+    """
+    def __init__(self, batching: bool = True, flush_delay: float = 0.0):
+        self.batching = batching
+        self.flush_delay = flush_delay
+        self.stats = TransmitStats()
+        self._dirty: Dict[int, 'ChatProtocol'] = {}
+        self._handle: Optional[asyncio.Handle] = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'TransmitScheduler':
+        """Build the scheduler from the server configuration"""
+        return cls(batching=config.get("transmit_batching", True),
+                   flush_delay=config.get("transmit_flush_delay", 0.0))
+
+    def mark(self, protocol: 'ChatProtocol') -> None:
+        """Note that a connection has data to transmit"""
+        if not self.batching:
+            protocol.transmit()
+            return
+        self._dirty[id(protocol)] = protocol
+        if self._handle is None:
+            loop = asyncio.get_running_loop()
+            if self.flush_delay > 0:
+                self._handle = loop.call_later(self.flush_delay, self.flush)
+            else:
+                self._handle = loop.call_soon(self.flush)
+
+    def discard(self, protocol: 'ChatProtocol') -> None:
+        """Forget a connection that has just been transmitted by other means"""
+        if self._dirty:
+            self._dirty.pop(id(protocol), None)
+
+    def flush(self) -> int:
+        """Transmit every dirty connection; returns how many were transmitted"""
+        self._handle = None
+        dirty = self._dirty
+        self._dirty = {}
+        for protocol in dirty.values():
+            protocol.transmit()
+        return len(dirty)
+
+    def close(self) -> None:
+        """Cancel a scheduled flush"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
\ No newline at end of file
@@ -1,48 +1,174 @@
 #server_state.py
-from dataclasses import dataclass
-from typing import Dict, Optional
-from src.protocol.states import StateManager, ConnectionState
+from typing import Dict, List, Optional, Set, Tuple
+from src.protocol.states import ConnectionState, can_transition
 
-@dataclass
 class ClientInfo:
-    username: str
-    protocol: 'ChatProtocol'
-    state: StateManager
-    token: Optional[str] = None
+    """
+    One session in the session table.
+
+    A slotted record rather than a dataclass, since a server holds one per
+    connection: no per-instance dict, the state a small int checked against
+    the module-level transition table, and `session_id` the record's slot in
+    ServerStateManager.sessions. The id is reused once the session is gone.
+    `username` is the very string the clients dict is keyed on and the
+    protocol holds, so a name is stored once.
+    """
+    __slots__ = ("session_id", "username", "protocol", "state", "token")
+
+    def __init__(self, session_id: int, username: str, protocol: 'ChatProtocol',
+                 state: ConnectionState = ConnectionState.AUTHENTICATED, token: Optional[str] = None):
+        self.session_id = session_id
+        self.username = username
+        self.protocol = protocol
+        self.state = state
+        self.token = token
+
+    def transition_to(self, new_state: ConnectionState) -> bool:
+        """Move to a new state; False if the transition is not allowed"""
+        if can_transition(self.state, new_state):
+            self.state = new_state
+            return True
+        return False
+
+    def __repr__(self) -> str:
+        return f"ClientInfo({self.session_id}, {self.username!r}, {self.state.name})"
 
 class ServerStateManager:
     def __init__(self):
         self.clients: Dict[str, ClientInfo] = {}
-        self.state_manager = StateManager()
-
-    def add_client(self, username: str, protocol: 'ChatProtocol') -> None:
-        """Register a new client connection"""
-        if username not in self.clients:
-            self.clients[username] = ClientInfo(
-                username=username,
-                protocol=protocol,
-                state=StateManager()
-            )
-            self.clients[username].state.transition_to(ConnectionState.AUTHENTICATED)
+        self.sessions: List[Optional[ClientInfo]] = []  # Session id -> session, None for a free slot
+        self._free_slots: List[int] = []
+        self.presence_version = 0  # Bumped every time a presence delta is drained
+        self._presence_changes: Dict[str, bool] = {}  # Username -> was online before pending changes
+        self.remote_clients: Dict[str, int] = {}  # Username -> worker (or federation node) id, for users elsewhere
+        self.rooms: Dict[str, Set[str]] = {}       # Room name -> member usernames
+        self.user_rooms: Dict[str, Set[str]] = {}  # Username -> joined room names
+        self.offline_mail: Dict[str, int] = {}     # Username -> messages waiting in the offline mailbox
+
+    def add_client(self, username: str, protocol: 'ChatProtocol') -> Optional[ClientInfo]:
+        """Register a new client connection; None if the user already has one"""
+        if username in self.clients:
+            return None
+        if not self.is_client_online(username):
+            self._presence_changes.setdefault(username, False)
+        if self._free_slots:
+            session_id = self._free_slots.pop()
+        else:
+            session_id = len(self.sessions)
+            self.sessions.append(None)
+        client = self.sessions[session_id] = self.clients[username] = ClientInfo(session_id, username, protocol)
+        return client
 
     def remove_client(self, username: str) -> None:
         """Remove a client connection"""
-        if username in self.clients:
-            del self.clients[username]
+        client = self.clients.pop(username, None)
+        if client is not None:
+            self.sessions[client.session_id] = None
+            self._free_slots.append(client.session_id)
+            if not self.is_client_online(username):
+                self._presence_changes.setdefault(username, True)
+            for room in list(self.user_rooms.get(username, ())):
+                self.leave_room(username, room)
 
     def get_client(self, username: str) -> Optional[ClientInfo]:
         """Get client information"""
         return self.clients.get(username)
 
+    def get_session(self, session_id: int) -> Optional[ClientInfo]:
+        """Get the session in a slot of the session table"""
+        return self.sessions[session_id] if 0 <= session_id < len(self.sessions) else None
+
     def get_online_users(self) -> list:
         """Get list of online users"""
-        return list(self.clients.keys())
+        return list(self.clients.keys()) + [u for u in self.remote_clients if u not in self.clients]
 
     def is_client_online(self, username: str) -> bool:
         """Check if a client is online"""
-        return username in self.clients
+        return username in self.clients or username in self.remote_clients
+
+    def add_remote_client(self, username: str, worker_id: int) -> None:
+        """Record a user connected to another worker"""
+        if not self.is_client_online(username):
+            self._presence_changes.setdefault(username, False)
+        self.remote_clients[username] = worker_id
+
+    def remove_remote_client(self, username: str, worker_id: int) -> None:
+        """Forget a user that left another worker"""
+        if self.remote_clients.get(username) == worker_id:
+            del self.remote_clients[username]
+            if not self.is_client_online(username):
+                self._presence_changes.setdefault(username, True)
+
+    def pending_mail(self, username: str) -> int:
+        """Number of offline messages waiting for a user"""
+        return self.offline_mail.get(username, 0)
+
+    def get_client_worker(self, username: str) -> Optional[int]:
+        """Get the worker holding a user connected elsewhere"""
+        return self.remote_clients.get(username)
 
     def update_client_token(self, username: str, token: str) -> None:
         """Update client's authentication token"""
         if username in self.clients:
-            self.clients[username].token = token
\ No newline at end of file
+            self.clients[username].token = token
+
+    def has_presence_changes(self) -> bool:
+        """Check if users joined or left since the last drained delta"""
+        return bool(self._presence_changes)
+
+    def drain_presence_delta(self) -> Optional[Tuple[int, List[str], List[str]]]:
+        """
+        Collect the net presence changes since the previous call.
+
+        A user who joined and left again in between cancels out.
+
+        Returns:
+            (version, joined, left), or None if nothing changed
+        """
+        joined = [u for u, was_online in self._presence_changes.items()
+                  if not was_online and self.is_client_online(u)]
+        left = [u for u, was_online in self._presence_changes.items()
+                if was_online and not self.is_client_online(u)]
+        self._presence_changes.clear()
+        if not joined and not left:
+            return None
+        self.presence_version += 1
+        return self.presence_version, joined, left
+
+    def presence_snapshot(self) -> Tuple[int, List[str]]:
+        """Get the presence version and the full list of online users"""
+        return self.presence_version, self.get_online_users()
+
+    def join_room(self, username: str, room: str) -> bool:
+        """Add a user to a room, creating it if needed; False if already a member"""
+        members = self.rooms.setdefault(room, set())
+        if username in members:
+            return False
+        members.add(username)
+        self.user_rooms.setdefault(username, set()).add(room)
+        return True
+
+    def leave_room(self, username: str, room: str) -> bool:
+        """Remove a user from a room, dropping empty rooms; False if not a member"""
+        members = self.rooms.get(room)
+        if not members or username not in members:
+            return False
+        members.discard(username)
+        if not members:
+            del self.rooms[room]
+        joined = self.user_rooms[username]
+        joined.discard(room)
+        if not joined:
+            del self.user_rooms[username]
+        return True
+
+    def get_room_members(self, room: str) -> Set[str]:
+        """Get the usernames in a room"""
+        return self.rooms.get(room, set())
+
+    def is_room_member(self, username: str, room: str) -> bool:
+        return username in self.rooms.get(room, ())
+
+    def list_rooms(self) -> List[Tuple[str, int]]:
+        """Get (room, member count) pairs sorted by room name"""
+        return sorted((room, len(members)) for room, members in self.rooms.items())
\ No newline at end of file
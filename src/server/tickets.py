@@ -0,0 +1,39 @@
+#tickets.py
+from collections import OrderedDict
+from typing import Optional
+
+from aioquic.tls import SessionTicket
+
+class SessionTicketStore:
+    """
+    TLS session tickets issued by this server, for resumption and 0-RTT.
+
+    Tickets are single use: fetching one removes it, so a replayed first
+    flight finds no ticket and falls back to a full handshake without its
+    early data. The oldest tickets are forgotten beyond `max_tickets`.
+    """
+    def __init__(self, max_tickets: int = 10000):
+        self.max_tickets = max_tickets
+        self._tickets: "OrderedDict[bytes, SessionTicket]" = OrderedDict()
+        self.issued = 0
+        self.resumed = 0  # Tickets presented and found
+        self.missed = 0   # Tickets presented but unknown, used or expired
+
+    def add(self, ticket: SessionTicket) -> None:
+        """session_ticket_handler for serve(): remember a newly issued ticket"""
+        self._tickets[ticket.ticket] = ticket
+        self.issued += 1
+        while len(self._tickets) > self.max_tickets:
+            self._tickets.popitem(last=False)
+
+    def pop(self, label: bytes) -> Optional[SessionTicket]:
+        """session_ticket_fetcher for serve(): hand out a ticket once"""
+        ticket = self._tickets.pop(label, None)
+        if ticket is None or not ticket.is_valid:
+            self.missed += 1
+            return None
+        self.resumed += 1
+        return ticket
+
+    def __len__(self) -> int:
+        return len(self._tickets)
@@ -0,0 +1,208 @@
+#tracing.py
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from src.protocol.message import MsgType
+
+class Trace:
+    """Stage timestamps of one sampled message, in perf_counter nanoseconds"""
+    __slots__ = ("trace_id", "user", "kind", "started", "stages", "recipients")
+
+    def __init__(self, trace_id: str, started: int):
+        self.trace_id = trace_id
+        self.user: Optional[str] = None  # Sender, once known
+        self.kind: Optional[int] = None  # Message type, once decoded
+        self.started = started
+        self.stages = [("receive", started)]
+        self.recipients: List[list] = []  # [username, queued, transmitted, held in the outbound queue]
+
+    def mark(self, stage: str, at: Optional[int] = None) -> None:
+        self.stages.append((stage, time.perf_counter_ns() if at is None else at))
+
+    def to_json(self) -> dict:
+        """Stage and recipient times in microseconds since the message arrived"""
+        start = self.started
+        try:
+            kind = MsgType(self.kind).name.lower()
+        except ValueError:
+            kind = self.kind
+        return {
+            "id": self.trace_id, "user": self.user, "type": kind,
+            "stages": [[stage, (at - start) / 1000] for stage, at in self.stages],
+            "recipients": [{"user": user, "queued": (queued - start) / 1000,
+                            "sent": (sent - start) / 1000 if sent else None, "held": held}
+                           for user, queued, sent, held in self.recipients],
+        }
+
+class MessageTracer:
+    """
+    Sampled tracing of messages through the server, from the stream data
+    they arrive in to the transmit of every frame sent because of them.
+
+    A `sample_rate` share of incoming messages get a Trace, kept in a ring
+    buffer of the last `buffer_size`. While a traced message is handled it
+    is `current`, and every frame queued meanwhile counts as one of its
+    copies, stamped again when its connection transmits. Every
+    `dump_interval` seconds the traces older than `settle` seconds, whose
+    transmits are in by then, are appended to `path` as JSON lines. With
+    tracing off the server holds no tracer, and pays one attribute check per
+    stream chunk and per frame.
+    """
+    def __init__(self, sample_rate: float, buffer_size: int = 10000, path: Optional[str] = None,
+                 dump_interval: float = 10.0, settle: float = 1.0):
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"Sample rate must be in (0, 1]: {sample_rate}")
+        self.sample_rate = sample_rate
+        self.path = path
+        self.dump_interval = dump_interval
+        self.settle = settle
+        self.current: Optional[Trace] = None
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._ids = itertools.count(1)
+        self._prefix = f"{os.getpid():x}-"  # Ids stay unique across workers and restarts
+        self._random = random.random
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self.sampled = 0
+        self.written = 0
+
+    @classmethod
+    def from_config(cls, config: dict, worker_id: int = 0) -> Optional['MessageTracer']:
+        """Build the tracer from the server configuration; None when it is disabled"""
+        sample_rate = config.get("trace_sample_rate", 0.0)
+        if not sample_rate:
+            return None
+        path = config.get("trace_path")
+        if path and worker_id:
+            path = f"{path}.{worker_id}"
+        return cls(sample_rate, buffer_size=config.get("trace_buffer_size", 10000), path=path,
+                   dump_interval=config.get("trace_dump_interval", 10.0))
+
+    def begin(self, received: int) -> Optional[Trace]:
+        """A Trace for a message that arrived at `received`, if it is sampled"""
+        if self.sample_rate < 1 and self._random() >= self.sample_rate:
+            return None
+        trace = Trace(f"{self._prefix}{next(self._ids)}", received)
+        self._buffer.append(trace)
+        self.sampled += 1
+        return trace
+
+    def queued(self, protocol, held: bool) -> None:
+        """A frame for `protocol` was queued on behalf of the current trace"""
+        record = [protocol.username, time.perf_counter_ns(), 0, held]
+        self.current.recipients.append(record)
+        if protocol.traced_frames is None:
+            protocol.traced_frames = []
+        protocol.traced_frames.append(record)
+
+    @staticmethod
+    def transmitted(records: List[list]) -> None:
+        now = time.perf_counter_ns()
+        for record in records:
+            record[2] = now
+
+    def drain(self, everything: bool = False) -> List[dict]:
+        """Remove the settled traces (all of them with `everything`) from the buffer"""
+        cutoff = time.perf_counter_ns() - int(self.settle * 1e9)
+        buffer = self._buffer
+        drained = []
+        while buffer and (everything or buffer[0].started < cutoff):
+            drained.append(buffer.popleft().to_json())
+        return drained
+
+    def dump(self, everything: bool = False) -> int:
+        """Append the settled traces to `path`; returns how many were written"""
+        if not self.path:
+            return 0
+        traces = self.drain(everything)
+        if traces:
+            try:
+                with open(self.path, "a") as f:
+                    f.write("".join(json.dumps(trace, separators=(",", ":")) + "\n" for trace in traces))
+            except OSError as e:
+                logging.error(f"Writing traces failed: {e}")
+                return 0
+            self.written += len(traces)
+        return len(traces)
+
+    def start(self) -> None:
+        if self.path and self.dump_interval:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._handle = asyncio.get_running_loop().call_later(self.dump_interval, self._dump_periodically)
+
+    def _dump_periodically(self) -> None:
+        self.dump()
+        self._handle = asyncio.get_running_loop().call_later(self.dump_interval, self._dump_periodically)
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+        self.dump(everything=True)
+
+# Summaries of dumped traces
+
+def read_traces(paths: Iterable[str]) -> Iterable[dict]:
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def summarize(traces: Iterable[dict], kind: Optional[str] = None) -> Dict[str, List[float]]:
+    """
+    Microseconds spent per stage: from each stage to the next, then per copy
+    from the last stage to its queueing, from queueing to transmit, and in all.
+    """
+    spans: Dict[str, List[float]] = {}
+    for trace in traces:
+        if kind and trace["type"] != kind:
+            continue
+        stages = trace["stages"]
+        for (previous, started), (stage, ended) in zip(stages, stages[1:]):
+            spans.setdefault(f"{previous} -> {stage}", []).append(ended - started)
+        last_stage = stages[-1][1]
+        sent_times = []
+        for copy in trace["recipients"]:
+            spans.setdefault("copy queued (since receive)", []).append(copy["queued"])
+            if copy["sent"] is not None:
+                spans.setdefault("copy queued -> transmitted", []).append(copy["sent"] - copy["queued"])
+                sent_times.append(copy["sent"])
+        spans.setdefault("receive -> last stage", []).append(last_stage)
+        if sent_times:
+            spans.setdefault("receive -> last copy transmitted", []).append(max(sent_times))
+    return spans
+
+def percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles of dumped message traces")
+    parser.add_argument("paths", nargs="+", help="Trace files; globs are expanded, e.g. 'data/traces.jsonl*'")
+    parser.add_argument("--type", help="Only messages of this type, e.g. chat or auth_req")
+    args = parser.parse_args(argv)
+    paths = sorted(path for pattern in args.paths for path in (glob.glob(pattern) or [pattern]))
+
+    traces = list(read_traces(paths))
+    spans = summarize(traces, args.type)
+    kinds: Dict[str, int] = {}
+    for trace in traces:
+        kinds[str(trace["type"])] = kinds.get(str(trace["type"]), 0) + 1
+    print(f"{len(traces)} traces: " + ", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items())))
+    print(f"{'stage (us)':<36} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for span, values in spans.items():
+        values.sort()
+        print(f"{span:<36} {len(values):>7} {percentile(values, 50):>9.1f} {percentile(values, 90):>9.1f} "
+              f"{percentile(values, 99):>9.1f} {values[-1]:>9.1f}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,85 @@
+#typing_relay.py
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from src.protocol.message import MsgType
+from .fanout import fan_out_ephemeral
+from .server_state import ServerStateManager
+
+# Where a user is typing: (room, private target); both None means everyone
+Scope = Tuple[Optional[str], Optional[str]]
+
+class TypingRelay:
+    """
+    Relays typing indicators.
+
+    Each user's indicator for a scope is accepted at most once per `interval`
+    seconds; extra ones are dropped. Accepted indicators are merged for
+    `window` seconds, and then each scope gets one message naming everyone
+    typing there, fanned out as datagrams where the client supports them.
+    """
+    def __init__(self, server_state: ServerStateManager, interval: float = 1.0, window: float = 0.25,
+                 max_names: int = 16):
+        self.server_state = server_state
+        self.interval = interval
+        self.window = window
+        self.max_names = max_names  # Keeps a merged indicator small enough for one datagram
+        self._last: Dict[Tuple[str, Scope], float] = {}
+        self._pending: Dict[Scope, Set[str]] = {}
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self.accepted = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_config(cls, config: dict, server_state: ServerStateManager) -> 'TypingRelay':
+        """Build the relay from the server configuration"""
+        return cls(server_state, interval=config.get("typing_interval", 1.0),
+                   window=config.get("typing_window", 0.25))
+
+    def typing(self, username: str, room: Optional[str] = None, target: Optional[str] = None) -> bool:
+        """Record that `username` is typing; returns False when rate-limited"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        key = (username, (room, target))
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self.dropped += 1
+            return False
+        self._last[key] = now
+        self._pending.setdefault((room, target), set()).add(username)
+        self.accepted += 1
+        if self._handle is None:
+            self._handle = loop.call_later(self.window, self.flush)
+        return True
+
+    def flush(self) -> int:
+        """Send the merged indicators now; returns the number of recipients"""
+        self._handle = None
+        pending, self._pending = self._pending, {}
+        clients = self.server_state.clients
+        sent = 0
+        for (room, target), names in pending.items():
+            if target is not None:
+                usernames = [target]
+            elif room is not None:
+                usernames = self.server_state.get_room_members(room)
+            else:
+                usernames = clients.keys()
+            msg = {"t": int(MsgType.TYPING), "body": "\n".join(sorted(names)[:self.max_names]),
+                   "to": target, "token": None, "room": room}
+            sent += fan_out_ephemeral(
+                (clients[username].protocol for username in usernames
+                 if username not in names and username in clients),
+                msg
+            )
+        # Forget rate-limit entries that can no longer limit anything
+        if self._last:
+            cutoff = asyncio.get_running_loop().time() - self.interval
+            self._last = {key: last for key, last in self._last.items() if last > cutoff}
+        return sent
+
+    def close(self) -> None:
+        """Cancel a scheduled flush"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
\ No newline at end of file
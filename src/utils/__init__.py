@@ -1,3 +1,4 @@
 from .config_loader import load_config
+from .metrics import MetricsRegistry
 
-__all__ = ['load_config']
\ No newline at end of file
+__all__ = ['load_config', 'MetricsRegistry']
\ No newline at end of file
@@ -0,0 +1,177 @@
+## metrics.py
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+def _label_text(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str = "", labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> List[Tuple[str, float]]:
+        return [(f"{self.name}{_label_text(self.labels)}", self.value)]
+
+class Gauge:
+    """Value that goes up and down, either set directly or read from a callback when exported"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str = "", labels: Labels = (), fn: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def read(self) -> float:
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float("nan")
+        return self.value
+
+    def samples(self) -> List[Tuple[str, float]]:
+        return [(f"{self.name}{_label_text(self.labels)}", self.read())]
+
+class Histogram:
+    """Observations counted into fixed buckets, plus their sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", labels: Labels = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> List[Tuple[str, float]]:
+        out = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            out.append((f"{self.name}_bucket{_label_text(self.labels, le)}", cumulative))
+        out.append((f"{self.name}_sum{_label_text(self.labels)}", self.sum))
+        out.append((f"{self.name}_count{_label_text(self.labels)}", self.count))
+        return out
+
+class MetricsRegistry:
+    """
+    In-process metrics.
+
+    Instruments are plain objects updated with an attribute increment, so
+    hot paths pay a method call and no locking (everything runs on the event
+    loop). Export renders the Prometheus text format.
+    """
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Labels], object] = {}
+
+    def _get(self, cls, name: str, help: str, labels: Optional[Dict[str, str]], **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = cls(name, help, key[1], **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str = "", labels: Optional[Dict[str, str]] = None) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", labels: Optional[Dict[str, str]] = None,
+              fn: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str = "", labels: Optional[Dict[str, str]] = None,
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        lines = []
+        described = set()
+        for (name, _), metric in sorted(self._metrics.items()):
+            if name not in described:
+                described.add(name)
+                if metric.help:
+                    lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, float]:
+        """Every sample as a flat dict"""
+        return {sample: value for metric in self._metrics.values() for sample, value in metric.samples()}
+
+async def serve_metrics(registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9100) -> asyncio.AbstractServer:
+    """Serve the registry as plain text over HTTP (any GET path)"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Read the request head; the path does not matter
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = registry.render().encode("utf-8")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except Exception as e:
+            logging.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+async def write_snapshots(registry: MetricsRegistry, path: str, interval: float = 10.0) -> None:
+    """Rewrite a JSON snapshot of the registry every `interval` seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        snapshot = {"time": time.time(), "metrics": registry.snapshot()}
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.error(f"Writing metrics snapshot failed: {e}")
\ No newline at end of file
@@ -1,5 +1,14 @@
+import asyncio
+import json
 import pytest
+from datetime import datetime, timedelta
+from aioquic.tls import CipherSuite, SessionTicket
 from src.client.client_state import ClientStateManager, ConnectionState
+from src.client.tickets import TicketCache
+from src.client.client import ChatClientProtocol
+from src.protocol.framing import frame
+from src.protocol.message import MsgType, BINARY_VERSION, pack, unpack
+from aioquic.quic.events import ConnectionTerminated, StreamDataReceived
 
 def test_client_state_manager():
     """Test client state management"""
@@ -21,4 +30,99 @@ def test_client_state_manager():
     assert csm.transition_to(ConnectionState.CONNECTING)
     assert csm.transition_to(ConnectionState.AUTHENTICATING)
     assert csm.transition_to(ConnectionState.AUTHENTICATED)
-    assert csm.is_authenticated
\ No newline at end of file
+    assert csm.is_authenticated
+
+def test_client_presence_tracking():
+    """Test applying presence snapshots and deltas"""
+    csm = ClientStateManager()
+
+    # Deltas before the first snapshot cannot be applied
+    assert not csm.apply_presence_delta(1, ["alice"], [])
+
+    csm.apply_presence_snapshot(3, ["alice", "bob"])
+    assert csm.apply_presence_delta(3, ["stale"], [])  # Already in the snapshot
+    assert csm.apply_presence_delta(4, ["carol"], ["bob"])
+    assert csm.online_users == {"alice", "carol"}
+
+    # A gap means a snapshot must be requested
+    assert not csm.apply_presence_delta(6, ["dave"], [])
+    assert csm.online_users == {"alice", "carol"}
+
+def make_ticket(label: bytes, lifetime: timedelta = timedelta(hours=1)) -> SessionTicket:
+    now = datetime.utcnow()
+    return SessionTicket(age_add=0, cipher_suite=CipherSuite.AES_128_GCM_SHA256, not_valid_after=now + lifetime,
+                         not_valid_before=now, resumption_secret=b"secret", server_name="localhost", ticket=label)
+
+def test_ticket_cache_round_trip(tmp_path):
+    """Test that tickets and resume tokens survive a restart of the client"""
+    path = str(tmp_path / "tickets.json")
+    cache = TicketCache(path)
+    assert cache.get("localhost", 4433).ticket is None
+
+    cache.store_ticket("localhost", 4433, make_ticket(b"t1"))
+    cache.store_session("localhost", 4433, "alice", "jwt", 2)
+
+    entry = TicketCache(path).get("localhost", 4433)
+    assert entry.ticket == cache.get("localhost", 4433).ticket
+    assert (entry.username, entry.token, entry.wire_version) == ("alice", "jwt", 2)
+    assert TicketCache(path).get("localhost", 9999).token is None
+
+    cache.drop_token("localhost", 4433)
+    cache.store_ticket("localhost", 4433, make_ticket(b"old", lifetime=timedelta(seconds=-1)))
+    entry = TicketCache(path).get("localhost", 4433)
+    assert entry.token is None and entry.ticket is None  # Expired tickets are not offered
+
+    # A damaged file loses its bad entries, never more
+    with open(path, "w") as f:
+        json.dump({"localhost:4433": {"ticket": {"ticket": 1}, "token": "jwt"},
+                   "localhost:4434": {"username": "bob", "token": "jwt2"}}, f)
+    cache = TicketCache(path)
+    assert cache.get("localhost", 4433).token is None and cache.get("localhost", 4434).token == "jwt2"
+
+class RecordingQuic:
+    """Minimal QuicConnection stand-in that keeps what the client writes"""
+    def __init__(self):
+        self._streams = {}
+        self.sent = []
+
+    def get_next_available_stream_id(self, is_unidirectional=False):
+        return 0
+
+    def send_stream_data(self, stream_id, data, end_stream=False):
+        self.sent.append(unpack(data[4:]))
+
+    def datagrams_to_send(self, now):
+        return []
+
+    def get_timer(self):
+        return None
+
+def receive(protocol, msg):
+    data = frame(pack({"v": BINARY_VERSION, "to": None, "token": None, **msg}))
+    protocol.quic_event_received(StreamDataReceived(data=data, end_stream=False, stream_id=1))
+
+def test_client_protocol_login_and_bounded_inbox():
+    """Test that login resolves on AUTH_OK and that a lagging consumer loses the oldest messages"""
+    async def scenario():
+        quic = RecordingQuic()
+        protocol = ChatClientProtocol(quic, inbox_size=2)
+        login = asyncio.create_task(protocol.authenticate("alice", "secret"))
+        await asyncio.sleep(0)
+        assert quic.sent[0]["t"] == MsgType.AUTH_REQ and quic.sent[0]["to"] == "alice"
+
+        receive(protocol, {"t": int(MsgType.AUTH_OK), "body": "Welcome", "token": "jwt"})
+        assert await login and protocol.token == "jwt"
+
+        for i in range(3):
+            receive(protocol, {"t": int(MsgType.CHAT), "body": f"m{i}"})
+        assert protocol.dropped == 2  # AUTH_OK and m0
+
+        # Pipelined writes go out without waiting for each other
+        for i in range(5):
+            protocol.write({"t": MsgType.CHAT, "body": f"out{i}"})
+        assert [m["body"] for m in quic.sent[1:]] == [f"out{i}" for i in range(5)]
+
+        protocol.quic_event_received(ConnectionTerminated(error_code=0, frame_type=None, reason_phrase=""))
+        return [m["body"] async for m in protocol.messages()]
+
+    assert asyncio.run(scenario()) == ["m1", "m2"]
\ No newline at end of file
@@ -1,7 +1,15 @@
+import asyncio
+import concurrent.futures
+import sqlite3
+import time
 import pytest
 from src.protocol import Message, MsgType, pack, unpack
-from src.protocol.auth import AuthManager
+from src.protocol import BINARY_VERSION, ALPN_BINARY, ALPN_JSON, JSON_VERSION, wire_version_for_alpn
+from src.protocol.auth import AuthManager, ClaimsCache, hash_password
+from src.protocol.compression import COMPRESSED_TAG, DICTIONARY_ID, Compressor, decompress
+from src.protocol.framing import FrameBuffer, StreamReassembler, frame
 from src.protocol.states import StateManager, ConnectionState
+from src.protocol.user_store import MemoryUserStore, SQLiteUserStore, UserStore
 
 def test_message_packing():
     """Test message serialization and deserialization"""
@@ -19,6 +27,95 @@ def test_message_packing():
     assert isinstance(packed, bytes)
     assert unpacked == original_msg
 
+def test_binary_message_packing():
+    """Test binary serialization and format auto-detection"""
+    original_msg = {
+        "v": BINARY_VERSION,
+        "t": MsgType.CHAT,
+        "body": "Héllo, World!",
+        "to": "alice",
+        "token": None
+    }
+
+    packed = pack(original_msg)
+    unpacked = unpack(packed)
+
+    assert packed[0] == BINARY_VERSION
+    assert len(packed) < len(pack(dict(original_msg, v=1)))
+    assert unpacked == original_msg
+
+    # Truncated frames are rejected
+    with pytest.raises(ValueError):
+        unpack(packed[:-1])
+
+    # Integer extension fields are only decoded when present
+    with_seq = dict(original_msg, t=MsgType.PRESENCE, seq=2 ** 40)
+    assert unpack(pack(with_seq)) == with_seq
+
+    assert wire_version_for_alpn(ALPN_BINARY) == BINARY_VERSION
+    assert wire_version_for_alpn(ALPN_JSON) == JSON_VERSION
+    assert wire_version_for_alpn(None) == JSON_VERSION
+
+def test_compression_with_shared_dictionary():
+    """Test that compressed messages round-trip and that small or incompressible ones stay raw"""
+    compressor = Compressor(threshold=32)
+    joined = {"v": BINARY_VERSION, "t": int(MsgType.SYS), "body": "User 'alice' joined the chat.",
+              "to": None, "token": None}
+    payload = compressor.compress(pack(joined))
+    assert payload[:1] == COMPRESSED_TAG and len(payload) < len(pack(joined))
+    assert unpack(payload) == joined
+
+    short = pack({"v": BINARY_VERSION, "t": int(MsgType.CHAT), "body": "hi"})
+    assert compressor.compress(short) == short
+    noise = pack({"v": JSON_VERSION, "t": int(MsgType.CHAT), "body": "q9Zr!x7@Lm#2Kp$w", "to": None, "token": None})
+    sent = compressor.compress(noise)
+    assert sent == noise or len(sent) < len(noise)  # Never larger than the original
+    assert compressor.messages == 3 and compressor.bytes_out < compressor.bytes_in
+
+    # Inflating past the limit is refused
+    bomb = Compressor(threshold=0).compress(b"\x02" + b"a" * 100000)
+    with pytest.raises(ValueError):
+        decompress(bomb, max_size=1000)
+
+    # The dictionary id rides along in AUTH_REQ / AUTH_OK in both wire formats
+    for version in (JSON_VERSION, BINARY_VERSION):
+        msg = {"v": version, "t": int(MsgType.AUTH_OK), "body": "Welcome", "to": None, "token": "jwt",
+               "zdict": DICTIONARY_ID}
+        assert unpack(pack(msg))["zdict"] == DICTIONARY_ID
+
+def test_frame_reassembly():
+    """Test extracting length-prefixed frames regardless of event boundaries"""
+    payloads = [pack({"v": 1, "t": MsgType.CHAT, "body": f"msg {i}"}) for i in range(3)]
+    stream = b"".join(frame(p) for p in payloads)
+
+    # Many frames in one event
+    assert FrameBuffer().feed(stream) == payloads
+
+    # A frame split across events
+    buffer = FrameBuffer()
+    assert buffer.feed(stream[:3]) == []
+    assert buffer.feed(stream[3:len(frame(payloads[0])) + 2]) == payloads[:1]
+    assert buffer.pending == 2
+    assert buffer.feed(stream[len(frame(payloads[0])) + 2:]) == payloads[1:]
+    assert buffer.pending == 0
+
+    # Oversized frames are rejected
+    with pytest.raises(ValueError):
+        FrameBuffer(max_frame_size=4).feed(frame(b"too long"))
+
+def test_stream_reassembler_detects_legacy_streams():
+    """Test that unframed one-message-per-stream peers keep working"""
+    legacy = pack({"v": 1, "t": MsgType.CHAT, "body": "hello"})
+    reassembler = StreamReassembler()
+
+    assert reassembler.feed(0, legacy[:5], False) == []
+    assert reassembler.feed(0, legacy[5:], True) == [legacy]
+    assert reassembler.framed is False
+
+    assert reassembler.feed(4, frame(legacy) + frame(legacy), False) == [legacy, legacy]
+    assert reassembler.framed is True
+    assert reassembler.pending == 0
+
 def test_auth_manager():
     """Test authentication manager functionality"""
     auth = AuthManager(secret_key="test-key")
@@ -41,6 +138,86 @@ def test_auth_manager():
     
     assert auth.validate_token("invalid-token") is None
 
+def test_claims_cache():
+    """Test that decoded token claims are cached, bounded and expire"""
+    cache = ClaimsCache(max_size=2)
+    now = time.time()
+    cache.put("a", {"sub": "alice", "exp": now + 60})
+    cache.put("b", {"sub": "bob", "exp": now + 60})
+    assert cache.get("a")["sub"] == "alice"  # "a" is now the most recent
+    cache.put("c", {"sub": "carol", "exp": now + 60})
+    assert cache.get("b") is None and cache.get("c")["sub"] == "carol"
+    cache.put("old", {"sub": "dave", "exp": now - 1})
+    assert cache.get("old") is None
+
+    auth = AuthManager(secret_key="test-key")
+    token = auth.issue_token("testuser")
+    assert auth.validate_token(token) == "testuser"
+    assert auth.validate_token(token) == "testuser"
+    assert auth._claims.hits == 1
+
+def test_sqlite_user_store(tmp_path):
+    """Test that users persist in SQLite, are shared between stores on one file and cached"""
+    path = str(tmp_path / "users.db")
+    assert isinstance(UserStore.from_config({}), MemoryUserStore)
+    with pytest.raises(ValueError):
+        UserStore.from_config({"user_store": "ldap"})
+
+    class Incomplete(UserStore):
+        def get_hash(self, username):
+            return None
+    with pytest.raises(TypeError):
+        Incomplete()  # A backend missing a method fails here, not during a login
+
+    async def scenario():
+        store = SQLiteUserStore(path, pool_size=2, cache_size=2)
+        other = SQLiteUserStore(path, pool_size=1)  # As another worker process would open it
+        auth = AuthManager(secret_key="test-key", bcrypt_rounds=4, store=store)
+        try:
+            assert await auth.register_async("alice", "password")
+            assert not await auth.register_async("alice", "password")
+            assert await auth.verify_async("alice", "password")
+            assert not await auth.verify_async("alice", "wrong-password")
+            assert not await auth.verify_async("nonexistent", "password")
+
+            # Unknown names are not cached: a user registered elsewhere is found at once
+            assert await store.get_hash_async("bob") is None
+            assert other.add("bob", hash_password("secret", 4))
+            assert await other.get_hash_async("alice") == await store.get_hash_async("alice")
+            hits = store.hits
+            assert all(await asyncio.gather(*(store.get_hash_async("bob") for _ in range(3))))
+            assert await store.get_hash_async("bob") and store.hits == hits + 1
+
+            assert store.add_many([(f"user{i}", b"hash") for i in range(100)] + [("alice", b"hash")]) == 100
+            assert len(store) == len(other) == 102
+            assert await store.get_hash_async("user0") == store.get_hash("user1") == b"hash"
+            assert list(store._cache) == ["user0", "user1"]  # Least recently used first out
+
+            # A cancelled query settles its waiting lookups, and the next one asks again
+            class Stalled(concurrent.futures.Executor):
+                def submit(self, fn, *args, **kwargs):
+                    self.query = concurrent.futures.Future()
+                    return self.query
+            executor, store._executor = store._executor, Stalled()
+            lookup = asyncio.ensure_future(store.get_hash_async("carol"))
+            await asyncio.sleep(0.01)
+            store._executor.query.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await lookup
+            store._executor = executor
+            assert not store._lookups and await store.get_hash_async("carol") is None
+        finally:
+            store.close()
+            other.close()
+        with pytest.raises(RuntimeError):
+            await store.get_hash_async("dave")  # Fails rather than waiting forever once the store is closed
+
+    asyncio.run(scenario())
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    reopened = AuthManager(secret_key="test-key", store=SQLiteUserStore(path))
+    assert reopened.verify("alice", "password") and not reopened.register("bob", "other")
+    reopened.store.close()
+
 def test_state_manager():
     """Test state management functionality"""
     sm = StateManager()
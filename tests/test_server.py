@@ -1,6 +1,39 @@
+import asyncio
+import datetime
+import json
+import ssl
+import struct
+import time
 import pytest
+from aioquic.buffer import Buffer
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.packet import PACKET_TYPE_RETRY, pull_quic_header
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from jose import jwt
 from src.server.server_state import ServerStateManager, ClientInfo
-from src.protocol.states import StateManager
+from src.server.fanout import fan_out
+from src.server.auth_service import AuthService
+from src.server.cluster import MessageBus, adopt_connection, stamp_cid
+from src.server.history import HistoryStore, ChatHistory
+from src.server.outbound import OutboundLimits, OutboundQueue
+from src.server.scheduler import TransmitScheduler
+from src.server.tickets import SessionTicketStore
+from src.server.typing_relay import TypingRelay
+from src.server.reaper import IdleReaper, TimerWheel
+from src.server.rate_limit import RateLimiter
+from src.server.mailbox import OfflineMailbox
+from src.server.admission import ChatQuicServer, HandshakeAdmission, RetryTokens, ADMIT, RETRY, REFUSE
+from src.server.federation import Federation, HashRing, FED_HELLO, FED_MAIL, _FRAME, _HELLO, _proof
+from src.server.tracing import MessageTracer, read_traces, summarize
+from src.utils.metrics import MetricsRegistry, serve_metrics
+from src.protocol.auth import AuthManager, TOKEN_RESUME
+from src.protocol.user_store import MemoryUserStore
+from src.protocol.states import StateManager, ConnectionState
+from src.protocol.message import MsgType, JSON_VERSION, BINARY_VERSION, pack, unpack
 
 class MockProtocol:
     """Mock protocol class for testing"""
@@ -10,6 +43,52 @@ class MockProtocol:
     async def async_send(self, *args, **kwargs):
         self.messages.append((args, kwargs))
 
+class MockConnection:
+    """Mock protocol recording raw frames pushed by fan-out"""
+    def __init__(self, username, wire_version=JSON_VERSION, datagrams=False):
+        self.username = username
+        self.wire_version = wire_version
+        self.frames = []
+        self.datagram_limit = 1000 if datagrams else 0
+        self.datagrams = []
+
+    @property
+    def frame_key(self):
+        return (self.wire_version, False)
+
+    def encode_frame(self, msg):
+        return pack({**msg, "v": self.wire_version})
+
+    def send_frame(self, data):
+        self.frames.append(data)
+
+    @property
+    def ephemeral_key(self):
+        return ("datagram", self.wire_version) if self.datagram_limit else self.frame_key
+
+    def encode_ephemeral(self, msg):
+        return self.encode_frame(msg)
+
+    def send_ephemeral(self, data):
+        (self.datagrams if self.datagram_limit else self.frames).append(data)
+
+def test_fan_out_encodes_once_per_format():
+    """Test that fan-out shares one encoded frame per wire format"""
+    recipients = [
+        MockConnection("a"),
+        MockConnection("b"),
+        MockConnection("c", BINARY_VERSION),
+        MockConnection("d", BINARY_VERSION),
+    ]
+    sent = fan_out(recipients, {"t": int(MsgType.SYS), "body": "hello", "to": None, "token": None})
+
+    assert sent == 4
+    assert recipients[0].frames[0] is recipients[1].frames[0]
+    assert recipients[2].frames[0] is recipients[3].frames[0]
+    assert unpack(recipients[0].frames[0])["v"] == JSON_VERSION
+    assert unpack(recipients[2].frames[0]) == unpack(recipients[3].frames[0])
+    assert unpack(recipients[2].frames[0])["body"] == "hello"
+
 def test_server_state_manager():
     """Test server state management"""
     ssm = ServerStateManager()
@@ -31,4 +110,800 @@ def test_server_state_manager():
     # Test token update
     ssm.add_client("testuser", mock_protocol)
     ssm.update_client_token("testuser", "test-token")
-    assert ssm.get_client("testuser").token == "test-token"
\ No newline at end of file
+    assert ssm.get_client("testuser").token == "test-token"
+
+def test_session_table_slots():
+    """Test that sessions get integer ids whose slots are reused"""
+    ssm = ServerStateManager()
+    alice = ssm.add_client("alice", MockProtocol())
+    bob = ssm.add_client("bob", MockProtocol())
+    assert (alice.session_id, bob.session_id) == (0, 1)
+    assert ssm.add_client("alice", MockProtocol()) is None
+    assert ssm.get_session(1) is bob
+    assert not hasattr(alice, "__dict__")
+
+    ssm.remove_client("alice")
+    assert ssm.get_session(0) is None
+    assert ssm.get_session(7) is None
+    carol = ssm.add_client("carol", MockProtocol())
+    assert carol.session_id == 0 and ssm.get_session(0) is carol
+
+    assert carol.state == ConnectionState.AUTHENTICATED
+    assert not carol.transition_to(ConnectionState.CONNECTING)
+    assert carol.transition_to(ConnectionState.DISCONNECTED)
+    assert carol.state == ConnectionState.DISCONNECTED
+
+def test_presence_deltas_are_coalesced():
+    """Test that presence changes are merged into versioned deltas"""
+    ssm = ServerStateManager()
+    assert ssm.drain_presence_delta() is None
+
+    ssm.add_client("alice", MockProtocol())
+    ssm.add_client("bob", MockProtocol())
+    assert ssm.has_presence_changes()
+    assert ssm.drain_presence_delta() == (1, ["alice", "bob"], [])
+    assert ssm.presence_snapshot() == (1, ["alice", "bob"])
+
+    # Joining and leaving inside one window cancels out
+    ssm.add_client("carol", MockProtocol())
+    ssm.remove_client("carol")
+    ssm.remove_client("bob")
+    assert ssm.drain_presence_delta() == (2, [], ["bob"])
+    assert ssm.drain_presence_delta() is None
+
+def test_room_membership_index():
+    """Test room join/leave bookkeeping in both directions"""
+    ssm = ServerStateManager()
+    for name in ("alice", "bob"):
+        ssm.add_client(name, MockProtocol())
+
+    assert ssm.join_room("alice", "python")
+    assert not ssm.join_room("alice", "python")
+    assert ssm.join_room("bob", "python")
+    assert ssm.join_room("bob", "music")
+    assert ssm.get_room_members("python") == {"alice", "bob"}
+    assert ssm.list_rooms() == [("music", 1), ("python", 2)]
+
+    assert ssm.leave_room("alice", "python")
+    assert not ssm.leave_room("alice", "python")
+    assert not ssm.is_room_member("alice", "python")
+
+    # Disconnecting leaves every room and empty rooms disappear
+    ssm.remove_client("bob")
+    assert ssm.rooms == {}
+    assert ssm.user_rooms == {}
+
+def test_remote_clients_are_online():
+    """Test tracking users connected to other workers"""
+    ssm = ServerStateManager()
+    ssm.add_client("alice", MockProtocol())
+    ssm.add_remote_client("bob", 2)
+
+    assert ssm.is_client_online("bob")
+    assert ssm.get_client("bob") is None
+    assert ssm.get_client_worker("bob") == 2
+    assert sorted(ssm.get_online_users()) == ["alice", "bob"]
+    assert ssm.drain_presence_delta() == (1, ["alice", "bob"], [])
+
+    # Only the worker holding the user can take it offline
+    ssm.remove_remote_client("bob", 1)
+    assert ssm.is_client_online("bob")
+    ssm.remove_remote_client("bob", 2)
+    assert not ssm.is_client_online("bob")
+    assert ssm.drain_presence_delta() == (2, [], ["bob"])
+
+def test_message_bus_between_workers(tmp_path):
+    """Test presence and private delivery across two workers' buses"""
+    async def scenario():
+        states = [ServerStateManager(), ServerStateManager()]
+        history = ChatHistory(HistoryStore(str(tmp_path / "history")), states[1])
+        buses = [MessageBus(i, 2, str(tmp_path), states[i], history=history if i else None) for i in range(2)]
+        for bus in buses:
+            await bus.start()
+        try:
+            bob = MockConnection("bob")
+            states[1].add_client("bob", bob)
+            buses[1].publish_presence("bob", True)
+            await asyncio.sleep(0.05)
+            assert states[0].get_client_worker("bob") == 1
+
+            buses[0].send_private(1, "bob", {"t": int(MsgType.CHAT), "body": "[Private] alice: hi"}, sender="alice")
+            buses[0].publish_message({"t": int(MsgType.CHAT), "body": "alice: hello"}, exclude="alice")
+            buses[0].publish_message({"t": int(MsgType.CHAT), "body": "bob: echo"}, exclude="bob")
+            await asyncio.sleep(0.05)
+            assert [unpack(f)["body"] for f in bob.frames] == ["[Private] alice: hi", "alice: hello"]
+            # The sender can find their private message in the history of the worker that delivered it
+            pages = await history.fetch("alice", last=10)
+            assert "[Private] alice: hi" in [r[2] for r in json.loads(pages[0]["body"])["records"]]
+
+            # A body larger than one datagram goes over in pieces
+            big = "[Private] alice: " + "x" * (300 * 1024)
+            buses[0].send_private(1, "bob", {"t": int(MsgType.CHAT), "body": big})
+            await asyncio.sleep(0.05)
+            assert unpack(bob.frames[-1])["body"] == big and buses[0].send_errors == 0
+
+            # Once worker 1 is gone, a failed send to its socket forgets its users
+            buses[1].close()
+            buses[0].send_private(1, "bob", {"t": int(MsgType.CHAT), "body": "[Private] alice: still there?"})
+            assert states[0].get_client_worker("bob") is None and buses[0].send_errors == 1
+        finally:
+            for bus in buses:
+                bus.close()
+            history.close()
+
+    asyncio.run(scenario())
+    assert stamp_cid(b"\xff" * 8, 3) == b"\x03" + b"\xff" * 7
+
+def quic_configurations():
+    """Server and client QuicConfiguration for in-memory handshakes, with a throwaway self-signed certificate"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+                   .public_key(key.public_key()).serial_number(x509.random_serial_number())
+                   .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                   .sign(key, hashes.SHA256()))
+    server_config = QuicConfiguration(is_client=False, alpn_protocols=["chat"])
+    server_config.certificate, server_config.private_key = certificate, key
+    client_config = QuicConfiguration(is_client=True, alpn_protocols=["chat"], server_name="localhost",
+                                      verify_mode=ssl.CERT_NONE)
+    return server_config, client_config
+
+def test_worker_connection_ids_carry_worker_id():
+    """Test that every host connection ID of an adopted connection starts with the worker id"""
+    server_config, client_config = quic_configurations()
+    client = QuicConnection(configuration=client_config)
+    server = QuicConnection(configuration=server_config,
+                            original_destination_connection_id=client.original_destination_connection_id)
+    adopt_connection(server, 3)
+
+    client_addr, server_addr = ("10.0.0.1", 4433), ("10.0.0.2", 4433)
+    clock = time.time()
+    def exchange():
+        for _ in range(6):
+            for data, _addr in client.datagrams_to_send(clock):
+                server.receive_datagram(data, client_addr, clock)
+            for data, _addr in server.datagrams_to_send(clock):
+                client.receive_datagram(data, server_addr, clock)
+
+    client.connect(server_addr, clock)
+    exchange()
+    # Retiring IDs makes the server issue fresh ones
+    for _ in range(3):
+        client.change_connection_id()
+        exchange()
+    issued = [c.cid for c in server._host_cids] + [c.cid for c in client._peer_cid_available] + [client._peer_cid.cid]
+    assert server._handshake_complete and len(issued) > 3
+    assert all(cid[0] == 3 for cid in issued)
+
+class CountingStore(MemoryUserStore):
+    """In-memory user store counting the lookups made through the async API"""
+    lookups = 0
+
+    async def get_hash_async(self, username):
+        self.lookups += 1
+        return self.get_hash(username)
+
+def test_auth_service_shared_across_logins():
+    """Test that logins are checked against one shared user store in a pool"""
+    async def scenario():
+        store = CountingStore()
+        service = AuthService(AuthManager(bcrypt_rounds=4, store=store), max_workers=2)
+        try:
+            # First login registers, later ones verify against the stored hash; each looks the user up once
+            assert await service.login("alice", "secret")
+            assert await service.login("alice", "secret")
+            assert not await service.login("alice", "wrong")
+            assert store.lookups == 3
+
+            results = await asyncio.gather(*(service.login(f"user{i}", "pw") for i in range(6)))
+            assert all(results)
+            assert service.pending == 0
+        finally:
+            service.shutdown()
+
+    asyncio.run(scenario())
+
+def test_history_store_segments_and_reopen(tmp_path):
+    """Test appends across segments, indexed range reads and reopening the log"""
+    store = HistoryStore(str(tmp_path), segment_bytes=1024, index_interval=4, tail_records=8)
+    seqs = [store.append(f"message {i}".encode()) for i in range(200)]
+    assert seqs == list(range(1, 201))
+    assert store.flush()
+    assert len(store._segments) > 1
+
+    # Old records come from the mapped segments, recent ones from memory
+    assert [bytes(p) for _, _, p in store.read(50, 3)] == [b"message 49", b"message 50", b"message 51"]
+    assert [seq for seq, _, _ in store.read(190, 20)] == list(range(190, 201))
+    store.close()
+
+    reopened = HistoryStore(str(tmp_path), segment_bytes=1024, index_interval=4, tail_records=8)
+    assert reopened.last_seq == 200
+    assert reopened.append(b"after restart") == 201
+    assert [bytes(p) for _, _, p in reopened.read(200, 5)] == [b"message 199", b"after restart"]
+    reopened.close()
+
+def test_chat_history_visibility_and_pages(tmp_path):
+    """Test that history pages only contain messages the requester may see"""
+    async def scenario():
+        ssm = ServerStateManager()
+        ssm.join_room("alice", "dev")
+        history = ChatHistory(HistoryStore(str(tmp_path)), ssm, page_size=2)
+        try:
+            history.record({"t": int(MsgType.CHAT), "body": "alice: hi"}, sender="alice")
+            history.record({"t": int(MsgType.CHAT), "body": "[dev] alice: x", "room": "dev"}, sender="alice")
+            history.record({"t": int(MsgType.CHAT), "body": "[Private] alice: psst"}, sender="alice", recipient="bob")
+            history.record({"t": int(MsgType.CHAT), "body": "bob: yo"}, sender="bob")
+
+            def bodies(pages):
+                return [r[2] for page in pages for r in json.loads(page["body"])["records"]]
+
+            assert bodies(await history.fetch("carol", last=10)) == ["alice: hi", "bob: yo"]
+            pages = await history.fetch("alice", last=10)
+            assert len(pages) == 2 and all(p["t"] == MsgType.HISTORY for p in pages)
+            assert bodies(pages) == ["alice: hi", "[dev] alice: x", "[Private] alice: psst", "bob: yo"]
+
+            # Paging forward from a cursor
+            first = await history.fetch("bob", since=0, last=None)
+            assert bodies(first) == ["alice: hi", "[Private] alice: psst"]
+            assert json.loads(first[-1]["body"])["more"]
+            rest = await history.fetch("bob", since=first[-1]["seq"])
+            assert bodies(rest) == ["bob: yo"] and not json.loads(rest[-1]["body"])["more"]
+
+            # The last N are the last N the user may see, however many hidden ones came after
+            for n in range(5):
+                history.record({"t": int(MsgType.CHAT), "body": f"[Private] bob: {n}"}, sender="bob", recipient="dave")
+            assert bodies(await history.fetch("carol", last=2)) == ["alice: hi", "bob: yo"]
+        finally:
+            history.close()
+
+    asyncio.run(scenario())
+
+class StalledWriter:
+    """Frame writer whose peer acknowledges nothing until told to"""
+    def __init__(self):
+        self.written = []
+        self.unacked = 0
+
+    def buffered(self):
+        return self.unacked
+
+    def write(self, data):
+        self.written.append(data)
+        self.unacked += len(data)
+
+def test_outbound_queue_backpressure_and_policies():
+    """Test that a stalled client fills a bounded queue and the policy applies"""
+    limits = OutboundLimits(max_frames=3, max_bytes=1024, high_watermark=4, policy="drop_oldest")
+    writer = StalledWriter()
+    queue = OutboundQueue(writer, limits)
+    assert queue.put(b"aaaa") == 1  # Written straight through
+    for frame in (b"b", b"c", b"d", b"e"):
+        assert queue.put(frame) == 0  # QUIC already holds the watermark
+    assert queue.depth == 3 and queue.drops == 1
+    assert limits.stats.depth == 3 and limits.stats.drops == 1
+
+    writer.unacked = 0  # Peer caught up
+    assert queue.drain() == 3
+    assert writer.written == [b"aaaa", b"c", b"d", b"e"]
+    assert queue.depth == 0 and limits.stats.depth == 0
+
+    newest = OutboundQueue(StalledWriter(), OutboundLimits(max_frames=1, high_watermark=0, policy="drop_newest"))
+    newest.put(b"x")
+    newest.put(b"y")
+    assert list(newest._frames) == [b"x"] and newest.drops == 1
+
+    evicted = []
+    limits = OutboundLimits(max_frames=1, high_watermark=0, policy="disconnect")
+    queue = OutboundQueue(StalledWriter(), limits, on_evict=lambda: evicted.append(True))
+    queue.put(b"x")
+    queue.put(b"y")
+    assert evicted == [True] and queue.evicted and queue.depth == 0
+    assert limits.stats.evictions == 1 and limits.stats.depth == 0
+    assert queue.put(b"z") == 0
+
+    with pytest.raises(ValueError):
+        OutboundLimits(policy="ignore")
+
+def test_transmit_scheduler_coalesces_per_tick():
+    """Test that many marks in one tick cost one transmit per connection"""
+    class Transmitting:
+        def __init__(self):
+            self.transmits = 0
+
+        def transmit(self):
+            self.transmits += 1
+
+    async def scenario():
+        scheduler = TransmitScheduler()
+        a, b = Transmitting(), Transmitting()
+        for _ in range(20):
+            scheduler.mark(a)
+        scheduler.mark(b)
+        assert (a.transmits, b.transmits) == (0, 0)
+        await asyncio.sleep(0)
+        assert (a.transmits, b.transmits) == (1, 1)
+
+        immediate = TransmitScheduler(batching=False)
+        for _ in range(3):
+            immediate.mark(a)
+        assert a.transmits == 4
+
+    asyncio.run(scenario())
+
+def test_session_ticket_store_is_single_use():
+    """Test that each ticket resumes at most one connection"""
+    from tests.test_client import make_ticket
+
+    store = SessionTicketStore(max_tickets=2)
+    for label in (b"a", b"b", b"c"):
+        store.add(make_ticket(label))
+    assert len(store) == 2 and store.pop(b"a") is None  # Oldest forgotten
+    assert store.pop(b"b").ticket == b"b"
+    assert store.pop(b"b") is None  # Replay
+    assert (store.issued, store.resumed, store.missed) == (3, 1, 2)
+
+def test_auth_service_sessions():
+    """Test that a session token stands in for the password of the same user only"""
+    async def scenario():
+        service = AuthService(AuthManager(bcrypt_rounds=4), executor="inline")
+        session = service.open_session("alice")
+        assert session.username == "alice" and session.expires_at > 0
+        resumed = service.resume_session("alice", session.token)
+        assert resumed == session
+        assert service.resume_session("bob", session.token) is None
+        assert service.resume_session("alice", "garbage") is None
+        # Neither an access token nor a token signed with another key resumes a session
+        assert service.resume_session("alice", service.issue_token("alice")) is None
+        forged = jwt.encode({"sub": "alice", "use": TOKEN_RESUME, "exp": int(time.time()) + 3600},
+                            "your-very-secret-key", algorithm="HS256")
+        assert service.resume_session("alice", forged) is None
+
+    asyncio.run(scenario())
+    with pytest.raises(ValueError):
+        AuthService.from_config({"auth_secret": None})
+    with pytest.raises(ValueError):
+        AuthService.from_config({"auth_secret": "short"})
+
+def test_metrics_registry_and_http_export():
+    """Test counters, gauges and histograms and their text export over HTTP"""
+    registry = MetricsRegistry()
+    sent = registry.counter("sent_total", "Frames sent")
+    sent.inc()
+    sent.inc(2)
+    assert registry.counter("sent_total") is sent
+    depth = [7]
+    registry.gauge("depth", fn=lambda: depth[0])
+    latency = registry.histogram("latency_seconds", labels={"handler": "x"}, buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    with pytest.raises(ValueError):
+        registry.gauge("sent_total")
+
+    snapshot = registry.snapshot()
+    assert snapshot["sent_total"] == 3 and snapshot["depth"] == 7
+    assert snapshot['latency_seconds_bucket{handler="x",le="0.1"}'] == 1
+    assert snapshot['latency_seconds_bucket{handler="x",le="1.0"}'] == 2
+    assert snapshot['latency_seconds_bucket{handler="x",le="+Inf"}'] == 3
+    assert snapshot['latency_seconds_count{handler="x"}'] == 3
+
+    async def scenario():
+        server = await serve_metrics(registry, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+        return response.decode()
+
+    depth[0] = 9
+    response = asyncio.run(scenario())
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "# TYPE sent_total counter" in response and "\nsent_total 3\n" in response
+    assert "\ndepth 9\n" in response
+
+def test_typing_relay_rate_limits_and_merges():
+    """Test that typing indicators are rate-limited per user and merged per scope before fan-out"""
+    async def scenario():
+        ssm = ServerStateManager()
+        clients = {name: MockConnection(name, datagrams=name != "dave") for name in ("alice", "bob", "carol", "dave")}
+        for name, connection in clients.items():
+            ssm.add_client(name, connection)
+        ssm.join_room("alice", "python")
+        ssm.join_room("carol", "python")
+
+        relay = TypingRelay(ssm, interval=10.0, window=0.01)
+        assert relay.typing("alice")
+        assert not relay.typing("alice")  # Rate-limited
+        assert relay.typing("bob")
+        assert relay.typing("alice", room="python")
+        assert relay.typing("bob", target="carol")
+        await asyncio.sleep(0.05)
+
+        everyone = [unpack(d) for d in clients["carol"].datagrams]
+        assert {m["body"] for m in everyone} == {"alice\nbob", "alice", "bob"}
+        assert {m.get("room") for m in everyone} == {None, "python"}
+        assert unpack(clients["dave"].frames[0])["body"] == "alice\nbob"  # Stream fallback
+        assert clients["dave"].datagrams == []
+        assert clients["alice"].datagrams == []  # Typers are not told about themselves
+        assert (relay.accepted, relay.dropped) == (4, 1)
+
+    asyncio.run(scenario())
+
+class MockSession:
+    """Mock connection as seen by the idle reaper"""
+    def __init__(self, ssm, reaper, username=None):
+        self.ssm = ssm
+        self.reaper = reaper
+        self.username = username
+        self.connected_at = self.last_seen = asyncio.get_running_loop().time()
+        self._closed = asyncio.Event()
+        self.reaped = None
+        if username:
+            ssm.add_client(username, self)
+        reaper.watch(self)
+
+    def reap(self, reason):
+        self.reaped = reason
+        self.handle_disconnect()
+
+    def handle_disconnect(self):
+        self.reaper.forget(self)
+        if self.username and self.username in self.ssm.clients:
+            self.ssm.remove_client(self.username)
+            return True
+        return False
+
+def test_idle_reaper_closes_dead_sessions():
+    """Test the timer wheel and that quiet, unauthenticated and closed sessions are reaped"""
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule("a", 2.0)
+    wheel.schedule("b", 100.0)  # Past one turn: lands in the farthest bucket
+    wheel.schedule("c", 1.0)
+    assert wheel.cancel("c") and not wheel.cancel("c")
+    assert [wheel.advance() for _ in range(7)] == [set(), {"a"}, set(), set(), set(), set(), {"b"}]
+    assert len(wheel) == 0
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        ssm = ServerStateManager()
+        reaper = IdleReaper(ssm, idle_timeout=0.1, auth_timeout=0.05, tick=0.01, slots=16)
+        quiet = MockSession(ssm, reaper, "alice")
+        lurker = MockSession(ssm, reaper)
+        active = MockSession(ssm, reaper, "bob")
+        gone = MockSession(ssm, reaper, "carol")
+        gone._closed.set()  # Closed without its session being removed
+        for _ in range(15):
+            await asyncio.sleep(0.01)
+            active.last_seen = loop.time()
+
+        assert (quiet.reaped, lurker.reaped, active.reaped, gone.reaped) == (
+            "Idle timeout", "Authentication timeout", None, None)
+        assert set(ssm.clients) == {"bob"}
+        assert (reaper.reaped_idle, reaper.reaped_unauthenticated, reaper.cleaned) == (1, 1, 1)
+        assert len(reaper.wheel) == 1
+
+        await asyncio.sleep(0.2)
+        assert active.reaped == "Idle timeout" and not ssm.clients
+        assert reaper._handle is None  # The timer stops with nothing left to watch
+
+    asyncio.run(scenario())
+
+def test_rate_limiter_buckets_and_actions():
+    """Test per-user and per-type buckets, the shared fan-out budget and the over-limit actions"""
+    chat, join = int(MsgType.CHAT), int(MsgType.ROOM_JOIN)
+    limiter = RateLimiter({MsgType.CHAT: (2.0, 3.0)}, fanout_rate=100.0, fanout_burst=200.0)
+    assert [limiter.check("alice", chat, now=0.0) for _ in range(4)] == [0.0, 0.0, 0.0, None]
+    assert limiter.check("bob", chat, now=0.0) == 0.0  # Separate bucket per user
+    assert limiter.check("alice", join, now=0.0) == 0.0  # Unlisted types are not limited
+    assert limiter.check("alice", chat, now=0.5) == 0.0  # Refilled one token
+    assert limiter.check("alice", chat, now=0.5) is None
+
+    # Fan-out budget: 200 recipient sends, shared by everyone
+    assert limiter.check("carol", chat, recipients=150, now=1.0) == 0.0
+    assert limiter.check("dave", chat, recipients=150, now=1.0) is None
+    assert limiter.check("dave", chat, recipients=150, now=2.0) == 0.0
+    assert limiter.dropped == 3
+
+    delaying = RateLimiter({MsgType.CHAT: (2.0, 1.0)}, action="delay", max_delay=1.0)
+    assert [delaying.check("alice", chat, now=0.0) for _ in range(4)] == [0.0, 0.5, 1.0, None]
+    assert (delaying.delayed, delaying.dropped) == (2, 1)
+
+    warning = RateLimiter({MsgType.CHAT: (1.0, 1.0)}, action="warn")
+    assert [warning.check("alice", chat, now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert warning.warned == 2
+    assert warning.check("alice", chat, now=1.0) == 0.0 and warning.warned == 2  # Not left in debt
+
+    limiter.forget("alice")
+    assert "alice" not in limiter._buckets
+    with pytest.raises(ValueError):
+        RateLimiter(action="block")
+
+def test_handshake_admission_and_retry_tokens():
+    """Test the handshake cap, the per-address rate, Retry under load and token checks"""
+    class Handshake:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    admission = HandshakeAdmission(max_handshakes=3, rate_per_ip=1.0, burst_per_ip=2.0, retry_threshold=2,
+                                   handshake_timeout=5.0)
+    alice, bob = ("10.0.0.1", 4000), ("10.0.0.2", 4000)
+    assert admission.admit(alice, b"", now=0.0) == ADMIT
+    assert admission.admit(alice, b"", now=0.0) == ADMIT
+    assert admission.admit(alice, b"", now=0.0) == REFUSE  # Over the per-address burst
+    assert admission.admit(bob, b"", now=0.0) == ADMIT
+
+    first, second = Handshake(), Handshake()
+    admission.started(first, 0.0)
+    admission.started(second, 1.0)
+    assert admission.admit(bob, b"", now=1.0) == RETRY  # Under load, addresses are validated first
+    token = admission.tokens.create_token(bob, b"original", b"retry-cid")
+    assert admission.admit(bob, token, now=1.0) == ADMIT
+    admission.started(Handshake(), 1.0)
+    assert admission.admit(bob, token, now=2.0) == REFUSE  # At the cap
+    admission.finished(second)
+    assert admission.in_flight == 2 and admission.completed == 1
+    # The oldest handshake runs out of time and gives its slot back
+    assert admission.admit(bob, token, now=5.0) == ADMIT and first.closed and admission.timed_out == 1
+    assert (admission.refused_rate, admission.refused_busy, admission.retries) == (1, 1, 1)
+    # A forged token, or one minted for another address, is sent a Retry and costs that address nothing
+    carol = ("10.0.0.3", 4000)
+    assert admission.admit(carol, b"forged" * 8, now=5.0) == RETRY
+    assert admission.admit(carol, token, now=5.0) == RETRY
+    assert admission.invalid_tokens == 2 and "10.0.0.3" not in admission._sources
+    with pytest.raises(ValueError):
+        HandshakeAdmission(retry="sometimes")
+
+    tokens = RetryTokens(lifetime=10.0)
+    token = tokens.create_token(alice, b"original", b"retry-cid")
+    assert tokens.validate_token(alice, token) == (b"original", b"retry-cid")
+    with pytest.raises(ValueError):
+        tokens.validate_token(bob, token)
+    with pytest.raises(ValueError):
+        tokens.validate_token(alice, token[:-1] + bytes([token[-1] ^ 1]))
+    with pytest.raises(ValueError):
+        RetryTokens(lifetime=-1.0, key=tokens._key).validate_token(alice, token)
+
+def test_quic_server_retries_forged_tokens_under_load():
+    """Test that an Initial with a forged token gets a Retry, without a connection or a charge to its address"""
+    class Transport:
+        def __init__(self):
+            self.sent = []
+
+        def sendto(self, data, addr):
+            self.sent.append((data, addr))
+
+    async def scenario():
+        server_config, client_config = quic_configurations()
+        admission = HandshakeAdmission(max_handshakes=10, retry_threshold=2)
+        server = ChatQuicServer(admission=admission, configuration=server_config,
+                                create_protocol=lambda connection, **kwargs: None)
+        server._transport = transport = Transport()
+        for _ in range(2):
+            admission.started(object(), asyncio.get_running_loop().time())
+
+        spoofed = ("10.0.0.9", 4433)
+        client = QuicConnection(configuration=client_config)
+        client._peer_token = b"forged" * 8
+        client.connect(("10.0.0.1", 4433), time.time())
+        for data, _addr in client.datagrams_to_send(time.time()):
+            server.datagram_received(data, spoofed)
+        assert len(transport.sent) == 1 and transport.sent[0][1] == spoofed
+        header = pull_quic_header(Buffer(data=transport.sent[0][0]), host_cid_length=8)
+        assert header.packet_type == PACKET_TYPE_RETRY
+        assert admission.tokens.validate_token(spoofed, header.token)
+        assert server._protocols == {} and admission.in_flight == 2
+        assert admission.invalid_tokens == 1 and "10.0.0.9" not in admission._sources
+
+    asyncio.run(scenario())
+
+def test_offline_mailbox_caps_spill_and_ttl(tmp_path):
+    """Test per-user and memory caps, spilling to disk, expiry and the index in ServerStateManager"""
+    async def scenario():
+        ssm = ServerStateManager()
+        mailbox = OfflineMailbox(ssm, max_per_user=3, max_bytes=200, ttl=100.0,
+                                 spill_dir=str(tmp_path / "mail"), sweep_interval=0)
+        assert [mailbox.put("bob", f"[Private] alice: hi {i}", now=0.0) for i in range(4)] == [True, True, True, False]
+        assert ssm.pending_mail("bob") == 3
+        # Over the memory cap, bob's mailbox is spilled to make room for carol's
+        assert mailbox.put("carol", "[Private] alice: " + "x" * 100, now=50.0)
+        assert mailbox.disk_bytes > 0 and mailbox.memory_bytes <= 200
+        await mailbox.flush()
+        assert len(list((tmp_path / "mail").iterdir())) == 1
+
+        assert await mailbox.take("bob", now=60.0) == [(0.0, f"[Private] alice: hi {i}") for i in range(3)]
+        assert ssm.pending_mail("bob") == 0 and mailbox.disk_bytes == 0
+        assert list((tmp_path / "mail").iterdir()) == []
+
+        assert mailbox.sweep(now=200.0) == 1  # Carol's message expired
+        assert ssm.pending_mail("carol") == 0 and await mailbox.take("carol") == []
+
+        # Spilled mail expires in the executor; appends and rewrites of one file keep their order
+        mailbox = OfflineMailbox(ssm, ttl=100.0, spill_dir=str(tmp_path / "mail"), sweep_interval=0)
+        for sent_at in (300.0, 400.0, 500.0):
+            mailbox.put("dave", f"[Private] alice: {sent_at}", now=sent_at)
+            mailbox._spill("dave", mailbox._boxes["dave"])
+        assert mailbox.sweep(now=450.0) == 0
+        mailbox.put("dave", "[Private] alice: late", now=460.0)
+        mailbox._spill("dave", mailbox._boxes["dave"])
+        await mailbox.flush()
+        assert mailbox.expired == 1 and ssm.pending_mail("dave") == 3
+        assert [sent_at for sent_at, _ in await mailbox.take("dave", now=470.0)] == [400.0, 500.0, 460.0]
+        assert mailbox.disk_bytes == 0 and mailbox.memory_bytes == 0
+
+        # A spill that fails while the mail is being taken hands it to take() rather than losing it
+        mailbox = OfflineMailbox(ssm, ttl=100.0, spill_dir=str(tmp_path / "gone"), sweep_interval=0)
+        (tmp_path / "gone").rmdir()
+        for sent_at in (600.0, 610.0):
+            mailbox.put("erin", f"[Private] alice: {sent_at}", now=sent_at)
+        mailbox._spill("erin", mailbox._boxes["erin"])
+        mailbox.put("erin", "[Private] alice: 620.0", now=620.0)
+        assert [sent_at for sent_at, _ in await mailbox.take("erin", now=630.0)] == [600.0, 610.0, 620.0]
+        assert mailbox.disk_bytes == 0 and mailbox.memory_bytes == 0 and mailbox.delivered == 3
+
+        unspilled = OfflineMailbox(ServerStateManager(), max_bytes=100, sweep_interval=0)
+        assert not unspilled.put("bob", "[Private] alice: " + "x" * 100)
+        assert unspilled.refused == 1
+
+    asyncio.run(scenario())
+
+def test_federation_nodes_on_localhost():
+    """Test ring placement, presence gossip, cross-node delivery and offline mail between three nodes"""
+    ring = HashRing([0, 1, 2])
+    names = [f"user{i}" for i in range(3000)]
+    placed = {name: ring.node_for(name) for name in names}
+    reordered = HashRing([2, 0, 1])
+    assert placed == {name: reordered.node_for(name) for name in names}
+    assert all(700 < list(placed.values()).count(node) < 1300 for node in range(3))
+    ring.add(3)
+    moved = [name for name in names if ring.node_for(name) != placed[name]]
+    assert all(ring.node_for(name) == 3 for name in moved) and 450 < len(moved) < 1050
+
+    async def until(condition, tries=200):
+        for _ in range(tries):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("Federation did not converge")
+
+    async def scenario():
+        states = [ServerStateManager() for _ in range(3)]
+        mailboxes = [OfflineMailbox(state, sweep_interval=0) for state in states]
+        secret = b"federation-test-secret-0123456789"
+        nodes = [Federation(i, ("127.0.0.1", 0), {}, states[i], mailbox=mailboxes[i], gossip_interval=0,
+                            secret=secret) for i in range(3)]
+        ports = [await node.listen() for node in nodes]
+        for node in nodes:
+            for peer in range(3):
+                if peer != node.node_id:
+                    node.add_peer(peer, "127.0.0.1", ports[peer])
+        try:
+            await until(lambda: all(link.up for node in nodes for link in node.links.values()))
+            bob, carol = MockConnection("bob"), MockConnection("carol")
+            states[1].add_client("bob", bob)
+            nodes[1].publish_presence("bob", True)
+            states[2].add_client("carol", carol)
+            nodes[2].publish_presence("carol", True)
+            await until(lambda: states[0].get_client_worker("bob") == 1 and states[0].get_client_worker("carol") == 2)
+            assert states[2].get_client_worker("bob") == 1
+
+            nodes[0].send_private(1, "bob", {"t": int(MsgType.CHAT), "body": "[Private] alice: hi"})
+            nodes[0].publish_message({"t": int(MsgType.CHAT), "body": "alice: hello"}, exclude="alice")
+            await until(lambda: len(bob.frames) == 2 and len(carol.frames) == 1)
+            assert [unpack(f)["body"] for f in bob.frames] == ["[Private] alice: hi", "alice: hello"]
+
+            # Mail for an offline user waits on the user's home node and follows them to the node they log in to
+            dave = next(name for name in (f"dave{i}" for i in range(100)) if nodes[0].ring.node_for(name) == 2)
+            assert nodes[0].mail_home(dave) == 2 and nodes[2].mail_home(dave) is None
+            nodes[0].send_mail(2, dave, f"[Private] alice: see you, {dave}")
+            await until(lambda: states[2].pending_mail(dave) == 1)
+            connection = MockConnection(dave)
+            states[1].add_client(dave, connection)
+            nodes[1].publish_presence(dave, True)
+            await until(lambda: len(connection.frames) == 2)
+            assert unpack(connection.frames[1])["body"] == f"[Private] alice: see you, {dave}"
+            assert states[2].pending_mail(dave) == 0
+
+            # A node that missed deltas catches up from a peer's snapshot
+            states[1].remove_client("bob")
+            nodes[1].publish_presence("bob", False)
+            await until(lambda: states[0].get_client_worker("bob") is None)
+            nodes[0].views[1] = (nodes[0].views[1][0], 0)
+            nodes[0].gossip_interval = 60
+            nodes[0].gossip()
+            await until(lambda: nodes[0].views[1] == (nodes[1].incarnation, nodes[1].version))
+            assert states[0].get_client_worker(dave) == 1 and states[0].get_client_worker("bob") is None
+
+            # A host without the secret is refused, and a linked one cannot slip in a frame without its MAC
+            async def intrude(secret, frame):
+                reader, writer = await asyncio.open_connection("127.0.0.1", ports[0])
+                challenge = await reader.readexactly(16)
+                nonce = b"n" * 16
+                proof = _proof(secret, b"hello", challenge, nonce, 1, 0)
+                writer.write(_FRAME.pack(_HELLO.size, FED_HELLO) + _HELLO.pack(1, nonce, proof) + frame)
+                closed = await reader.read()
+                writer.close()
+                return closed
+            name = "mallory".encode()
+            forged = _FRAME.pack(2 + len(name) + 5, FED_MAIL) + struct.pack("!H", len(name)) + name + b"hello"
+            assert await intrude(b"x" * 32, forged) == b"" and nodes[0].rejected == 1
+            assert len(await intrude(secret, forged + b"\0" * 16)) == 32  # Welcomed, then cut off
+            assert states[0].pending_mail("mallory") == 0
+
+            # A message missing its user comes home once and stays, even if home still lists them elsewhere
+            erin = next(name for name in (f"erin{i}" for i in range(100)) if nodes[0].ring.node_for(name) == 0)
+            states[0].add_remote_client(erin, 1)
+            nodes[0].send_private(1, erin, {"t": int(MsgType.CHAT), "body": f"[Private] alice: hi {erin}"})
+            await until(lambda: states[0].pending_mail(erin) == 1)
+            await asyncio.sleep(0.05)
+            assert states[0].pending_mail(erin) == 1 and states[0].get_client_worker(erin) is None
+
+            # The users of a node whose link drops stop being routed to
+            nodes[2].close()
+            await until(lambda: states[0].get_client_worker("carol") is None)
+
+            # Once it restarts, the others relink and learn its users again
+            states[2] = ServerStateManager()
+            nodes[2] = Federation(2, ("127.0.0.1", ports[2]), {}, states[2], gossip_interval=0, secret=secret)
+            await nodes[2].listen()
+            for peer in range(2):
+                nodes[2].add_peer(peer, "127.0.0.1", ports[peer])
+            states[2].add_client("carol", carol)
+            nodes[2].publish_presence("carol", True)
+            await until(lambda: all(node.links[2].up for node in nodes[:2]), tries=800)
+            await until(lambda: states[0].get_client_worker("carol") == 2 and states[1].get_client_worker("carol") == 2)
+        finally:
+            for node in nodes:
+                node.close()
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+
+def test_message_tracer_samples_and_dumps(tmp_path):
+    assert MessageTracer.from_config({"trace_sample_rate": 0.0}) is None
+    tracer = MessageTracer.from_config({"trace_sample_rate": 1.0, "trace_path": str(tmp_path / "traces.jsonl"),
+                                        "trace_buffer_size": 3}, worker_id=2)
+    assert tracer.path.endswith("traces.jsonl.2")
+    with pytest.raises(ValueError):
+        MessageTracer(1.5)
+
+    # A chat message from alice, copied to bob and carol; carol's copy is held back
+    bob, carol = MockConnection("bob"), MockConnection("carol")
+    bob.traced_frames = carol.traced_frames = None
+    trace = tracer.begin(0)
+    trace.user, trace.kind = "alice", int(MsgType.CHAT)
+    trace.mark("decoded", 1000)
+    tracer.current = trace
+    tracer.queued(bob, held=False)
+    tracer.queued(carol, held=True)
+    tracer.current = None
+    trace.mark("handled", 3000)
+    tracer.transmitted(bob.traced_frames)
+
+    # The ring buffer keeps the latest traces; unsettled ones wait for a later dump
+    for _ in range(5):
+        tracer.begin(time.perf_counter_ns())
+    assert tracer.sampled == 6 and tracer.dump() == 0
+    assert tracer.dump(everything=True) == 3 and tracer.written == 3
+    tracer.begin(time.perf_counter_ns())
+    tracer.close()
+    assert [t["id"] for t in read_traces([tracer.path])][-1].endswith("-7")
+
+    # Only the kept traces are summarized: the chat message fell out of the buffer
+    rare = MessageTracer(0.01)
+    assert sum(rare.begin(0) is not None for _ in range(10000)) < 300
+    tracer = MessageTracer(1.0, path=str(tmp_path / "chat.jsonl"))
+    tracer._buffer.append(trace)
+    tracer.dump(everything=True)
+    [dumped] = read_traces([tracer.path])
+    assert dumped["type"] == "chat" and [stage for stage, _ in dumped["stages"]] == ["receive", "decoded", "handled"]
+    assert [(copy["user"], copy["held"], copy["sent"] is None) for copy in dumped["recipients"]] == \
+        [("bob", False, False), ("carol", True, True)]
+    spans = summarize([dumped], kind="chat")
+    assert spans["receive -> decoded"] == [1.0] and spans["decoded -> handled"] == [2.0]
+    assert len(spans["copy queued -> transmitted"]) == 1 and summarize([dumped], kind="auth_req") == {}
\ No newline at end of file